@@ -1,6 +1,7 @@
 from datetime import timedelta
 import pendulum
 from airflow import DAG
+from airflow.decorators import task
 from airflow.operators.bash import BashOperator
 
 DEFAULT_ARGS = {
@@ -17,6 +18,68 @@ SNAPSHOT_DATE = "{{ macros.ds_add(ds, 1) }}"
 # ✅ Un identifiant unique par run (utile si tu relances)
 RUN_ID = "{{ ts_nodash }}"
 
+# Nombre de pages /movie/popular (20 films/page, 0 = toutes)
+TMDB_PAGES = 25
+
+# Rétention de la zone raw JSON en jours (0 = illimitée)
+RAW_RETENTION_DAYS = 90
+
+# Shards par movie_id pour l'ingestion et le chargement (dynamic task mapping, LocalExecutor)
+NB_SHARDS = 4
+
+# Débits API globaux, répartis entre les shards parallèles
+TMDB_RATE_LIMIT = 20
+OMDB_RATE_LIMIT = 10
+
+SCRIPTS_DIR = f"{AIRFLOW_DIR}/scripts"
+
+# Configuration passée explicitement aux scripts (mêmes clés que leurs variables d'environnement)
+# METRICS_DIR commun : un seul rapport de métriques par run, quel que soit l'OUTPUT_DIR de l'étape
+RUN_CONFIG = {
+    "SNAPSHOT_DATE": SNAPSHOT_DATE,
+    "RUN_ID": RUN_ID,
+    "METRICS_DIR": f"{AIRFLOW_DIR}/datalake/_metrics",
+}
+RAW_CONFIG = {
+    **RUN_CONFIG,
+    "OUTPUT_DIR": f"{AIRFLOW_DIR}/datalake/raw",
+}
+POSTGRES_CONFIG = {
+    **RUN_CONFIG,
+    "POSTGRES_HOST": "postgres",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "POSTGRES_DB": "datalake",
+}
+DATALAKE_CONFIG = {
+    **RUN_CONFIG,
+    "OUTPUT_DIR": f"{AIRFLOW_DIR}/datalake",
+}
+
+
+def shard_configs(config: dict) -> list[dict]:
+    return [{**config, "SHARD_INDEX": str(i), "SHARD_COUNT": str(NB_SHARDS)} for i in range(NB_SHARDS)]
+
+
+@task
+def run_script(script: str, config: dict):
+    """
+    Exécute scripts/<script>.py dans le processus de la tâche (run(config) du module)
+    Imports faits ici et non au parsing du DAG : le scheduler ne charge ni pandas ni pyarrow.
+    """
+    import sys
+
+    directory, name = script.rsplit("/", 1)
+    for path in (SCRIPTS_DIR, f"{SCRIPTS_DIR}/{directory}"):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+    from common.task_runner import run_module
+
+    run_module(name, config)
+
+
 PARIS = pendulum.timezone("Europe/Paris")
 
 with DAG(
@@ -27,42 +90,50 @@ with DAG(
     default_args=DEFAULT_ARGS,
 ) as dag:
 
-    fetch_tmdb = BashOperator(
-        task_id="fetch_tmdb",
-        bash_command=f"""
-            set -e
-            export SNAPSHOT_DATE="{SNAPSHOT_DATE}"
-            export RUN_ID="{RUN_ID}"
-            export OUTPUT_DIR="{AIRFLOW_DIR}/datalake/raw"
-            python "{AIRFLOW_DIR}/scripts/ingest/fetch_tmdb.py"
-        """,
+    # classement popular une seule fois, puis détails par shard
+    fetch_tmdb_popular = run_script.override(task_id="fetch_tmdb_popular")(
+        script="ingest/fetch_tmdb",
+        config={**RAW_CONFIG, "TMDB_PAGES": str(TMDB_PAGES), "TMDB_STAGE": "popular"},
     )
 
-    fetch_omdb = BashOperator(
-        task_id="fetch_omdb",
-        bash_command=f"""
-            set -e
-            export SNAPSHOT_DATE="{SNAPSHOT_DATE}"
-            export RUN_ID="{RUN_ID}"
-            export OUTPUT_DIR="{AIRFLOW_DIR}/datalake/raw"
-            python "{AIRFLOW_DIR}/scripts/ingest/fetch_omdb.py"
-        """,
+    fetch_tmdb_details = run_script.override(task_id="fetch_tmdb_details").partial(
+        script="ingest/fetch_tmdb",
+    ).expand(
+        config=shard_configs({**RAW_CONFIG, "TMDB_STAGE": "details", "TMDB_RATE_LIMIT": f"{TMDB_RATE_LIMIT / NB_SHARDS:g}"}),
     )
 
-    load_db = BashOperator(
-        task_id="load_postgres",
-        bash_command=f"""
-            set -e
-            export SNAPSHOT_DATE="{SNAPSHOT_DATE}"
-            export RUN_ID="{RUN_ID}"
-            export DATA_DIR="{AIRFLOW_DIR}/datalake/raw"
-            export POSTGRES_HOST=postgres
-            export POSTGRES_PORT=5432
-            export POSTGRES_USER=postgres
-            export POSTGRES_PASSWORD=postgres
-            export POSTGRES_DB=datalake
-            python "{AIRFLOW_DIR}/scripts/load/load_raw_to_postgres.py"
-        """,
+    fetch_omdb = run_script.override(task_id="fetch_omdb").partial(
+        script="ingest/fetch_omdb",
+    ).expand(
+        config=shard_configs({**RAW_CONFIG, "OMDB_RATE_LIMIT": f"{OMDB_RATE_LIMIT / NB_SHARDS:g}"}),
+    )
+
+    # schéma, partitions, rétention et popular avant les shards (pas de DDL concurrent)
+    prepare_db = run_script.override(task_id="prepare_postgres")(
+        script="load/load_raw_to_postgres",
+        config={**POSTGRES_CONFIG, "DATA_DIR": f"{AIRFLOW_DIR}/datalake/raw", "LOAD_STAGE": "prepare"},
+    )
+
+    load_db = run_script.override(task_id="load_postgres").partial(
+        script="load/load_raw_to_postgres",
+    ).expand(
+        config=shard_configs({
+            **POSTGRES_CONFIG,
+            "DATA_DIR": f"{AIRFLOW_DIR}/datalake/raw",
+            "LOAD_STAGE": "shard",
+            # pas de pool de processus dans la tâche in-process : le parallélisme vient des shards
+            "LOAD_WORKERS": "1",
+        }),
+    )
+
+    # reduce : tous les shards doivent avoir terminé avant dbt
+    merge_manifests = run_script.override(task_id="merge_shard_manifests")(
+        script="load/merge_shard_manifests",
+        config={
+            **RUN_CONFIG,
+            "DATA_DIR": f"{AIRFLOW_DIR}/datalake/raw",
+            "SHARD_COUNT": str(NB_SHARDS),
+        },
     )
 
     dbt_run = BashOperator(
@@ -70,36 +141,30 @@ with DAG(
         bash_command=f"""
             set -e
             cd "{AIRFLOW_DIR}/movies_analytics"
-            dbt run
+            dbt run --vars '{{"snapshot_date": "{SNAPSHOT_DATE}"}}'
         """,
     )
 
-    export_parquet = BashOperator(
-        task_id="export_parquet",
-        bash_command=f"""
-            set -e
-            export SNAPSHOT_DATE="{SNAPSHOT_DATE}"
-            export RUN_ID="{RUN_ID}"
-            export OUTPUT_DIR="{AIRFLOW_DIR}/datalake"
-            export POSTGRES_HOST=postgres
-            export POSTGRES_PORT=5432
-            export POSTGRES_USER=postgres
-            export POSTGRES_PASSWORD=postgres
-            export POSTGRES_DB=datalake
-            python "{AIRFLOW_DIR}/scripts/export/export_to_parquet.py"
-        """,
+    # une seule tâche pour les deux couches : toutes les tables lues dans le même
+    # snapshot PostgreSQL (pg_export_snapshot), formatted et usage restent cohérents
+    export_parquet = run_script.override(task_id="export_parquet")(
+        script="export/export_to_parquet",
+        config={**POSTGRES_CONFIG, "OUTPUT_DIR": f"{AIRFLOW_DIR}/datalake", "EXPORT_LAYERS": "formatted,usage"},
     )
 
-    index_es = BashOperator(
-        task_id="index_elasticsearch",
-        bash_command=f"""
-            set -e
-            export SNAPSHOT_DATE="{SNAPSHOT_DATE}"
-            export RUN_ID="{RUN_ID}"
-            export ES_HOST=http://elasticsearch:9200
-            export OUTPUT_DIR="{AIRFLOW_DIR}/datalake"
-            python "{AIRFLOW_DIR}/scripts/index/index_elasticsearch.py"
-        """,
+    index_es = {
+        target: run_script.override(task_id=f"index_elasticsearch_{target}")(
+            script="index/index_elasticsearch",
+            config={**DATALAKE_CONFIG, "ES_HOST": "http://elasticsearch:9200", "ES_TARGETS": target},
+        )
+        for target in ("movies", "kpis")
+    }
+
+    compact_datalake = run_script.override(task_id="compact_datalake")(
+        script="maintenance/compact_datalake",
+        config={**DATALAKE_CONFIG, "RAW_RETENTION_DAYS": str(RAW_RETENTION_DAYS)},
     )
 
-    fetch_tmdb >> fetch_omdb >> load_db >> dbt_run >> export_parquet >> index_es
+    fetch_tmdb_popular >> fetch_tmdb_details >> fetch_omdb >> prepare_db >> load_db >> merge_manifests >> dbt_run
+    dbt_run >> export_parquet >> [index_es["movies"], index_es["kpis"]]
+    [index_es["movies"], index_es["kpis"]] >> compact_datalake
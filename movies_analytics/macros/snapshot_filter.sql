@@ -0,0 +1,20 @@
+{#
+    Filtre incrémental sur snapshot_date.
+    - run incrémental avec --vars '{"snapshot_date": "YYYY-MM-DD"}' : uniquement ce jour
+    - run incrémental avec --vars '{"date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD"}' : la plage (backfill)
+    - run incrémental sans variable : jours >= dernier snapshot déjà présent
+    - premier run / --full-refresh : aucun filtre (reconstruction complète)
+#}
+{% macro snapshot_filter(column='snapshot_date') %}
+    {%- if is_incremental() -%}
+        {%- if var('date_from', none) -%}
+            where {{ column }} between '{{ var("date_from") }}'::date and '{{ var("date_to", var("date_from")) }}'::date
+        {%- elif var('snapshot_date', none) -%}
+            where {{ column }} = '{{ var("snapshot_date") }}'::date
+        {%- else -%}
+            where {{ column }} >= (
+                select coalesce(max({{ column }}), '1900-01-01'::date) from {{ this }}
+            )
+        {%- endif -%}
+    {%- endif -%}
+{% endmacro %}
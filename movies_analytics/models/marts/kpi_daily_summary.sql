@@ -1,5 +1,8 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='snapshot_date',
+    indexes=[{'columns': ['snapshot_date'], 'unique': True}],
     schema='marts',
     tags=['marts', 'kpi']
 ) }}
@@ -14,6 +17,7 @@ with base as (
         is_overhyped,
         is_hidden_gem
     from {{ ref('movies_enriched_daily') }}
+    {{ snapshot_filter() }}
 )
 
 select snapshot_date,
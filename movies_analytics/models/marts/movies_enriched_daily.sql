@@ -1,5 +1,11 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['snapshot_date', 'tmdb_id'],
+    indexes=[
+        {'columns': ['snapshot_date', 'tmdb_id']},
+        {'columns': ['snapshot_date', 'imdb_id']}
+    ],
     schema='marts',
     tags=['marts', 'movies']
 ) }}
@@ -17,6 +23,7 @@ with pop as (
         original_language,
         genre_ids_json
     from {{ ref('stg_tmdb_popular') }}
+    {{ snapshot_filter() }}
 ),
 
 det as (
@@ -29,6 +36,7 @@ det as (
         genres_json,
         production_countries_json
     from {{ ref('stg_tmdb_details') }}
+    {{ snapshot_filter() }}
 ),
 
 tmdb as (
@@ -69,6 +77,7 @@ omdb as (
         actors,
         ratings_json
     from {{ ref('stg_omdb_ratings') }}
+    {{ snapshot_filter() }}
 ),
 
 joined as (
@@ -1,5 +1,8 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['snapshot_date', 'imdb_id'],
+    indexes=[{'columns': ['snapshot_date', 'imdb_id']}],
     schema='staging',
     tags=['staging', 'omdb']
 ) }}
@@ -12,6 +15,7 @@ with src as (
         title,
         payload
     from {{ source('raw', 'raw_omdb_ratings') }}
+    {{ snapshot_filter() }}
 ),
 
 clean as (
@@ -1,5 +1,11 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['snapshot_date', 'tmdb_id'],
+    indexes=[
+        {'columns': ['snapshot_date', 'tmdb_id']},
+        {'columns': ['snapshot_date', 'imdb_id']}
+    ],
     schema='staging',
     tags=['staging', 'tmdb']
 ) }}
@@ -13,6 +19,7 @@ with src as (
         title,
         payload
     from {{ source('raw', 'raw_tmdb_details') }}
+    {{ snapshot_filter() }}
 ),
 
 clean as (
@@ -1,5 +1,8 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key=['snapshot_date', 'tmdb_id'],
+    indexes=[{'columns': ['snapshot_date', 'tmdb_id']}],
     schema='staging',
     tags=['staging', 'tmdb']
 ) }}
@@ -12,6 +15,7 @@ with src as (
         title,
         payload
     from {{ source('raw', 'raw_tmdb_popular') }}
+    {{ snapshot_filter() }}
 ),
 
 clean as (
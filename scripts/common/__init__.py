@@ -0,0 +1,3 @@
+"""
+Modules partagés par les scripts du pipeline
+"""
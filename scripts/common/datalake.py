@@ -0,0 +1,135 @@
+"""
+Lecture du datalake (formatted / usage) avec pyarrow.dataset
+
+- partitionnement Hive (snapshot_date=YYYY-MM-DD/, snapshot_month=YYYY-MM/)
+- scans par plage de dates : partitions élaguées sans ouvrir les fichiers
+- projection de colonnes, filtres poussés au niveau des row groups
+- lecture par lots (iter_batches) pour les gros volumes
+- cache LRU en mémoire des métadonnées de datasets
+- un jour présent à la fois en partition quotidienne (réexport, backfill) et dans le fichier
+  mensuel compacté est lu depuis la partition quotidienne uniquement (comme à la compaction)
+"""
+
+import os
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+DATALAKE_PATH = Path(os.getenv('OUTPUT_DIR', '/opt/airflow/datalake'))
+DATALAKE_CACHE_SIZE = int(os.getenv('DATALAKE_CACHE_SIZE', '32'))
+
+LAYERS = ('formatted', 'usage')
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('snapshot_date', pa.date32()), ('snapshot_month', pa.string())]),
+    flavor='hive',
+)
+
+
+def _as_date(value) -> date | None:
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value))
+
+
+def _table_version(path: Path) -> int:
+    """mtime max du dossier table et de ses partitions (invalide le cache après un export)"""
+    latest = path.stat().st_mtime_ns
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                latest = max(latest, entry.stat().st_mtime_ns)
+    return latest
+
+
+@lru_cache(maxsize=DATALAKE_CACHE_SIZE)
+def _open_dataset(path: str, version: int) -> ds.Dataset:
+    # fichiers cachés (.tmp d'écriture en cours) ignorés par défaut
+    return ds.dataset(path, format='parquet', partitioning=PARTITIONING)
+
+
+class Datalake:
+    """Accès en lecture aux tables du datalake"""
+
+    def __init__(self, root: Path | str | None = None):
+        self.root = Path(root) if root is not None else DATALAKE_PATH
+
+    def table_path(self, layer: str, table: str) -> Path:
+        if layer not in LAYERS:
+            raise ValueError(f"Couche inconnue: {layer} (attendu: {', '.join(LAYERS)})")
+        return self.root / layer / table
+
+    def dataset(self, layer: str, table: str) -> ds.Dataset:
+        path = self.table_path(layer, table)
+        if not path.exists():
+            raise FileNotFoundError(f"Table introuvable: {path}")
+        return _open_dataset(str(path), _table_version(path))
+
+    def partitions(self, layer: str, table: str) -> list[str]:
+        """Partitions présentes (snapshot_date=... ou snapshot_month=...), triées"""
+        path = self.table_path(layer, table)
+        if not path.exists():
+            return []
+        return sorted(p.name for p in path.iterdir() if p.is_dir() and '=' in p.name)
+
+    def shadowed_days(self, layer: str, table: str) -> list[date]:
+        """Jours réexportés en partition quotidienne alors que leur mois est déjà compacté"""
+        names = self.partitions(layer, table)
+        months = {n.split('=', 1)[1] for n in names if n.startswith('snapshot_month=')}
+        days = [n.split('=', 1)[1] for n in names if n.startswith('snapshot_date=')]
+        return [date.fromisoformat(d) for d in days if d[:7] in months]
+
+    @staticmethod
+    def date_filter(date_from=None, date_to=None) -> ds.Expression | None:
+        date_from, date_to = _as_date(date_from), _as_date(date_to)
+        expr = None
+        if date_from is not None:
+            expr = ds.field('snapshot_date') >= pa.scalar(date_from, pa.date32())
+        if date_to is not None:
+            upper = ds.field('snapshot_date') <= pa.scalar(date_to, pa.date32())
+            expr = upper if expr is None else expr & upper
+        return expr
+
+    def scanner(
+        self,
+        layer: str,
+        table: str,
+        date_from=None,
+        date_to=None,
+        columns: list[str] | None = None,
+        filter: ds.Expression | None = None,
+        batch_size: int = 64 * 1024,
+    ) -> ds.Scanner:
+        dataset = self.dataset(layer, table)
+        if columns is None:
+            # clés de partition purement techniques (compaction mensuelle) non exposées
+            columns = [name for name in dataset.schema.names if name != 'snapshot_month']
+        expr = self.date_filter(date_from, date_to)
+        shadowed = self.shadowed_days(layer, table)
+        if shadowed:
+            # la partition quotidienne fait foi : ces jours sont ignorés dans le fichier mensuel
+            daily = ds.field('snapshot_month').is_null() | ~ds.field('snapshot_date').isin(
+                pa.array(shadowed, pa.date32())
+            )
+            expr = daily if expr is None else expr & daily
+        if filter is not None:
+            expr = filter if expr is None else expr & filter
+        return dataset.scanner(columns=columns, filter=expr, batch_size=batch_size)
+
+    def read_table(self, layer: str, table: str, **kwargs) -> pa.Table:
+        return self.scanner(layer, table, **kwargs).to_table()
+
+    def read_pandas(self, layer: str, table: str, **kwargs):
+        return self.read_table(layer, table, **kwargs).to_pandas()
+
+    def iter_batches(self, layer: str, table: str, **kwargs):
+        """RecordBatch par RecordBatch (mémoire bornée par batch_size)"""
+        yield from self.scanner(layer, table, **kwargs).to_batches()
+
+    @staticmethod
+    def clear_cache() -> None:
+        _open_dataset.cache_clear()
@@ -0,0 +1,55 @@
+"""
+Briques HTTP communes aux extracteurs (TMDB, OMDb) et à l'indexation Elasticsearch
+
+- TokenBucket : limiteur de débit partagé entre threads
+- make_session : requests.Session avec pool de connexions (keep-alive)
+- backoff_delay : backoff exponentiel avec jitter (respecte Retry-After, ex. 429)
+"""
+
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenBucket:
+    """Limiteur de débit (token bucket) partagé entre threads"""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """Session HTTP unique avec pool de connexions (keep-alive)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def backoff_delay(attempt: int, retry_after: str | None = None) -> float:
+    """Backoff exponentiel avec jitter (respecte Retry-After si fourni)"""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
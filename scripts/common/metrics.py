@@ -0,0 +1,334 @@
+"""
+Instrumentation du pipeline : spans chronométrés, compteurs (lignes, octets...) et pic de RSS
+
+    from common import metrics
+
+    @metrics.instrumented('load_postgres')
+    def main(): ...
+
+    with metrics.span('db_upsert') as s:
+        ...
+        s.add(rows=n, bytes=len(text))
+
+- les spans sont agrégés par nom (appels, durée totale / max, compteurs additionnés) :
+  un span par requête HTTP ne fait pas grossir le rapport
+- mémoire par span : RSS courant (/proc/self/statm) lu au début et à la fin de chaque appel →
+  rss_mb (RSS max en fin d'appel) et rss_delta_mb (plus forte croissance pendant un appel,
+  mémoire encore occupée en fin d'appel : un pic libéré avant la fin n'y apparaît pas) ;
+  le pic de RSS du processus (ru_maxrss, depuis son démarrage) n'est donné qu'au niveau de l'étape
+- un rapport JSON par RUN_ID : METRICS_DIR/run_id=<RUN_ID>.json, une entrée par étape (et shard),
+  mise à jour sous verrou (les tâches du run écrivent dans le même fichier)
+- optionnel : table meta.pipeline_metrics (METRICS_POSTGRES=1) et index Elasticsearch
+  METRICS_ES_INDEX (METRICS_ES=1), une ligne / un document par span, pour suivre les tendances dans Kibana
+- run courant propre au contexte (contextvars) : deux runs instrumentés qui se chevauchent dans
+  un processus (backfill → export) ne mélangent pas leurs spans ; les pools de threads d'un run
+  passent par metrics.ThreadPoolExecutor pour que leurs tâches enregistrent dans ce run
+- un puits en échec est signalé mais ne fait jamais échouer la tâche
+"""
+
+import os
+import json
+import time
+import fcntl
+import resource
+import functools
+import threading
+import contextvars
+from concurrent import futures
+from typing import Callable
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+# par défaut à côté des données de l'étape (OUTPUT_DIR) ; le DAG fixe un dossier commun au run
+METRICS_DIR = Path(os.getenv('METRICS_DIR') or Path(os.getenv('OUTPUT_DIR', '/opt/airflow/datalake')) / '_metrics')
+METRICS_POSTGRES = os.getenv('METRICS_POSTGRES', '0') == '1'
+METRICS_ES = os.getenv('METRICS_ES', '0') == '1'
+METRICS_ES_INDEX = os.getenv('METRICS_ES_INDEX', 'pipeline_metrics')
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# run courant du contexte : un run imbriqué (backfill → export) a ses propres spans, le run
+# englobant est rétabli à sa sortie ; conservé quand task_runner recharge ce module
+if '_current_run' not in globals():
+    _current_run = contextvars.ContextVar('metrics_run', default=None)
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    """Pic de mémoire résidente depuis le début du processus (ru_maxrss : Ko sous Linux)"""
+    return round(resource.getrusage(who).ru_maxrss / 1024, 1)
+
+
+def rss_mb() -> float | None:
+    """Mémoire résidente actuelle du processus (None hors Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * PAGE_SIZE / (1024 * 1024), 1)
+
+
+class Run:
+    """Spans agrégés d'une étape"""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, counters: dict, rss_start: float | None = None) -> None:
+        """rss_start : RSS au début du span (None pour une durée mesurée dans un autre processus)"""
+        rss = rss_mb() if rss_start is not None else None
+        with self.lock:
+            s = self.spans.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+            s['calls'] += 1
+            s['seconds'] += seconds
+            s['max_seconds'] = max(s['max_seconds'], seconds)
+            if rss is not None:
+                s['rss_mb'] = max(s.get('rss_mb', 0.0), rss)
+                s['rss_delta_mb'] = round(max(s.get('rss_delta_mb', 0.0), rss - rss_start), 1)
+            for key, value in counters.items():
+                s[key] = s.get(key, 0) + value
+
+
+_default_run = Run('adhoc')
+
+
+def current() -> Run:
+    return _current_run.get() or _default_run
+
+
+class ThreadPoolExecutor(futures.ThreadPoolExecutor):
+    """Pool dont les tâches s'exécutent dans le contexte de l'appelant (spans dans son run)"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class Span:
+    """Compteurs d'un span en cours (s.add(rows=..., bytes=...))"""
+
+    def __init__(self, counters: dict):
+        self.counters = dict(counters)
+
+    def add(self, **counters) -> None:
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+@contextmanager
+def span(name: str, **counters):
+    """Chronomètre le bloc ; enregistré aussi si le bloc lève une exception"""
+    s = Span(counters)
+    rss_start = rss_mb()
+    started = time.perf_counter()
+    try:
+        yield s
+    finally:
+        current().record(name, time.perf_counter() - started, s.counters, rss_start)
+
+
+def record(name: str, seconds: float, **counters) -> None:
+    """Span mesuré ailleurs (ex. worker d'un pool de processus qui renvoie sa durée) : pas de RSS"""
+    current().record(name, seconds, counters)
+
+
+# --- rapport ------------------------------------------------------------------
+
+# champs d'un span agrégé qui ne sont pas des compteurs
+SPAN_FIELDS = ('calls', 'seconds', 'max_seconds', 'rss_mb', 'rss_delta_mb')
+
+def stage_key(stage: str) -> tuple[str, str]:
+    from common.shards import shard_label, sharded  # configuration du shard courant
+
+    shard = shard_label() if sharded() else ''
+    return (f'{stage}-{shard}' if shard else stage), shard
+
+
+def stage_entry(run: Run, status: str) -> dict:
+    key, shard = stage_key(run.stage)
+    spans = {
+        name: {**s, 'seconds': round(s['seconds'], 3), 'max_seconds': round(s['max_seconds'], 3)}
+        for name, s in sorted(run.spans.items())
+    }
+    return {
+        'key': key,
+        'stage': run.stage,
+        'shard': shard,
+        'status': status,
+        'started_at_utc': run.started_at.isoformat(),
+        'finished_at_utc': datetime.now(timezone.utc).isoformat(),
+        'seconds': spans.get('total', {}).get('seconds', 0.0),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_children_mb': peak_rss_mb(resource.RUSAGE_CHILDREN),
+        'spans': spans,
+    }
+
+
+def write_json_report(run_id: str, snapshot_date: str | None, entry: dict) -> Path:
+    """Fusionne l'entrée de l'étape dans le rapport du run (verrou fichier, écriture atomique)"""
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    path = METRICS_DIR / f'run_id={run_id}.json'
+    with open(METRICS_DIR / f'.run_id={run_id}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        report = json.loads(path.read_text(encoding='utf-8')) if path.exists() else {}
+        report.update(run_id=run_id, snapshot_date=snapshot_date, updated_at_utc=entry['finished_at_utc'])
+        report.setdefault('stages', {})[entry['key']] = entry
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp, path)
+    return path
+
+
+def span_rows(run_id: str, snapshot_date: str | None, entry: dict) -> list[dict]:
+    """Une ligne par span (format commun Postgres / Elasticsearch)"""
+    rows = []
+    for name, s in entry['spans'].items():
+        counters = {k: v for k, v in s.items() if k not in SPAN_FIELDS}
+        rows.append({
+            'run_id': run_id,
+            'snapshot_date': snapshot_date,
+            'stage': entry['stage'],
+            'shard': entry['shard'],
+            'span': name,
+            'status': entry['status'],
+            'calls': s['calls'],
+            'seconds': s['seconds'],
+            'max_seconds': s['max_seconds'],
+            'rows': counters.pop('rows', None),
+            'bytes': counters.pop('bytes', None),
+            'rss_mb': s.get('rss_mb'),
+            'rss_delta_mb': s.get('rss_delta_mb'),
+            'counters': counters,
+            'recorded_at': entry['finished_at_utc'],
+        })
+    return rows
+
+
+def write_postgres(rows: list[dict]) -> None:
+    import psycopg2
+    from psycopg2.extras import Json, execute_values
+
+    conn = psycopg2.connect(
+        host=os.getenv('POSTGRES_HOST', 'postgres'),
+        port=int(os.getenv('POSTGRES_PORT', '5432')),
+        dbname=os.getenv('POSTGRES_DB', 'datalake'),
+        user=os.getenv('POSTGRES_USER', 'postgres'),
+        password=os.getenv('POSTGRES_PASSWORD', 'postgres'),
+    )
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute('CREATE SCHEMA IF NOT EXISTS meta;')
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS meta.pipeline_metrics (
+                        run_id        TEXT NOT NULL,
+                        snapshot_date DATE,
+                        stage         TEXT NOT NULL,
+                        shard         TEXT NOT NULL DEFAULT '',
+                        span          TEXT NOT NULL,
+                        status        TEXT NOT NULL,
+                        calls         BIGINT NOT NULL,
+                        seconds       DOUBLE PRECISION NOT NULL,
+                        max_seconds   DOUBLE PRECISION NOT NULL,
+                        rows          BIGINT,
+                        bytes         BIGINT,
+                        rss_mb        DOUBLE PRECISION,
+                        rss_delta_mb  DOUBLE PRECISION,
+                        counters      JSONB,
+                        recorded_at   TIMESTAMPTZ NOT NULL,
+                        PRIMARY KEY (run_id, stage, shard, span)
+                    );
+                """)
+                columns = list(rows[0])
+                updated = [c for c in columns if c not in ('run_id', 'stage', 'shard', 'span')]
+                execute_values(cur, f"""
+                    INSERT INTO meta.pipeline_metrics ({', '.join(columns)})
+                    VALUES %s
+                    ON CONFLICT (run_id, stage, shard, span)
+                    DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in updated)};
+                """, [tuple(Json(v) if c == 'counters' else v for c, v in row.items()) for row in rows])
+    finally:
+        conn.close()
+
+
+def write_elasticsearch(rows: list[dict]) -> None:
+    import requests
+
+    host = os.getenv('ES_HOST', 'http://elasticsearch:9200').rstrip('/')
+    lines = []
+    for row in rows:
+        doc_id = f"{row['run_id']}|{row['stage']}|{row['shard']}|{row['span']}"
+        lines.append(json.dumps({'index': {'_index': METRICS_ES_INDEX, '_id': doc_id}}))
+        lines.append(json.dumps(row))
+    r = requests.post(
+        f'{host}/_bulk',
+        headers={'Content-Type': 'application/x-ndjson'},
+        data=('\n'.join(lines) + '\n').encode('utf-8'),
+        timeout=30,
+    )
+    r.raise_for_status()
+    if r.json().get('errors'):
+        raise RuntimeError(f"items en erreur dans {METRICS_ES_INDEX}")
+
+
+def print_summary(entry: dict) -> None:
+    print(f"⏱️  {entry['key']}: {entry['seconds']:.2f}s | pic RSS du processus {entry['peak_rss_mb']} Mo")
+    for name, s in sorted(entry['spans'].items(), key=lambda item: -item[1]['seconds']):
+        if name == 'total':
+            continue
+        counters = ', '.join(f'{k}={v}' for k, v in s.items() if k not in ('seconds', 'max_seconds'))
+        print(f"   {s['seconds']:8.2f}s  {name} ({counters})")
+
+
+def write_report(run: Run, status: str) -> None:
+    run_id = os.getenv('RUN_ID') or run.started_at.strftime('%Y%m%d%H%M%S')
+    snapshot_date = os.getenv('SNAPSHOT_DATE')
+    entry = stage_entry(run, status)
+    print_summary(entry)
+
+    sinks = [('rapport JSON', lambda: write_json_report(run_id, snapshot_date, entry))]
+    rows = span_rows(run_id, snapshot_date, entry)
+    if METRICS_POSTGRES and rows:
+        sinks.append(('meta.pipeline_metrics', lambda: write_postgres(rows)))
+    if METRICS_ES and rows:
+        sinks.append((f'index {METRICS_ES_INDEX}', lambda: write_elasticsearch(rows)))
+
+    for label, sink in sinks:
+        try:
+            sink()
+        except Exception as e:
+            print(f"⚠️  Métriques non écrites ({label}): {e}")
+
+
+def instrumented(stage: str | Callable[[], str]):
+    """Décorateur de main() : spans de l'étape, span 'total', rapport écrit même en cas d'échec
+
+    stage peut être une fonction, évaluée à l'appel (nom qui dépend de la config, ex. LOAD_STAGE)
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return fn(*args, **kwargs)
+
+            run = Run(stage() if callable(stage) else stage)
+            token = _current_run.set(run)
+            status = 'failed'
+            try:
+                with span('total'):
+                    result = fn(*args, **kwargs)
+                status = 'success'
+                return result
+            finally:
+                _current_run.reset(token)
+                write_report(run, status)
+
+        return wrapper
+
+    return decorate
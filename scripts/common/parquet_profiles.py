@@ -0,0 +1,203 @@
+"""
+Profils d'écriture Parquet : schémas Arrow explicites, tri, row groups, compression
+"""
+
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common import metrics
+
+
+# Colonnes JSON à structure connue (sinon : texte JSON)
+GENRES = pa.list_(pa.struct([('id', pa.int64()), ('name', pa.string())]))
+COUNTRIES = pa.list_(pa.struct([('iso_3166_1', pa.string()), ('name', pa.string())]))
+RATINGS = pa.list_(pa.struct([('Source', pa.string()), ('Value', pa.string())]))
+
+JSON_COLUMN_TYPES = {
+    'genre_ids_json': pa.list_(pa.int64()),
+    'genres_json': GENRES,
+    'production_countries_json': COUNTRIES,
+    'ratings_json': RATINGS,
+    'omdb_ratings_json': RATINGS,
+}
+
+# Colonnes à faible cardinalité → encodage dictionnaire
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+
+# Schéma Arrow explicite par table exportée (nom du dossier datalake)
+TABLE_SCHEMAS = {
+    'tmdb_popular': pa.schema([
+        ('snapshot_date', pa.date32()),
+        ('tmdb_id', pa.int64()),
+        ('title', pa.string()),
+        ('release_date', pa.date32()),
+        ('popularity', pa.float64()),
+        ('tmdb_rating', pa.float64()),
+        ('tmdb_vote_count', pa.int32()),
+        ('original_language', CATEGORY),
+        ('genre_ids_json', JSON_COLUMN_TYPES['genre_ids_json']),
+    ]),
+    'tmdb_details': pa.schema([
+        ('snapshot_date', pa.date32()),
+        ('tmdb_id', pa.int64()),
+        ('imdb_id', pa.string()),
+        ('title', pa.string()),
+        ('release_date', pa.date32()),
+        ('runtime_minutes', pa.int32()),
+        ('status', CATEGORY),
+        ('original_language', CATEGORY),
+        ('genres_json', GENRES),
+        ('production_countries_json', COUNTRIES),
+    ]),
+    'omdb_ratings': pa.schema([
+        ('snapshot_date', pa.date32()),
+        ('imdb_id', pa.string()),
+        ('title_omdb', pa.string()),
+        ('imdb_rating', pa.float64()),
+        ('imdb_votes', pa.int64()),
+        ('metascore', pa.int32()),
+        ('rated', CATEGORY),
+        ('type', CATEGORY),
+        ('year_text', pa.string()),
+        ('country', pa.string()),
+        ('genre', pa.string()),
+        ('director', pa.string()),
+        ('actors', pa.string()),
+        ('ratings_json', RATINGS),
+    ]),
+    'movies_enriched': pa.schema([
+        ('snapshot_date', pa.date32()),
+        ('tmdb_id', pa.int64()),
+        ('imdb_id', pa.string()),
+        ('title', pa.string()),
+        ('release_date', pa.date32()),
+        ('release_year', pa.int32()),
+        ('runtime_minutes', pa.int32()),
+        ('status', CATEGORY),
+        ('original_language', CATEGORY),
+        ('popularity', pa.float64()),
+        ('tmdb_rating', pa.float64()),
+        ('tmdb_vote_count', pa.int32()),
+        ('genres_json', GENRES),
+        ('production_countries_json', COUNTRIES),
+        ('imdb_rating', pa.float64()),
+        ('imdb_votes', pa.int64()),
+        ('metascore', pa.int32()),
+        ('rated', CATEGORY),
+        ('type', CATEGORY),
+        ('omdb_country', pa.string()),
+        ('omdb_genre', pa.string()),
+        ('director', pa.string()),
+        ('actors', pa.string()),
+        ('omdb_ratings_json', RATINGS),
+        ('missing_omdb_data', pa.bool_()),
+        ('composite_score', pa.float64()),
+        ('is_overhyped', pa.bool_()),
+        ('is_hidden_gem', pa.bool_()),
+    ]),
+    'kpi_daily': pa.schema([
+        ('snapshot_date', pa.date32()),
+        ('nb_movies', pa.int64()),
+        ('nb_movies_with_omdb', pa.int64()),
+        ('omdb_coverage_ratio', pa.float64()),
+        ('avg_tmdb_rating', pa.float64()),
+        ('avg_imdb_rating', pa.float64()),
+        ('avg_popularity', pa.float64()),
+        ('nb_overhyped', pa.int64()),
+        ('nb_hidden_gems', pa.int64()),
+    ]),
+}
+
+# Ordre de tri dans chaque fichier (min/max serrés → row groups éliminables)
+SORT_KEYS = {
+    'tmdb_popular': ['snapshot_date', 'tmdb_id'],
+    'tmdb_details': ['snapshot_date', 'tmdb_id'],
+    'omdb_ratings': ['snapshot_date', 'imdb_id'],
+    'movies_enriched': ['snapshot_date', 'tmdb_id'],
+    'kpi_daily': ['snapshot_date'],
+}
+
+
+PARQUET_PROFILES = {
+    # ancien comportement (to_parquet pandas)
+    'snappy': {
+        'compression': 'snappy',
+        'compression_level': None,
+        'row_group_size': 1024 * 1024,
+        'data_page_size': None,
+        'write_page_index': False,
+    },
+    # fichiers plus petits, statistiques de pages pour le predicate pushdown
+    'zstd': {
+        'compression': 'zstd',
+        'compression_level': 6,
+        'row_group_size': 128 * 1024,
+        'data_page_size': 1024 * 1024,
+        'write_page_index': True,
+    },
+}
+
+
+def get_profile(name: str | None = None) -> dict:
+    """Profil choisi (PARQUET_PROFILE) avec surcharges par variables d'environnement"""
+    profile = dict(PARQUET_PROFILES[name or os.getenv('PARQUET_PROFILE', 'zstd')])
+    if os.getenv('PARQUET_ROW_GROUP_SIZE'):
+        profile['row_group_size'] = int(os.getenv('PARQUET_ROW_GROUP_SIZE'))
+    if os.getenv('PARQUET_ZSTD_LEVEL') and profile['compression'] == 'zstd':
+        profile['compression_level'] = int(os.getenv('PARQUET_ZSTD_LEVEL'))
+    return profile
+
+
+def table_schema(name: str, derived: pa.Schema) -> pa.Schema:
+    """Schéma explicite de la table, aligné sur l'ordre des colonnes de la requête"""
+    explicit = TABLE_SCHEMAS.get(name)
+    if explicit is None:
+        return derived
+    return pa.schema([
+        explicit.field(f.name) if f.name in explicit.names else f
+        for f in derived
+    ])
+
+
+class BufferedParquetWriter:
+    """ParquetWriter qui accumule les lots jusqu'à row_group_size lignes (un row group par écriture)"""
+
+    def __init__(self, path, schema: pa.Schema, profile: dict):
+        sort_keys = [c for c in profile.get('sort_keys', []) if c in schema.names]
+        options = {
+            'compression': profile['compression'],
+            'write_statistics': True,
+            'write_page_index': profile['write_page_index'],
+            'sorting_columns': [pq.SortingColumn(schema.get_field_index(c)) for c in sort_keys] or None,
+        }
+        if profile['compression_level'] is not None:
+            options['compression_level'] = profile['compression_level']
+        if profile['data_page_size'] is not None:
+            options['data_page_size'] = profile['data_page_size']
+
+        self.path = path
+        self.writer = pq.ParquetWriter(path, schema, **options)
+        self.row_group_size = profile['row_group_size']
+        self.batches = []
+        self.rows = 0
+
+    def write_batch(self, batch: pa.RecordBatch) -> None:
+        self.batches.append(batch)
+        self.rows += batch.num_rows
+        if self.rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.batches:
+            with metrics.span('parquet_write', rows=self.rows):
+                self.writer.write_table(pa.Table.from_batches(self.batches), row_group_size=self.row_group_size)
+            self.batches = []
+            self.rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        with metrics.span('parquet_write', files=1) as s:
+            self.writer.close()  # footer
+            s.add(bytes=os.path.getsize(self.path))
@@ -0,0 +1,80 @@
+"""
+Lecture de la zone raw : un seul lecteur pour l'ingestion (fetch_omdb) et le chargement PostgreSQL
+
+- fichiers <clé>.json (ancien format, un enregistrement par fichier)
+- segments NDJSON part-*.ndjson(.gz|.zst) écrits par ingest/raw_segments.SegmentWriter
+- enregistrements { _meta, data } ou payload direct (ancien format)
+"""
+
+import io
+import gzip
+import json
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # optionnel (segments .ndjson.zst)
+    zstandard = None
+
+SEGMENT_PATTERNS = ('*.ndjson', '*.ndjson.gz', '*.ndjson.zst')
+
+
+def raw_files(directory: Path) -> list[Path]:
+    """Fichiers d'un dossier date=... : JSON (un par enregistrement) + segments NDJSON"""
+    directory = Path(directory)
+    files = sorted(directory.glob('*.json'))
+    for pattern in SEGMENT_PATTERNS:
+        files.extend(sorted(directory.glob(pattern)))
+    return files
+
+
+def open_segment(path: Path):
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.suffix == '.zst':
+        if zstandard is None:
+            raise RuntimeError(f"zstandard requis pour lire {path.name}")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    return path.open('r', encoding='utf-8')
+
+
+def unwrap(obj: dict) -> dict:
+    """Accepte ancien format (payload direct) ou nouveau format { _meta, data }"""
+    if isinstance(obj, dict) and 'data' in obj and '_meta' in obj:
+        return obj['data']
+    return obj
+
+
+def iter_raw_records(files: list[Path], loads=json.loads):
+    """Produit (clé, objet tel qu'écrit) : nom du fichier JSON, ou _meta.key d'une ligne de segment
+
+    loads : décodeur JSON (ex. orjson.loads côté chargement)
+    """
+    for path in files:
+        if path.suffix == '.json':
+            try:
+                yield path.stem, loads(path.read_bytes())
+            except Exception as e:
+                print(f"⚠️ Erreur lecture {path.name}: {e}")
+            continue
+
+        try:
+            with open_segment(path) as f:
+                for n, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        obj = loads(line)
+                    except ValueError as e:
+                        print(f"⚠️ Erreur lecture {path.name}:{n}: {e}")
+                        continue
+                    key = obj.get('_meta', {}).get('key') if isinstance(obj, dict) else None
+                    yield (str(key) if key is not None else f"{path.name}:{n}"), obj
+        except Exception as e:
+            print(f"⚠️ Erreur lecture {path.name}: {e}")
+
+
+def iter_records(directory: Path, loads=json.loads):
+    """Produit (clé, data) pour un dossier date=..., quel que soit le format"""
+    for key, obj in iter_raw_records(raw_files(directory), loads):
+        yield key, unwrap(obj)
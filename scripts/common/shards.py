@@ -0,0 +1,78 @@
+"""
+Découpage d'une étape en N shards par movie_id (Airflow dynamic task mapping)
+
+- SHARD_INDEX / SHARD_COUNT : shard courant (0 ≤ index < count), 1 shard = pas de découpage
+- in_shard(movie_id) : appartenance d'un film au shard courant
+- file_shard(path) : shard d'un fichier raw (segment -sKofN-, fichier <movie_id>.json, sinon hash du nom)
+- manifestes par shard, fusionnés par merge_shard_manifests.py avant dbt
+"""
+
+import os
+import re
+import json
+import zlib
+from pathlib import Path
+from datetime import datetime, timezone
+
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', '0'))
+SHARD_COUNT = max(1, int(os.getenv('SHARD_COUNT', '1')))
+
+if not 0 <= SHARD_INDEX < SHARD_COUNT:
+    raise RuntimeError(f"❌ SHARD_INDEX={SHARD_INDEX} hors de [0, {SHARD_COUNT})")
+
+SEGMENT_SHARD = re.compile(r'-s(\d+)of(\d+)-')
+
+
+def sharded() -> bool:
+    return SHARD_COUNT > 1
+
+
+def shard_label() -> str:
+    return f"s{SHARD_INDEX}of{SHARD_COUNT}"
+
+
+def shard_of(movie_id, count: int = SHARD_COUNT) -> int:
+    return int(movie_id) % count
+
+
+def in_shard(movie_id) -> bool:
+    return shard_of(movie_id) == SHARD_INDEX
+
+
+def file_shard(path: Path, count: int = SHARD_COUNT) -> int:
+    name = Path(path).name
+    match = SEGMENT_SHARD.search(name)
+    if match and int(match.group(2)) == count:
+        return int(match.group(1))
+    stem = name.split('.', 1)[0]
+    if stem.isdigit():
+        return shard_of(stem, count)
+    return zlib.crc32(name.encode('utf-8')) % count
+
+
+def in_shard_file(path: Path) -> bool:
+    return file_shard(path) == SHARD_INDEX
+
+
+def manifest_dir(root: Path, snapshot_date: str, run_id: str) -> Path:
+    return Path(root) / '_manifests' / f'date={snapshot_date}' / run_id
+
+
+def write_shard_manifest(root: Path, snapshot_date: str, run_id: str, stage: str, stats: dict) -> Path:
+    """Manifeste d'un shard : <stage>-sKofN.json (écriture atomique)"""
+    path = manifest_dir(root, snapshot_date, run_id) / f'{stage}-{shard_label()}.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        'stage': stage,
+        'snapshot_date': snapshot_date,
+        'run_id': run_id,
+        'shard_index': SHARD_INDEX,
+        'shard_count': SHARD_COUNT,
+        'finished_at_utc': datetime.now(timezone.utc).isoformat(),
+        'stats': stats,
+    }
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+    return path
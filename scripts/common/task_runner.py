@@ -0,0 +1,65 @@
+"""
+Exécution in-process des scripts du pipeline (PythonOperator / @task, backfill)
+
+Les scripts lisent leur configuration dans l'environnement au chargement du module.
+run_module applique une config explicite (clés = variables d'environnement du script)
+le temps de l'appel, (re)charge le module puis appelle main(), sans nouvel interpréteur.
+
+- tâche Airflow (LocalExecutor) : chaque tâche est un fork neuf du worker, les imports du
+  script y sont payés à chaque fois ; seul le démarrage de l'interpréteur est économisé
+  (mesure : maintenance/measure_startup.py). Les scripts importent pandas / pyarrow au
+  premier usage, pas au chargement.
+- backfill : plusieurs runs dans le même processus, les modules lourds restent importés.
+
+L'environnement étant global au processus, les runs in-process sont sérialisés.
+"""
+
+import os
+import sys
+import time
+import importlib
+import threading
+from contextlib import contextmanager
+
+# modules dont la configuration dépend aussi de l'environnement (rechargés avec le script,
+# s'ils sont déjà importés) ; common.datalake : OUTPUT_DIR et DATALAKE_CACHE_SIZE
+CONFIG_MODULES = ('common.shards', 'common.metrics', 'common.datalake')
+
+_ENV_LOCK = threading.RLock()
+
+
+@contextmanager
+def task_env(config: dict | None):
+    """Variables de config posées dans os.environ pendant le bloc, restaurées ensuite"""
+    config = {k: str(v) for k, v in (config or {}).items() if v is not None}
+    with _ENV_LOCK:
+        previous = {k: os.environ.get(k) for k in config}
+        os.environ.update(config)
+        try:
+            yield
+        finally:
+            for k, v in previous.items():
+                if v is None:
+                    os.environ.pop(k, None)
+                else:
+                    os.environ[k] = v
+
+
+def load_module(name: str):
+    """Importe le module, ou le recharge pour relire la configuration courante"""
+    module = sys.modules.get(name)
+    if module is None:
+        return importlib.import_module(name)
+    return importlib.reload(module)
+
+
+def run_module(name: str, config: dict | None = None):
+    """Exécute main() du module `name` avec la config donnée ; renvoie la valeur de main()"""
+    with task_env(config):
+        for dependency in CONFIG_MODULES:
+            if dependency in sys.modules:
+                importlib.reload(sys.modules[dependency])
+        started = time.perf_counter()
+        module = load_module(name)
+        print(f"⏱️  {name} chargé en {time.perf_counter() - started:.3f}s (in-process)")
+        return module.main()
@@ -3,12 +3,21 @@ Export PostgreSQL → Parquet (formatted + usage)
 """
 
 import os
-import pandas as pd
+import sys
+import json
+import uuid
+import time
+import itertools
+from decimal import Decimal
 import psycopg2
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import pyarrow as pa
-import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.parquet_profiles import JSON_COLUMN_TYPES, SORT_KEYS, BufferedParquetWriter, get_profile, table_schema
+from common.task_runner import run_module
 
 
 DB_CONFIG = {
@@ -23,6 +32,41 @@ DB_CONFIG = {
 DATALAKE_PATH = Path(os.getenv('OUTPUT_DIR', '/opt/airflow/datalake'))
 SNAPSHOT_DATE = os.getenv('SNAPSHOT_DATE', datetime.now().strftime('%Y-%m-%d'))
 
+# "stream" = curseur serveur + ParquetWriter par lots (mémoire constante), "pandas" = ancien chemin
+EXPORT_MODE = os.getenv('EXPORT_MODE', 'stream')
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', '50000'))
+
+# Export parallèle : une connexion par table, toutes sur le même snapshot PostgreSQL exporté
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '4'))
+
+# Plage exportée (backfill) : par défaut uniquement SNAPSHOT_DATE, une partition Hive par jour
+EXPORT_DATE_FROM = os.getenv('EXPORT_DATE_FROM') or SNAPSHOT_DATE
+EXPORT_DATE_TO = os.getenv('EXPORT_DATE_TO') or EXPORT_DATE_FROM
+
+# Couches exportées (le DAG exporte formatted et usage dans une même tâche, sur un seul snapshot PostgreSQL)
+EXPORT_LAYERS = [layer for layer in os.getenv('EXPORT_LAYERS', 'formatted,usage').split(',') if layer]
+
+
+# Types PostgreSQL (OID) → Arrow
+PG_ARROW_TYPES = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float32(),
+    701: pa.float64(),
+    1700: pa.float64(),             # numeric
+    1082: pa.date32(),
+    1114: pa.timestamp('us'),
+    1184: pa.timestamp('us', tz='UTC'),
+}
+PG_NUMERIC = 1700
+PG_JSON = {114, 3802}               # json, jsonb
+PG_TEXT = {19, 25, 1042, 1043}      # name, text, bpchar, varchar
+
+# Profil Parquet du chemin stream (voir common/parquet_profiles.py : zstd | snappy)
+PARQUET_PROFILE = get_profile()
+
 
 EXPORTS = {
     'formatted': [
@@ -36,48 +80,266 @@ EXPORTS = {
     ]
 }
 
-def export_table_to_parquet(conn, schema_table: str, output_path: Path):
+def partition_path(table_dir: Path, day) -> Path:
+    return table_dir / f'snapshot_date={day}' / 'data.parquet'
+
+
+def date_range(date_from: str, date_to: str) -> list[date]:
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def snapshot_query(schema_table: str, date_from: str, date_to: str, sort_keys: list[str] | None = None) -> tuple[str, tuple]:
+    """Filtre snapshot_date poussé côté PostgreSQL (trié pour écrire une partition à la fois)"""
+    order_by = ", ".join(sort_keys or ['snapshot_date'])
+    if date_from == date_to:
+        return f"SELECT * FROM {schema_table} WHERE snapshot_date = %s ORDER BY {order_by}", (date_from,)
+    return (
+        f"SELECT * FROM {schema_table} WHERE snapshot_date BETWEEN %s AND %s ORDER BY {order_by}",
+        (date_from, date_to),
+    )
+
+
+def export_table_to_parquet(conn, schema_table: str, table_dir: Path, date_from: str, date_to: str):
     """Exporte table PostgreSQL vers Parquet"""
-    
-    print(f" Export {schema_table} → {output_path}")
+    import pandas as pd  # chemin pandas uniquement : pas d'import au chargement du module
+
+    print(f" Export {schema_table} → {table_dir} [{date_from} → {date_to}]")
     
     try:
-        # Lire données
-        query = f"SELECT * FROM {schema_table}"
-        df = pd.read_sql(query, conn)
+        # Lire données (uniquement la plage de snapshots demandée)
+        query, params = snapshot_query(schema_table, date_from, date_to)
+        with metrics.span('read_sql') as s:
+            df = pd.read_sql(query, conn, params=params)
+            s.add(rows=len(df))
         
         print(f"   ✅ {len(df)} lignes extraites")
         
-        # Créer dossier si nécessaire
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Exporter en Parquet (avec compression snappy)
-        df.to_parquet(
-            output_path,
-            engine='pyarrow',
-            compression='snappy',
-            index=False
-        )
-        
-        # Afficher taille fichier
-        size_mb = output_path.stat().st_size / (1024 * 1024)
-        print(f"   ✅ Fichier créé : {size_mb:.2f} MB")
+        if date_from == date_to:
+            groups = [(date_from, df)]
+        else:
+            groups = [(str(day), part) for day, part in df.groupby('snapshot_date')]
+
+        for day, part in groups:
+            output_path = partition_path(table_dir, day)
+
+            # Créer dossier si nécessaire
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Exporter en Parquet (avec compression snappy)
+            with metrics.span('parquet_write', rows=len(part), files=1) as s:
+                part.to_parquet(
+                    output_path,
+                    engine='pyarrow',
+                    compression='snappy',
+                    index=False
+                )
+                s.add(bytes=output_path.stat().st_size)
+
+            # Afficher taille fichier
+            size_mb = output_path.stat().st_size / (1024 * 1024)
+            print(f"   ✅ Fichier créé : {output_path.parent.name} ({len(part)} lignes, {size_mb:.2f} MB)")
         
         return len(df)
     
     except Exception as e:
+        conn.rollback()
+        print(f"   ⚠️  Erreur: {e}")
+        return None  # table en échec, remontée par main() après les autres exports
+
+
+def source_field(column) -> pa.Field:
+    """Champ Arrow déduit du type PostgreSQL d'une colonne de cursor.description"""
+    name, type_code = column.name, column.type_code
+    if type_code in PG_JSON:
+        return pa.field(name, JSON_COLUMN_TYPES.get(name, pa.string()))
+    return pa.field(name, PG_ARROW_TYPES.get(type_code, pa.string()))
+
+
+def converter_for(type_code: int, target: pa.DataType):
+    """Conversion Python nécessaire pour passer de la valeur psycopg2 au type Arrow cible"""
+    is_text = pa.types.is_string(target) or pa.types.is_dictionary(target)
+
+    if type_code in PG_JSON:
+        return (lambda v: None if v is None else json.dumps(v, ensure_ascii=False)) if is_text else None
+
+    if type_code == PG_NUMERIC:
+        if pa.types.is_integer(target):
+            return lambda v: None if v is None else int(v)
+        return lambda v: float(v) if isinstance(v, Decimal) else v
+
+    if is_text and type_code not in PG_TEXT:
+        return lambda v: None if v is None else str(v)
+
+    return None
+
+
+def rows_to_batch(rows: list, schema: pa.Schema, converters: list) -> pa.RecordBatch:
+    columns = list(zip(*rows)) if rows else [[] for _ in schema]
+    arrays = []
+    for col, field, conv in zip(columns, schema, converters):
+        values = [conv(v) for v in col] if conv else list(col)
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def open_partition_writer(table_dir: Path, day, schema: pa.Schema) -> tuple[BufferedParquetWriter, Path]:
+    """Writer de la partition du jour, écrit en .tmp (renommé par commit_partition_writer)"""
+    output_path = partition_path(table_dir, day)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output_path.with_name(f".{output_path.name}.tmp")
+    profile = dict(PARQUET_PROFILE, sort_keys=SORT_KEYS.get(table_dir.name, []))
+    return BufferedParquetWriter(tmp, schema, profile), tmp
+
+
+def commit_partition_writer(writer: BufferedParquetWriter, tmp_path: Path, table_dir: Path, day) -> None:
+    writer.close()
+    os.replace(tmp_path, partition_path(table_dir, day))
+
+
+def stream_query_to_partitions(conn, query: str, params, table_dir: Path) -> tuple[dict, pa.Schema]:
+    """Curseur serveur nommé → RecordBatch Arrow → un ParquetWriter par snapshot_date
+
+    Les lignes arrivent triées par snapshot_date : une seule partition est ouverte à la fois,
+    et chaque fichier est écrit en .tmp puis renommé.
+    """
+    counts = {}
+    writer = current = tmp_path = None
+
+    def commit_partition():
+        commit_partition_writer(writer, tmp_path, table_dir, current)
+
+    with conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}") as cur:
+        cur.itersize = EXPORT_BATCH_ROWS
+        cur.execute(query, params)
+        schema = None
+        try:
+            while True:
+                with metrics.span('read_sql') as s:
+                    rows = cur.fetchmany(EXPORT_BATCH_ROWS)
+                    s.add(rows=len(rows))
+                if schema is None:
+                    # description disponible après le premier fetch sur un curseur nommé
+                    derived = pa.schema([source_field(c) for c in cur.description])
+                    schema = table_schema(table_dir.name, derived)
+                    converters = [converter_for(c.type_code, f.type) for c, f in zip(cur.description, schema)]
+                    date_idx = schema.get_field_index('snapshot_date')
+                if not rows:
+                    break
+
+                for day, group in itertools.groupby(rows, key=lambda r: r[date_idx]):
+                    group = list(group)
+                    if day != current:
+                        if writer is not None:
+                            commit_partition()
+                        current = day
+                        writer, tmp_path = open_partition_writer(table_dir, day, schema)
+                    writer.write_batch(rows_to_batch(group, schema, converters))
+                    counts[day] = counts.get(day, 0) + len(group)
+
+            if writer is not None:
+                commit_partition()
+                writer = None
+        finally:
+            if writer is not None:
+                writer.close()
+                tmp_path.unlink(missing_ok=True)
+
+    return counts, schema
+
+
+def export_table_streaming(conn, schema_table: str, table_dir: Path, date_from: str, date_to: str):
+    """Exporte table PostgreSQL vers Parquet en flux (mémoire bornée par EXPORT_BATCH_ROWS)"""
+
+    print(
+        f" Export {schema_table} → {table_dir} [{date_from} → {date_to}] "
+        f"(stream, lots de {EXPORT_BATCH_ROWS}, {PARQUET_PROFILE['compression']})"
+    )
+
+    try:
+        query, params = snapshot_query(schema_table, date_from, date_to, SORT_KEYS.get(table_dir.name))
+        counts, schema = stream_query_to_partitions(conn, query, params, table_dir)
+        total = sum(counts.values())
+        print(f"   ✅ {total} lignes extraites")
+
+        # export quotidien : on écrit la partition même vide (les consommateurs l'attendent)
+        if date_from == date_to and not counts:
+            writer, tmp_path = open_partition_writer(table_dir, date_from, schema)
+            commit_partition_writer(writer, tmp_path, table_dir, date_from)
+
+        for day in date_range(date_from, date_to):
+            output_path = partition_path(table_dir, day)
+            if output_path.exists() and (day in counts or date_from == date_to):
+                size_mb = output_path.stat().st_size / (1024 * 1024)
+                print(f"   ✅ Fichier créé : {output_path.parent.name} ({counts.get(day, 0)} lignes, {size_mb:.2f} MB)")
+
+        return total
+
+    except Exception as e:
+        conn.rollback()
         print(f"   ⚠️  Erreur: {e}")
-        return 0
+        return None  # table en échec, remontée par main() après les autres exports
+
+
+def export_table(conn, schema_table: str, table_dir: Path, date_from: str = None, date_to: str = None):
+    date_from = date_from or EXPORT_DATE_FROM
+    date_to = date_to or EXPORT_DATE_TO
+    if EXPORT_MODE == 'pandas':
+        return export_table_to_parquet(conn, schema_table, table_dir, date_from, date_to)
+    return export_table_streaming(conn, schema_table, table_dir, date_from, date_to)
+
+
+def timed_export(conn, layer: str, schema_table: str, name: str) -> tuple:
+    started = time.monotonic()
+    count = export_table(conn, schema_table, DATALAKE_PATH / layer / name)
+    return layer, schema_table, count, time.monotonic() - started
 
 
+def export_with_snapshot(snapshot_id: str, layer: str, schema_table: str, name: str) -> tuple:
+    """Worker : connexion dédiée attachée au snapshot exporté (vue cohérente entre tables)"""
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_id,))
+        return timed_export(conn, layer, schema_table, name)
+    finally:
+        conn.close()
+
+
+def run_exports(conn, jobs: list[tuple]) -> list[tuple]:
+    """Exporte toutes les tables, en parallèle si EXPORT_WORKERS > 1"""
+    if EXPORT_WORKERS <= 1 or len(jobs) <= 1:
+        return [timed_export(conn, *job) for job in jobs]
+
+    # la transaction qui exporte le snapshot doit rester ouverte pendant tout l'export
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_export_snapshot()")
+        snapshot_id = cur.fetchone()[0]
+    print(f" Snapshot PostgreSQL: {snapshot_id} | workers={EXPORT_WORKERS}\n")
+
+    try:
+        with metrics.ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as pool:
+            futures = [pool.submit(export_with_snapshot, snapshot_id, *job) for job in jobs]
+            return [f.result() for f in futures]
+    finally:
+        conn.rollback()
+
+
+@metrics.instrumented(lambda: f"export_parquet_{'_'.join(EXPORT_LAYERS)}")
 def main():
     """Export complet PostgreSQL → Parquet"""
     
-    print(f"\n EXPORT DATALAKE - {SNAPSHOT_DATE}\n")
+    print(f"\n EXPORT DATALAKE - {EXPORT_DATE_FROM} → {EXPORT_DATE_TO}\n")
     
     # Afficher config
     print(f" Datalake path: {DATALAKE_PATH.absolute()}")
-    print(f" PostgreSQL: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}\n")
+    print(f" PostgreSQL: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
+    print(f" Mode: {EXPORT_MODE} | workers={EXPORT_WORKERS} | couches: {', '.join(EXPORT_LAYERS)}\n")
     
     # Connexion PostgreSQL
     try:
@@ -92,34 +354,41 @@ def main():
     stats = {'formatted': 0, 'usage': 0}
     
     try:
-        # Export FORMATTED (staging)
-        print(" FORMATTED (staging)")
-        print("=" * 50)
-        
-        for schema_table, name in EXPORTS['formatted']:
-            output_path = DATALAKE_PATH / 'formatted' / name / f'snapshot_date={SNAPSHOT_DATE}' / 'data.parquet'
-            count = export_table_to_parquet(conn, schema_table, output_path)
-            stats['formatted'] += count
-        
-        # Export USAGE (marts)
-        print("\n USAGE (marts)")
-        print("=" * 50)
-        
-        for schema_table, name in EXPORTS['usage']:
-            output_path = DATALAKE_PATH / 'usage' / name / f'snapshot_date={SNAPSHOT_DATE}' / 'data.parquet'
-            count = export_table_to_parquet(conn, schema_table, output_path)
-            stats['usage'] += count
+        # FORMATTED (staging) + USAGE (marts)
+        jobs = [
+            (layer, schema_table, name)
+            for layer in EXPORT_LAYERS
+            for schema_table, name in EXPORTS[layer]
+        ]
+        results = run_exports(conn, jobs)
+
+        failed = [schema_table for _, schema_table, count, _ in results if count is None]
+        for layer, _, count, _ in results:
+            stats[layer] += count or 0
         
         # Résumé
         print("\n" + "=" * 50)
         print(f" EXPORT TERMINÉ")
         print(f"    Formatted: {stats['formatted']} lignes")
         print(f"    Usage: {stats['usage']} lignes")
+        print("\n Durée par table")
+        for layer, schema_table, count, seconds in sorted(results, key=lambda r: -r[3]):
+            print(f"    {seconds:7.2f}s  {schema_table} ({'❌ échec' if count is None else f'{count} lignes'})")
         print("=" * 50)
+
+        # la tâche Airflow et le registre du backfill doivent voir l'échec
+        if failed:
+            raise RuntimeError(f"❌ {len(failed)} table(s) en échec: {', '.join(failed)}")
         
     finally:
         conn.close()
 
 
+def run(config: dict | None = None):
+    """Tâche Airflow ou backfill par blocs de jours : config = SNAPSHOT_DATE (ou EXPORT_DATE_FROM / EXPORT_DATE_TO),
+    EXPORT_LAYERS, OUTPUT_DIR, POSTGRES_*"""
+    return run_module(__name__, config)
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
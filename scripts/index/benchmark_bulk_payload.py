@@ -0,0 +1,87 @@
+"""
+Micro-benchmark du payload bulk Elasticsearch : sérialiseur legacy (iterrows) vs colonnaire
+
+Génère un DataFrame synthétique au format movies_enriched, vérifie que les deux
+sérialiseurs produisent exactement les mêmes octets puis compare les temps.
+
+    python scripts/index/benchmark_bulk_payload.py            # 20 000 lignes
+    BENCH_ROWS=100000 BENCH_REPEAT=5 python scripts/index/benchmark_bulk_payload.py
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from index_elasticsearch import INDEX_MOVIES, build_bulk_lines, build_bulk_lines_legacy
+
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "20000"))
+BENCH_REPEAT = int(os.getenv("BENCH_REPEAT", "3"))
+
+
+def synthetic_movies(n: int, seed: int = 42) -> pd.DataFrame:
+    """DataFrame au format usage/movies_enriched, avec des valeurs manquantes"""
+    rng = np.random.default_rng(seed)
+    missing = rng.random(n) < 0.2
+
+    imdb_rating = rng.uniform(1, 10, n).round(1)
+    imdb_rating[missing] = np.nan
+
+    return pd.DataFrame({
+        "snapshot_date": pd.Timestamp("2026-01-15"),
+        "tmdb_id": np.arange(1, n + 1, dtype="int64"),
+        "imdb_id": [None if m else f"tt{i:07d}" for i, m in enumerate(missing)],
+        "title": [f"Film n°{i} — « été »" for i in range(n)],
+        "original_language": rng.choice(["en", "fr", "ja", "ko"], n),
+        "release_date": pd.to_datetime("2000-01-01") + pd.to_timedelta(rng.integers(0, 9000, n), unit="D"),
+        "release_year": rng.integers(1990, 2026, n),
+        "popularity": rng.uniform(0, 500, n),
+        "tmdb_rating": rng.uniform(0, 10, n).round(3),
+        "tmdb_vote_count": rng.integers(0, 30000, n),
+        "imdb_rating": imdb_rating,
+        "imdb_votes": pd.array(np.where(missing, None, rng.integers(0, 10**6, n)), dtype="Int64"),
+        "director": [None if m else "Jean-Luc Godard" for m in missing],
+        "missing_omdb_data": missing,
+        "is_hidden_gem": rng.random(n) < 0.05,
+    })
+
+
+def timed(fn, *args) -> tuple[float, list[str]]:
+    best = float("inf")
+    result = None
+    for _ in range(BENCH_REPEAT):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    df = synthetic_movies(BENCH_ROWS)
+    id_cols = ["snapshot_date", "tmdb_id"]
+
+    print(f"\n BENCHMARK PAYLOAD BULK | {BENCH_ROWS} lignes, meilleur de {BENCH_REPEAT}\n")
+
+    t_legacy, legacy = timed(build_bulk_lines_legacy, INDEX_MOVIES, df, id_cols)
+    t_columnar, columnar = timed(build_bulk_lines, INDEX_MOVIES, df, id_cols)
+
+    payload_legacy = ("\n".join(legacy) + "\n").encode("utf-8")
+    payload_columnar = ("\n".join(columnar) + "\n").encode("utf-8")
+    if payload_legacy != payload_columnar:
+        for i, (a, b) in enumerate(zip(legacy, columnar)):
+            if a != b:
+                print(f"❌ ligne {i} différente:\n   legacy   : {a}\n   colonnaire: {b}")
+                break
+        raise SystemExit("❌ Les payloads diffèrent")
+
+    print(f"✅ Payloads identiques ({len(payload_legacy) / 1e6:.1f} MB)")
+    print(f"   legacy (iterrows): {t_legacy:.3f}s ({BENCH_ROWS / t_legacy:,.0f} docs/s)")
+    print(f"   colonnaire       : {t_columnar:.3f}s ({BENCH_ROWS / t_columnar:,.0f} docs/s)")
+    print(f"   gain             : x{t_legacy / t_columnar:.1f}")
+
+
+if __name__ == "__main__":
+    main()
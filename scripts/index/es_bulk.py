@@ -0,0 +1,181 @@
+"""
+Moteur bulk Elasticsearch
+
+- découpe les actions en requêtes _bulk bornées en octets et en nombre de documents
+- envoi parallèle par plusieurs workers sur une requests.Session partagée (keep-alive)
+- backpressure : nombre de requêtes en vol borné, le producteur attend les workers
+- seuls les items rejetés en 429 / 503 sont renvoyés, avec backoff exponentiel
+- une requête refusée en 413 est coupée en deux et renvoyée
+- toutes les erreurs par item sont agrégées (pas d'arrêt aux 5 premières)
+"""
+
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, wait
+import requests
+
+from common import metrics
+from common.http_client import backoff_delay, make_session
+
+RETRY_ITEM_STATUS = {429, 503}
+RETRY_REQUEST_STATUS = {429, 502, 503, 504}
+
+
+def iter_action_pairs(lines):
+    """Lignes NDJSON alternées (action, document) → couples"""
+    it = iter(lines)
+    return zip(it, it)
+
+
+class BulkResult:
+    """Compteurs d'une ou plusieurs requêtes _bulk"""
+
+    def __init__(self):
+        self.docs = 0
+        self.bytes = 0
+        self.requests = 0
+        self.retries = 0
+        self.results = Counter()   # created / updated / noop ...
+        self.errors = []           # (_id, status, type, reason)
+
+    def merge(self, other: "BulkResult") -> None:
+        self.docs += other.docs
+        self.bytes += other.bytes
+        self.requests += other.requests
+        self.retries += other.retries
+        self.results.update(other.results)
+        self.errors.extend(other.errors)
+
+    def error_summary(self, examples: int = 3) -> str:
+        by_type = Counter(err[2] for err in self.errors)
+        parts = [f"{t}: {n}" for t, n in by_type.most_common()]
+        sample = [f"{_id} ({status}) {reason}" for _id, status, _, reason in self.errors[:examples]]
+        return f"{len(self.errors)} erreurs [{', '.join(parts)}] ex: {sample}"
+
+
+class BulkIndexer:
+    """Envoi bulk découpé et parallèle"""
+
+    def __init__(
+        self,
+        host: str,
+        workers: int = 4,
+        max_bytes: int = 10 * 1024 * 1024,
+        max_docs: int = 5000,
+        max_retries: int = 5,
+        timeout: float = 60,
+        session: requests.Session | None = None,
+    ):
+        self.url = f"{host.rstrip('/')}/_bulk"
+        self.workers = max(1, workers)
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = session or make_session(self.workers)
+
+    def chunks(self, pairs):
+        """Regroupe les couples (action, doc) en requêtes ≤ max_bytes et ≤ max_docs"""
+        chunk, size = [], 0
+        for action, doc in pairs:
+            item = (action.encode("utf-8"), doc.encode("utf-8"))
+            item_size = len(item[0]) + len(item[1]) + 2
+            if chunk and (size + item_size > self.max_bytes or len(chunk) >= self.max_docs):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(item)
+            size += item_size
+        if chunk:
+            yield chunk
+
+    def _post(self, body: bytes) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = self.session.post(
+                    self.url,
+                    headers={"Content-Type": "application/x-ndjson"},
+                    data=body,
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            if r.status_code in RETRY_REQUEST_STATUS and attempt < self.max_retries:
+                time.sleep(backoff_delay(attempt, r.headers.get("Retry-After")))
+                continue
+            return r
+        raise RuntimeError(f"❌ Échec _bulk après {self.max_retries + 1} tentatives")
+
+    def send_chunk(self, chunk) -> BulkResult:
+        """Envoie une requête _bulk, renvoie uniquement les items 429/503"""
+        result = BulkResult()
+        result.docs = len(chunk)
+        pending = chunk
+
+        for attempt in range(self.max_retries + 1):
+            body = b"".join(action + b"\n" + doc + b"\n" for action, doc in pending)
+            with metrics.span("bulk_post", docs=len(pending), bytes=len(body)):
+                r = self._post(body)
+            result.requests += 1
+            result.bytes += len(body)
+
+            if r.status_code == 413 and len(pending) > 1:
+                # requête trop grosse pour http.max_content_length : on coupe en deux
+                half = len(pending) // 2
+                for part in (pending[:half], pending[half:]):
+                    sub = self.send_chunk(part)
+                    sub.docs = 0
+                    result.merge(sub)
+                return result
+            r.raise_for_status()
+
+            retry = []
+            for (action, doc), item in zip(pending, r.json().get("items", [])):
+                op = next(iter(item.values()))
+                status = op.get("status", 0)
+                if status in RETRY_ITEM_STATUS and attempt < self.max_retries:
+                    retry.append((action, doc))
+                elif op.get("error"):
+                    error = op["error"]
+                    if not isinstance(error, dict):
+                        error = {"type": "unknown", "reason": str(error)}
+                    result.errors.append((op.get("_id"), status, error.get("type"), error.get("reason")))
+                else:
+                    result.results[op.get("result", "indexed")] += 1
+
+            if not retry:
+                return result
+            result.retries += len(retry)
+            pending = retry
+            time.sleep(backoff_delay(attempt))
+
+        return result
+
+    def index(self, pairs) -> BulkResult:
+        """Indexe un flux de couples (action, doc) ; au plus 2 × workers requêtes en vol"""
+        total = BulkResult()
+        max_in_flight = self.workers * 2
+
+        with metrics.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = set()
+            for chunk in self.chunks(pairs):
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for f in done:
+                        total.merge(f.result())
+                in_flight.add(pool.submit(self.send_chunk, chunk))
+            for f in in_flight:
+                total.merge(f.result())
+
+        return total
+
+
+def report(index_name: str, result: BulkResult, seconds: float) -> None:
+    rate = result.docs / seconds if seconds > 0 else 0.0
+    counts = ", ".join(f"{k}: {v}" for k, v in sorted(result.results.items())) or "aucun"
+    print(
+        f"   {index_name}: {result.docs} docs en {seconds:.2f}s ({rate:,.0f} docs/s) | "
+        f"{result.requests} requêtes, {result.bytes / 1e6:.1f} MB, {result.retries} items relancés | {counts}"
+    )
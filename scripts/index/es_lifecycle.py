@@ -0,0 +1,175 @@
+"""
+Cycle de vie des indices Elasticsearch pour un chargement bulk
+
+Un index versionné par jour et par run : <alias>-YYYY.MM.DD-<run>
+1. création avec le mapping, refresh_interval=-1 et 0 réplica pendant le chargement
+2. chargement bulk (par l'appelant)
+3. refresh, force-merge optionnel, restauration des réglages du mapping
+4. bascule atomique de l'alias de lecture (les autres jours restent derrière l'alias)
+5. suppression des anciennes versions du même jour
+Si le chargement échoue, l'index neuf est supprimé et l'alias ne bouge pas.
+"""
+
+import copy
+import json
+from datetime import datetime
+import requests
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# réglages suspendus pendant le chargement
+BULK_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+
+def day_prefix(alias: str, snapshot_date: str) -> str:
+    return f"{alias}-{snapshot_date.replace('-', '.')}-"
+
+
+def versioned_index_name(alias: str, snapshot_date: str, run_stamp: str | None = None) -> str:
+    run_stamp = run_stamp or datetime.now().strftime("%Y%m%d%H%M%S")
+    return f"{day_prefix(alias, snapshot_date)}{run_stamp}"
+
+
+def list_indices(session: requests.Session, host: str, pattern: str) -> list[str]:
+    r = session.get(f"{host}/{pattern}", params={"allow_no_indices": "true"}, timeout=60)
+    if r.status_code == 404:
+        return []
+    r.raise_for_status()
+    return sorted(r.json())
+
+
+def alias_targets(session: requests.Session, host: str, alias: str) -> list[str]:
+    r = session.get(f"{host}/_alias/{alias}", timeout=60)
+    if r.status_code == 404:
+        return []
+    r.raise_for_status()
+    return sorted(r.json())
+
+
+def is_concrete_index(session: requests.Session, host: str, name: str) -> bool:
+    """Index « historique » portant le nom de l'alias (mode live)"""
+    r = session.get(f"{host}/{name}", timeout=60)
+    if r.status_code == 404:
+        return False
+    r.raise_for_status()
+    return name in r.json()
+
+
+def index_uuid(session: requests.Session, host: str, index_name: str) -> str:
+    """UUID de l'index concret (change si l'index est supprimé puis recréé)"""
+    r = session.get(f"{host}/{index_name}/_settings/index.uuid", timeout=60)
+    r.raise_for_status()
+    settings = r.json()
+    concrete = index_name if index_name in settings else next(iter(settings))
+    return settings[concrete]["settings"]["index"]["uuid"]
+
+
+def create_for_bulk(session: requests.Session, host: str, index_name: str, mapping: dict) -> dict:
+    """Crée l'index avec refresh suspendu et sans réplica ; renvoie les réglages à restaurer"""
+    body = copy.deepcopy(mapping)
+    settings = body.setdefault("settings", {})
+    restore = {
+        "refresh_interval": settings.get("refresh_interval"),   # None = défaut ES (1s)
+        "number_of_replicas": settings.get("number_of_replicas", 1),
+    }
+    settings.update(BULK_SETTINGS)
+
+    r = session.put(f"{host}/{index_name}", headers=JSON_HEADERS, data=json.dumps(body), timeout=60)
+    r.raise_for_status()
+    print(f"✅ Index créé (bulk): {index_name} (refresh suspendu, 0 réplica)")
+    return restore
+
+
+def finish_bulk(
+    session: requests.Session,
+    host: str,
+    index_name: str,
+    restore: dict,
+    force_merge: bool = False,
+) -> None:
+    """Rend les documents visibles, force-merge optionnel, restaure refresh_interval / réplicas"""
+    r = session.post(f"{host}/{index_name}/_refresh", timeout=300)
+    r.raise_for_status()
+
+    if force_merge:
+        # segments figés (l'index d'un jour n'est plus modifié) : un seul segment par shard
+        r = session.post(f"{host}/{index_name}/_forcemerge", params={"max_num_segments": 1}, timeout=3600)
+        r.raise_for_status()
+        print(f"   ✅ Force-merge: {index_name}")
+
+    # réplicas restaurés après le merge : ils copient des segments déjà fusionnés
+    r = session.put(
+        f"{host}/{index_name}/_settings",
+        headers=JSON_HEADERS,
+        data=json.dumps({"index": restore}),
+        timeout=60,
+    )
+    r.raise_for_status()
+
+    r = session.get(
+        f"{host}/_cluster/health/{index_name}",
+        params={"wait_for_status": "yellow", "timeout": "120s"},
+        timeout=180,
+    )
+    r.raise_for_status()
+
+
+def swap_alias(
+    session: requests.Session,
+    host: str,
+    alias: str,
+    index_name: str,
+    snapshot_date: str,
+    drop_legacy: bool = False,
+) -> list[str]:
+    """Bascule atomique : l'alias quitte les versions précédentes du jour et pointe sur index_name"""
+    prefix = day_prefix(alias, snapshot_date)
+    previous = [i for i in alias_targets(session, host, alias) if i.startswith(prefix) and i != index_name]
+
+    actions = [{"remove": {"index": i, "alias": alias}} for i in previous]
+
+    if is_concrete_index(session, host, alias):
+        if not drop_legacy:
+            raise RuntimeError(
+                f"❌ Un index '{alias}' existe déjà (mode live) : impossible de créer l'alias. "
+                f"Réindexer l'historique ou relancer avec ES_DROP_LEGACY_INDEX=1"
+            )
+        # suppression de l'index historique dans la même opération que la création de l'alias
+        actions.append({"remove_index": {"index": alias}})
+
+    actions.append({"add": {"index": index_name, "alias": alias}})
+
+    r = session.post(f"{host}/_aliases", headers=JSON_HEADERS, data=json.dumps({"actions": actions}), timeout=60)
+    r.raise_for_status()
+    print(f"🔀 Alias {alias} → {index_name}" + (f" (remplace {', '.join(previous)})" if previous else ""))
+    return previous
+
+
+def prune_versions(
+    session: requests.Session,
+    host: str,
+    alias: str,
+    snapshot_date: str,
+    keep: int = 1,
+) -> list[str]:
+    """Supprime les anciennes versions du jour (hors alias), garde les `keep` plus récentes"""
+    prefix = day_prefix(alias, snapshot_date)
+    versions = list_indices(session, host, f"{prefix}*")
+    live = set(alias_targets(session, host, alias))
+
+    old = [i for i in versions[:-keep] if i not in live] if keep > 0 else [i for i in versions if i not in live]
+    for index_name in old:
+        r = session.delete(f"{host}/{index_name}", timeout=60)
+        if r.status_code != 404:
+            r.raise_for_status()
+    if old:
+        print(f"🗑️  Anciennes versions supprimées: {', '.join(old)}")
+    return old
+
+
+def drop_index(session: requests.Session, host: str, index_name: str) -> None:
+    """Abandon d'un chargement : l'index neuf n'a jamais été exposé derrière l'alias"""
+    r = session.delete(f"{host}/{index_name}", timeout=60)
+    if r.status_code != 404:
+        r.raise_for_status()
+    print(f"🗑️  Index abandonné: {index_name}")
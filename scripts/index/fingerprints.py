@@ -0,0 +1,134 @@
+"""
+Empreintes des documents envoyés à Elasticsearch (détection des changements)
+
+Base SQLite à côté du datalake : une ligne par (index, _id) avec l'empreinte
+blake2b du document sérialisé et l'UUID de l'index ES qui l'a reçu.
+Si l'index est recréé (UUID différent), ses empreintes sont oubliées et tout
+est renvoyé.
+
+Plusieurs indexations partagent la base (branches movies / kpis du DAG, jours parallèles
+du backfill) : connexion en autocommit, journal WAL (lectures jamais bloquées par un
+écrivain), et chaque écriture est une transaction courte. Aucun verrou n'est gardé
+pendant l'envoi bulk.
+"""
+
+import json
+import sqlite3
+import hashlib
+from collections import Counter
+from pathlib import Path
+
+LOOKUP_CHUNK = 500
+
+
+def fingerprint(doc_line: str) -> str:
+    return hashlib.blake2b(doc_line.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def action_id(action_line: str) -> str:
+    return json.loads(action_line)["index"]["_id"]
+
+
+class FingerprintStore:
+    """Empreintes par (index_name, doc_id)"""
+
+    def __init__(self, path: Path, enabled: bool = True):
+        self.path = Path(path)
+        self.enabled = enabled
+        self.conn = None
+        if enabled:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # timeout : attente d'une écriture courte d'une autre indexation, jamais d'un envoi bulk
+            self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS fingerprints (
+                    index_name TEXT NOT NULL,
+                    doc_id TEXT NOT NULL,
+                    index_uuid TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (index_name, doc_id)
+                )
+                """
+            )
+
+    def _write(self, sql: str, rows: list) -> None:
+        """Une transaction courte (BEGIN IMMEDIATE : le verrou d'écriture est pris tout de suite)"""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self.conn.executemany(sql, rows)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def reset_if_recreated(self, index_name: str, index_uuid: str) -> None:
+        """Index recréé côté ES : les empreintes ne décrivent plus son contenu (une fois par envoi)"""
+        if not self.enabled:
+            return
+        self._write("DELETE FROM fingerprints WHERE index_name = ? AND index_uuid <> ?", [(index_name, index_uuid)])
+
+    def _known(self, index_name: str, doc_ids: list[str]) -> dict[str, str]:
+        known = {}
+        for i in range(0, len(doc_ids), LOOKUP_CHUNK):
+            chunk = doc_ids[i:i + LOOKUP_CHUNK]
+            rows = self.conn.execute(
+                f"SELECT doc_id, fingerprint FROM fingerprints "
+                f"WHERE index_name = ? AND doc_id IN ({','.join('?' * len(chunk))})",
+                [index_name, *chunk],
+            )
+            known.update(rows)
+        return known
+
+    def select_changed(self, index_name: str, pairs) -> tuple[list, dict, Counter]:
+        """
+        Filtre les couples (action, doc) : renvoie ceux à envoyer, leurs empreintes
+        et les compteurs skipped / created / updated (lecture seule, hors transaction)
+        """
+        pairs = list(pairs)
+        counts = Counter()
+        if not self.enabled:
+            counts["created"] = len(pairs)
+            return pairs, {}, counts
+
+        ids = [action_id(action) for action, _ in pairs]
+        known = self._known(index_name, ids)
+
+        changed, pending = [], {}
+        for doc_id, (action, doc) in zip(ids, pairs):
+            fp = fingerprint(doc)
+            previous = known.get(doc_id)
+            if previous == fp:
+                counts["skipped"] += 1
+                continue
+            counts["updated" if previous else "created"] += 1
+            changed.append((action, doc))
+            pending[doc_id] = fp
+        return changed, pending, counts
+
+    def commit(self, index_name: str, index_uuid: str, pending: dict[str, str], failed_ids=()) -> None:
+        """Enregistre les empreintes des documents effectivement indexés"""
+        if not self.enabled:
+            return
+        failed = set(failed_ids)
+        self._write(
+            """
+            INSERT INTO fingerprints (index_name, doc_id, index_uuid, fingerprint)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (index_name, doc_id) DO UPDATE
+            SET index_uuid = excluded.index_uuid, fingerprint = excluded.fingerprint
+            """,
+            [(index_name, doc_id, index_uuid, fp) for doc_id, fp in pending.items() if doc_id not in failed],
+        )
+
+    def forget(self, index_names) -> None:
+        """Oublie les empreintes d'indices supprimés"""
+        if not self.enabled:
+            return
+        self._write("DELETE FROM fingerprints WHERE index_name = ?", [(n,) for n in index_names])
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
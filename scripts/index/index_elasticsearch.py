@@ -2,28 +2,147 @@
 Indexation Elasticsearch depuis fichiers Parquet
 """
 
+from __future__ import annotations
+
 import os
+import sys
 import json
-from datetime import datetime, date
+import time
+import queue
+import threading
+import contextvars
+from collections import Counter
+from typing import TYPE_CHECKING
+from datetime import datetime, date, timedelta
 from pathlib import Path
-import numpy as np
 
-import pandas as pd
 import requests
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.task_runner import run_module
+from common.http_client import make_session
+from es_bulk import BulkIndexer, iter_action_pairs, report
+import es_lifecycle
+from fingerprints import FingerprintStore
+
+if TYPE_CHECKING:  # annotations seulement : pandas et pyarrow sont importés au premier usage
+    import pandas as pd
+    from common.datalake import Datalake
+
 # Configuration depuis variables d'environnement Airflow
 ES_HOST = os.getenv("ES_HOST", "http://elasticsearch:9200").rstrip("/")
 SNAPSHOT_DATE = os.getenv("SNAPSHOT_DATE") or datetime.now().strftime("%Y-%m-%d")
 
 DATALAKE_PATH = Path(os.getenv("OUTPUT_DIR", "/opt/airflow/datalake"))
-MOVIES_PARQUET = DATALAKE_PATH / "usage" / "movies_enriched" / f"snapshot_date={SNAPSHOT_DATE}" / "data.parquet"
-KPIS_PARQUET = DATALAKE_PATH / "usage" / "kpi_daily" / f"snapshot_date={SNAPSHOT_DATE}" / "data.parquet"
 
 INDEX_MOVIES = "movies_enriched_daily"
 INDEX_KPIS = "movies_kpis_daily"
 
+# Indices traités (le DAG lance movies et kpis en branches parallèles)
+ES_TARGETS = [t for t in os.getenv("ES_TARGETS", "movies,kpis").split(",") if t]
+
+# Plage indexée (backfill) : par défaut uniquement SNAPSHOT_DATE
+ES_DATE_FROM = os.getenv("ES_DATE_FROM") or SNAPSHOT_DATE
+ES_DATE_TO = os.getenv("ES_DATE_TO") or ES_DATE_FROM
+
 TIMEOUT = 60
 
+# "columnar" (défaut) ou "legacy" (iterrows, conservé pour comparaison)
+ES_SERIALIZER = os.getenv("ES_SERIALIZER", "columnar")
+
+# Envoi bulk : requêtes bornées en taille / nb de docs, plusieurs workers en parallèle
+ES_BULK_WORKERS = int(os.getenv("ES_BULK_WORKERS", "4"))
+ES_BULK_MAX_MB = float(os.getenv("ES_BULK_MAX_MB", "10"))
+ES_BULK_MAX_DOCS = int(os.getenv("ES_BULK_MAX_DOCS", "5000"))
+ES_BULK_MAX_RETRIES = int(os.getenv("ES_BULK_MAX_RETRIES", "5"))
+# connexions keep-alive de la session partagée (workers × jours indexés en parallèle en backfill)
+ES_POOL_SIZE = int(os.getenv("ES_POOL_SIZE", str(ES_BULK_WORKERS)))
+
+# "versioned" : un index par jour et par run derrière l'alias INDEX_* (bascule atomique)
+# "live" : écriture directe dans l'index INDEX_* existant
+ES_INDEX_MODE = os.getenv("ES_INDEX_MODE", "live")
+ES_FORCE_MERGE = os.getenv("ES_FORCE_MERGE", "0") == "1"
+ES_KEEP_VERSIONS = int(os.getenv("ES_KEEP_VERSIONS", "1"))  # versions conservées par jour
+ES_DROP_LEGACY_INDEX = os.getenv("ES_DROP_LEGACY_INDEX", "0") == "1"
+
+# Empreintes des documents déjà envoyés : seuls les documents nouveaux ou modifiés partent
+ES_FINGERPRINTS = os.getenv("ES_FINGERPRINTS", "1") != "0"
+ES_FINGERPRINT_DB = Path(os.getenv("ES_FINGERPRINT_DB", str(DATALAKE_PATH / "_state" / "es_fingerprints.sqlite")))
+
+# "full" : table du jour chargée en DataFrame ; "stream" : lecture par lots (colonnes du mapping
+# uniquement), sérialisation et envoi en parallèle, mémoire bornée par ES_STREAM_BATCH_ROWS
+ES_READ_MODE = os.getenv("ES_READ_MODE", "full")
+ES_STREAM_BATCH_ROWS = int(os.getenv("ES_STREAM_BATCH_ROWS", "10000"))
+ES_STREAM_PREFETCH = int(os.getenv("ES_STREAM_PREFETCH", "2"))  # lots lus d'avance
+PREFETCH_POLL_SECONDS = 0.1  # réactivité du thread de lecture à l'arrêt du consommateur
+
+BULK_INDEXER = BulkIndexer(
+    ES_HOST,
+    workers=ES_BULK_WORKERS,
+    max_bytes=int(ES_BULK_MAX_MB * 1024 * 1024),
+    max_docs=ES_BULK_MAX_DOCS,
+    max_retries=ES_BULK_MAX_RETRIES,
+    timeout=TIMEOUT,
+    session=make_session(ES_POOL_SIZE),
+)
+
+
+# Mapping movies
+MOVIES_MAPPING = {
+    "settings": {"number_of_shards": 1, "number_of_replicas": 0},
+    "mappings": {
+        "properties": {
+            "snapshot_date": {"type": "date"},
+            "tmdb_id": {"type": "long"},
+            "imdb_id": {"type": "keyword"},
+            "title": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "original_language": {"type": "keyword"},
+            "release_date": {"type": "date"},
+            "release_year": {"type": "integer"},
+            "popularity": {"type": "double"},
+            "tmdb_rating": {"type": "double"},
+            "tmdb_vote_count": {"type": "integer"},
+            "imdb_rating": {"type": "double"},
+            "imdb_votes": {"type": "integer"},
+            "metascore": {"type": "double"},
+            "composite_score": {"type": "double"},
+            "runtime_minutes": {"type": "integer"},
+            "status": {"type": "keyword"},
+            "rated": {"type": "keyword"},
+            "director": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
+            "actors": {"type": "text"},
+            "missing_omdb_data": {"type": "boolean"},
+            "is_overhyped": {"type": "boolean"},
+            "is_hidden_gem": {"type": "boolean"},
+        }
+    },
+}
+
+# Mapping KPIs
+KPIS_MAPPING = {
+    "settings": {"number_of_shards": 1, "number_of_replicas": 0},
+    "mappings": {
+        "properties": {
+            "snapshot_date": {"type": "date"},
+            "nb_movies": {"type": "integer"},
+            "nb_movies_with_omdb": {"type": "integer"},
+            "omdb_coverage_ratio": {"type": "double"},
+            "avg_tmdb_rating": {"type": "double"},
+            "avg_imdb_rating": {"type": "double"},
+            "avg_popularity": {"type": "double"},
+            "nb_overhyped": {"type": "integer"},
+            "nb_hidden_gems": {"type": "integer"},
+        }
+    },
+}
+
+# cible ES_TARGETS → (alias, table usage, mapping, colonnes de l'_id)
+TARGETS = {
+    "movies": (INDEX_MOVIES, "movies_enriched", MOVIES_MAPPING, ["snapshot_date", "tmdb_id"]),
+    "kpis": (INDEX_KPIS, "kpi_daily", KPIS_MAPPING, ["snapshot_date"]),
+}
+
 
 def es_ok() -> None:
     """Vérifier connexion Elasticsearch"""
@@ -59,8 +178,90 @@ def create_index_if_missing(index_name: str, mapping: dict) -> None:
     print(f"✅ Index créé: {index_name}")
 
 
+def categories_to_object(df: pd.DataFrame) -> pd.DataFrame:
+    """Colonnes dictionnaire → catégories pandas : on revient à des objets pour la sérialisation"""
+    import pandas as pd  # import différé : pas de pandas au chargement du module
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(object)
+    return df
+
+
+def open_datalake() -> Datalake:
+    from common.datalake import Datalake  # pyarrow importé au premier accès au datalake, pas au chargement
+
+    return Datalake(DATALAKE_PATH)
+
+
+def has_snapshot(lake: Datalake, table: str, day: str) -> bool:
+    """Partition quotidienne du jour, ou fichier mensuel compacté qui la contient"""
+    partitions = lake.partitions("usage", table)
+    return f"snapshot_date={day}" in partitions or f"snapshot_month={day[:7]}" in partitions
+
+
+def read_snapshot(table: str, date_from: str, date_to: str) -> pd.DataFrame:
+    """Lire une table usage sur [date_from, date_to] (partitions et row groups hors plage élagués)"""
+    with metrics.span("parquet_read") as s:
+        df = open_datalake().read_pandas("usage", table, date_from=date_from, date_to=date_to)
+        s.add(rows=len(df))
+    return categories_to_object(df)
+
+
+def mapping_columns(lake: Datalake, table: str, mapping: dict) -> list[str]:
+    """Colonnes de la table présentes dans le mapping (ordre du fichier conservé)"""
+    fields = mapping["mappings"]["properties"]
+    return [name for name in lake.dataset("usage", table).schema.names if name in fields]
+
+
+def prefetch(iterable, depth: int):
+    """Consomme iterable dans un thread (lecture Parquet hors GIL) avec au plus depth éléments d'avance
+
+    Si le consommateur s'arrête (exception, close()), le producteur est prévenu par stop :
+    put() avec timeout pour ne jamais rester bloqué sur une file pleine, thread joint en sortie.
+    """
+    q = queue.Queue(maxsize=max(1, depth))
+    done = object()
+    stop = threading.Event()
+
+    def offer(item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=PREFETCH_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not offer(item):
+                    return
+        except BaseException as e:  # remonté au consommateur
+            offer(e)
+        finally:
+            offer(done)
+
+    # contexte de l'appelant : les spans éventuels du thread vont dans le run courant
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
 def convert_to_json_serializable(obj):
     """Convertir objets Python en types JSON sérialisables"""
+    import numpy as np
+    import pandas as pd
     # Gérer None et NaN
     if obj is None:
         return None
@@ -97,11 +298,11 @@ def convert_to_json_serializable(obj):
     return obj
 
 
-def bulk_index(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> None:
-    """Indexation bulk Elasticsearch"""
-    if df.empty:
-        print(f"⚠️  Rien à indexer pour {index_name} (df vide)")
-        return
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Dates → texte, NaN → None (étapes communes aux deux sérialiseurs)"""
+    import pandas as pd
+
+    df = df.copy()
 
     # Convertir toutes les colonnes datetime en string ISO
     for col in df.columns:
@@ -109,9 +310,13 @@ def bulk_index(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> None:
             df[col] = df[col].dt.strftime('%Y-%m-%d')
     
     # Convertir NaN -> None
-    df = df.where(pd.notnull(df), None)
+    return df.where(pd.notnull(df), None)
+
+
+def build_bulk_lines_legacy(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> list[str]:
+    """Sérialiseur historique ligne à ligne (référence pour le benchmark)"""
+    df = prepare_frame(df)
 
-    # Bulk payload NDJSON
     lines = []
     for _, row in df.iterrows():
         # Convertir chaque valeur en type JSON sérialisable
@@ -125,131 +330,271 @@ def bulk_index(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> None:
         lines.append(json.dumps({"index": {"_index": index_name, "_id": doc_id}}))
         lines.append(json.dumps(doc, ensure_ascii=False, default=str))
 
-    payload = "\n".join(lines) + "\n"
+    return lines
 
-    r = requests.post(
-        f"{ES_HOST}/_bulk",
-        headers={"Content-Type": "application/x-ndjson"},
-        data=payload.encode("utf-8"),
-        timeout=TIMEOUT,
+
+def iterrows_dtype(df: pd.DataFrame):
+    """dtype commun qu'iterrows imposerait (ex. int → float si toutes les colonnes sont numériques)"""
+    import numpy as np
+    dtypes = list(df.dtypes)
+    if dtypes and all(isinstance(d, np.dtype) and d.kind in "iuf" for d in dtypes):
+        return np.result_type(*dtypes)
+    return None
+
+
+def column_to_json_values(series: pd.Series) -> list:
+    """Convertit une colonne entière en valeurs Python JSON-compatibles (équivalent cellule par cellule)"""
+    import numpy as np
+    dtype = series.dtype
+
+    if isinstance(dtype, np.dtype) and dtype.kind in "biu":
+        return series.to_numpy().tolist()
+
+    if isinstance(dtype, np.dtype) and dtype.kind == "f":
+        arr = series.to_numpy()
+        values = arr.tolist()
+        for i in np.flatnonzero(np.isnan(arr)):
+            values[i] = None
+        return values
+
+    # objets / extensions : masque NA vectorisé, conversion seulement pour les types non triviaux
+    missing = series.isna().to_numpy()
+    values = series.to_numpy(dtype=object).tolist()
+    for i, v in enumerate(values):
+        if missing[i]:
+            values[i] = None
+        elif type(v) is not str:
+            values[i] = convert_to_json_serializable(v)
+    return values
+
+
+def build_bulk_lines(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> list[str]:
+    """Sérialiseur colonnaire : chaque colonne est convertie une seule fois, sortie identique à l'historique"""
+    df = prepare_frame(df)
+
+    common = iterrows_dtype(df)
+    if common is not None:
+        df = df.astype(common)
+
+    columns = [str(c) for c in df.columns]
+    values = [column_to_json_values(df[c]) for c in df.columns]
+
+    # _id vectorisé à partir des colonnes déjà converties
+    id_values = [[str(v) for v in values[columns.index(c)]] if c in columns else None for c in id_cols]
+    id_parts = [col if col is not None else ["None"] * len(df) for col in id_values]
+    doc_ids = ["_".join(parts) for parts in zip(*id_parts)]
+
+    encode_action = json.JSONEncoder().encode
+    encode_doc = json.JSONEncoder(ensure_ascii=False, default=str).encode
+
+    lines = []
+    for doc_id, row in zip(doc_ids, zip(*values)):
+        lines.append(encode_action({"index": {"_index": index_name, "_id": doc_id}}))
+        lines.append(encode_doc(dict(zip(columns, row))))
+    return lines
+
+
+def frame_lines(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> list[str]:
+    """Bulk payload NDJSON (lignes action / document)"""
+    with metrics.span("serialize", rows=len(df)):
+        if ES_SERIALIZER == "legacy":
+            return build_bulk_lines_legacy(index_name, df, id_cols)
+        return build_bulk_lines(index_name, df, id_cols)
+
+
+def send_batches(index_name: str, batches) -> int:
+    """Envoie des lots de couples (action, doc), sans les documents inchangés ; renvoie le nb de docs lus"""
+    uuid = es_lifecycle.index_uuid(BULK_INDEXER.session, ES_HOST, index_name) if ES_FINGERPRINTS else ""
+    store = FingerprintStore(ES_FINGERPRINT_DB, enabled=ES_FINGERPRINTS)
+    store.reset_if_recreated(index_name, uuid)
+    counts, pending = Counter(), {}
+
+    def changed_pairs():
+        # consommé par le thread principal de BulkIndexer.index : SQLite reste mono-thread
+        for pairs in batches:
+            changed, batch_pending, batch_counts = store.select_changed(index_name, pairs)
+            counts.update(batch_counts)
+            pending.update(batch_pending)
+            yield from changed
+
+    try:
+        start = time.perf_counter()
+        result = BULK_INDEXER.index(changed_pairs())
+        report(index_name, result, time.perf_counter() - start)
+        print(
+            f"   {index_name}: {counts['created']} nouveaux, {counts['updated']} modifiés, "
+            f"{counts['skipped']} inchangés (ignorés)"
+        )
+
+        store.commit(index_name, uuid, pending, failed_ids=(err[0] for err in result.errors))
+    finally:
+        store.close()
+
+    if result.errors:
+        raise RuntimeError(f"❌ Bulk indexing errors ({index_name}): {result.error_summary()}")
+
+    total = sum(counts.values())
+    print(f"✅ Bulk OK: {index_name} ({result.docs}/{total} docs envoyés)")
+    return total
+
+
+def bulk_index(index_name: str, df: pd.DataFrame, id_cols: list[str]) -> int:
+    """Indexation bulk Elasticsearch"""
+    if df.empty:
+        print(f"⚠️  Rien à indexer pour {index_name} (df vide)")
+        return 0
+
+    lines = frame_lines(index_name, df, id_cols)
+    return send_batches(index_name, [list(iter_action_pairs(lines))])
+
+
+def stream_index(index_name: str, table: str, mapping: dict, id_cols: list[str], date_from: str, date_to: str) -> int:
+    """Indexation en flux : lecture par lots (thread), sérialisation, envoi par les workers bulk"""
+    lake = open_datalake()
+    batches = prefetch(
+        lake.iter_batches(
+            "usage", table,
+            date_from=date_from, date_to=date_to,
+            columns=mapping_columns(lake, table, mapping),
+            batch_size=ES_STREAM_BATCH_ROWS,
+        ),
+        ES_STREAM_PREFETCH,
     )
-    r.raise_for_status()
-    resp = r.json()
 
-    if resp.get("errors"):
-        errors = []
-        for item in resp.get("items", []):
-            action = item.get("index", {})
-            if action.get("error"):
-                errors.append(action.get("error"))
-                if len(errors) >= 5:
-                    break
-        raise RuntimeError(f"❌ Bulk indexing errors: {errors}")
+    def batch_pairs():
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            df = categories_to_object(batch.to_pandas())
+            yield list(iter_action_pairs(frame_lines(index_name, df, id_cols)))
 
-    print(f"✅ Bulk OK: {index_name} ({len(df)} docs)")
+    try:
+        total = send_batches(index_name, batch_pairs())
+    finally:
+        batches.close()  # arrête et joint le thread de lecture si l'envoi a échoué
+    if total == 0:
+        print(f"⚠️  Rien à indexer pour {index_name} ({table} vide sur {date_from} → {date_to})")
+    return total
+
+
+def load_index(
+    index_name: str, table: str, mapping: dict, df: pd.DataFrame | None, id_cols: list[str], date_from: str, date_to: str
+) -> int:
+    if df is None:
+        return stream_index(index_name, table, mapping, id_cols, date_from, date_to)
+    return bulk_index(index_name, df, id_cols)
+
+
+def index_table(
+    alias: str, table: str, mapping: dict, df: pd.DataFrame | None, id_cols: list[str], date_from: str, date_to: str
+) -> int:
+    """Charge la table dans l'index alias (live) ou dans une nouvelle version du jour (versioned)
+
+    df=None : lecture en flux depuis le datalake (ES_READ_MODE=stream)
+    versioned : une version d'index par jour, date_from == date_to
+    """
+    if ES_INDEX_MODE != "versioned":
+        return load_index(alias, table, mapping, df, id_cols, date_from, date_to)
+
+    if date_from != date_to:
+        raise ValueError(f"❌ Mode versioned : un seul jour par index ({date_from} → {date_to})")
+
+    session = BULK_INDEXER.session
+    index_name = es_lifecycle.versioned_index_name(alias, date_from)
+    restore = es_lifecycle.create_for_bulk(session, ES_HOST, index_name, mapping)
+    try:
+        total = load_index(index_name, table, mapping, df, id_cols, date_from, date_to)
+        es_lifecycle.finish_bulk(session, ES_HOST, index_name, restore, force_merge=ES_FORCE_MERGE)
+        es_lifecycle.swap_alias(session, ES_HOST, alias, index_name, date_from, drop_legacy=ES_DROP_LEGACY_INDEX)
+    except Exception:
+        es_lifecycle.drop_index(session, ES_HOST, index_name)
+        store = FingerprintStore(ES_FINGERPRINT_DB, enabled=ES_FINGERPRINTS)
+        store.forget([index_name])
+        store.close()
+        raise
+    pruned = es_lifecycle.prune_versions(session, ES_HOST, alias, date_from, keep=ES_KEEP_VERSIONS)
 
+    store = FingerprintStore(ES_FINGERPRINT_DB, enabled=ES_FINGERPRINTS)
+    store.forget(pruned)
+    store.close()
+    return total
 
+
+def day_range(date_from: str, date_to: str) -> list[str]:
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def create_indices(targets: list[str]) -> None:
+    """Index live créés si absents (en mode versioned, chaque chargement crée sa propre version)"""
+    if ES_INDEX_MODE == "versioned":
+        return
+    print(" Création indices")
+    print("=" * 50)
+    for target in targets:
+        alias, _, mapping, _ = TARGETS[target]
+        create_index_if_missing(alias, mapping)
+
+
+def index_range(date_from: str, date_to: str, targets: list[str] = ES_TARGETS) -> Counter:
+    """Indexe les tables usage sur [date_from, date_to] ; renvoie le nb de docs par cible
+
+    live : toute la plage en une passe bulk ; versioned : une version d'index par jour
+    """
+    if ES_INDEX_MODE == "versioned":
+        spans = [(day, day) for day in day_range(date_from, date_to)]
+    else:
+        spans = [(date_from, date_to)]
+
+    counts = Counter()
+    for start, end in spans:
+        for target in targets:
+            alias, table, mapping, id_cols = TARGETS[target]
+            # en mode stream, la lecture se fait par lots pendant l'indexation
+            df = None
+            if ES_READ_MODE != "stream":
+                df = read_snapshot(table, start, end)
+                print(f"✅ {table} [{start} → {end}]: {len(df)} lignes, {len(df.columns)} colonnes")
+            counts[target] += index_table(alias, table, mapping, df, id_cols, start, end)
+    return counts
+
+
+@metrics.instrumented(lambda: f"index_elasticsearch_{'_'.join(ES_TARGETS)}")
 def main():
     """Indexation complète Elasticsearch"""
     
-    print(f"\n INDEXATION ELASTICSEARCH | snapshot_date={SNAPSHOT_DATE}\n")
+    print(f"\n INDEXATION ELASTICSEARCH | snapshot_date={SNAPSHOT_DATE} | plage {ES_DATE_FROM} → {ES_DATE_TO}\n")
     print(f" ES_HOST: {ES_HOST}")
     print(f" Datalake: {DATALAKE_PATH}")
-    print(f" Movies: {MOVIES_PARQUET}")
-    print(f" KPIs: {KPIS_PARQUET}\n")
+    print(f" Tables: {', '.join(TARGETS[t][1] for t in ES_TARGETS)}\n")
 
     # Vérifier Elasticsearch
     es_ok()
 
-    # Vérifier fichiers
-    if not MOVIES_PARQUET.exists():
-        print(f"⚠️  Fichier movies introuvable: {MOVIES_PARQUET}")
-        print(f"   Contenu datalake/usage:")
-        usage_dir = DATALAKE_PATH / "usage"
-        if usage_dir.exists():
-            for item in usage_dir.rglob("*.parquet"):
-                print(f"   - {item}")
-        raise FileNotFoundError(f"Fichier introuvable: {MOVIES_PARQUET}")
-    
-    if not KPIS_PARQUET.exists():
-        print(f"⚠️  Fichier KPIs introuvable: {KPIS_PARQUET}")
-        raise FileNotFoundError(f"Fichier introuvable: {KPIS_PARQUET}")
-
-    # Mapping movies
-    movies_mapping = {
-        "settings": {"number_of_shards": 1, "number_of_replicas": 0},
-        "mappings": {
-            "properties": {
-                "snapshot_date": {"type": "date"},
-                "tmdb_id": {"type": "long"},
-                "imdb_id": {"type": "keyword"},
-                "title": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                "original_language": {"type": "keyword"},
-                "release_date": {"type": "date"},
-                "release_year": {"type": "integer"},
-                "popularity": {"type": "double"},
-                "tmdb_rating": {"type": "double"},
-                "tmdb_vote_count": {"type": "integer"},
-                "imdb_rating": {"type": "double"},
-                "imdb_votes": {"type": "integer"},
-                "metascore": {"type": "double"},
-                "composite_score": {"type": "double"},
-                "runtime_minutes": {"type": "integer"},
-                "status": {"type": "keyword"},
-                "rated": {"type": "keyword"},
-                "director": {"type": "text", "fields": {"keyword": {"type": "keyword"}}},
-                "actors": {"type": "text"},
-                "missing_omdb_data": {"type": "boolean"},
-                "is_overhyped": {"type": "boolean"},
-                "is_hidden_gem": {"type": "boolean"},
-            }
-        },
-    }
-
-    # Mapping KPIs
-    kpis_mapping = {
-        "settings": {"number_of_shards": 1, "number_of_replicas": 0},
-        "mappings": {
-            "properties": {
-                "snapshot_date": {"type": "date"},
-                "nb_movies": {"type": "integer"},
-                "nb_movies_with_omdb": {"type": "integer"},
-                "omdb_coverage_ratio": {"type": "double"},
-                "avg_tmdb_rating": {"type": "double"},
-                "avg_imdb_rating": {"type": "double"},
-                "avg_popularity": {"type": "double"},
-                "nb_overhyped": {"type": "integer"},
-                "nb_hidden_gems": {"type": "integer"},
-            }
-        },
-    }
-
-    # Créer indices
-    print(" Création indices")
-    print("=" * 50)
-    create_index_if_missing(INDEX_MOVIES, movies_mapping)
-    create_index_if_missing(INDEX_KPIS, kpis_mapping)
+    # Vérifier partitions du jour (sur une plage de backfill, un jour sans partition est simplement vide)
+    if ES_DATE_FROM == ES_DATE_TO == SNAPSHOT_DATE:
+        lake = open_datalake()
+        for target in ES_TARGETS:
+            table = TARGETS[target][1]
+            if not has_snapshot(lake, table, SNAPSHOT_DATE):
+                print(f"⚠️  Partition {table} introuvable pour {SNAPSHOT_DATE}")
+                print(f"   Partitions usage/{table}: {', '.join(lake.partitions('usage', table)) or 'aucune'}")
+                raise FileNotFoundError(f"Partition introuvable: usage/{table} snapshot_date={SNAPSHOT_DATE}")
 
-    # Lire Parquet
-    print("\n Lecture Parquet")
-    print("=" * 50)
-    df_movies = pd.read_parquet(MOVIES_PARQUET)
-    df_kpis = pd.read_parquet(KPIS_PARQUET)
-    
-    print(f"✅ Movies: {len(df_movies)} lignes, {len(df_movies.columns)} colonnes")
-    print(f"✅ KPIs: {len(df_kpis)} lignes, {len(df_kpis.columns)} colonnes")
+    create_indices(ES_TARGETS)
 
-    # Indexation bulk
-    print("\n Indexation Elasticsearch")
+    print(f"\n Indexation Elasticsearch (mode {ES_INDEX_MODE}, lecture {ES_READ_MODE})")
     print("=" * 50)
-    bulk_index(INDEX_MOVIES, df_movies, id_cols=["snapshot_date", "tmdb_id"])
-    bulk_index(INDEX_KPIS, df_kpis, id_cols=["snapshot_date"])
+    counts = index_range(ES_DATE_FROM, ES_DATE_TO)
+    nb_movies, nb_kpis = counts["movies"], counts["kpis"]
 
     # Résumé
     print("\n" + "=" * 50)
     print("🎉 INDEXATION TERMINÉE")
-    print(f"    Movies: {len(df_movies)} docs indexés")
-    print(f"    KPIs: {len(df_kpis)} docs indexés")
+    if "movies" in ES_TARGETS:
+        print(f"    Movies: {nb_movies} docs indexés")
+    if "kpis" in ES_TARGETS:
+        print(f"    KPIs: {nb_kpis} docs indexés")
     print("=" * 50)
     
     print(f"\n KIBANA")
@@ -259,5 +604,11 @@ def main():
     print(f"   3. Créer Data View '{INDEX_KPIS}' (timestamp: snapshot_date)")
 
 
+def run(config: dict | None = None):
+    """Tâche Airflow par cible : config = SNAPSHOT_DATE, ES_TARGETS, ES_HOST, OUTPUT_DIR
+    (le backfill appelle index_range directement)"""
+    return run_module(__name__, config)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
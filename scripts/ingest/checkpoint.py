@@ -0,0 +1,77 @@
+"""
+Manifeste de reprise d'une extraction (un fichier JSON par SNAPSHOT_DATE / RUN_ID)
+
+Une relance Airflow garde le même RUN_ID : les pages et fiches déjà écrites
+dans la zone raw sont relues ici et ne sont pas redemandées à l'API.
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+from datetime import datetime, timezone
+
+
+class Checkpoint:
+    """Pages et détails (tmdb_id, imdb_id...) déjà écrits, sauvegardés tous les flush_every ajouts"""
+
+    def __init__(self, path: Path, snapshot_date: str, run_id: str, flush_every: int = 25):
+        self.path = path
+        self.snapshot_date = snapshot_date
+        self.run_id = run_id
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.total_pages = None
+        self.pages = set()
+        self.details = set()
+
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.total_pages = state.get("total_pages")
+            self.pages = set(state.get("pages", []))
+            self.details = set(state.get("details", []))
+            print(f"↩️  Reprise checkpoint {path.name}: {len(self.pages)} pages, {len(self.details)} détails")
+
+    def mark_page(self, page: int, total_pages: int | None):
+        with self.lock:
+            self.pages.add(page)
+            if total_pages:
+                self.total_pages = total_pages
+            self._maybe_flush()
+
+    def mark_detail(self, key):
+        with self.lock:
+            self.details.add(key)
+            self._maybe_flush()
+
+    def mark_details(self, keys: list):
+        with self.lock:
+            self.details.update(keys)
+            self._write()
+
+    def _maybe_flush(self):
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self._write()
+
+    def save(self):
+        with self.lock:
+            self._write()
+
+    def _write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        state = {
+            "snapshot_date": self.snapshot_date,
+            "run_id": self.run_id,
+            "updated_at_utc": datetime.now(timezone.utc).isoformat(),
+            "total_pages": self.total_pages,
+            "pages": sorted(self.pages),
+            "details": sorted(self.details),
+        }
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+        self.pending = 0
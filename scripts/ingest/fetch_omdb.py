@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+from concurrent.futures import as_completed
+from pathlib import Path
+from datetime import datetime, timezone
+import requests
+
+from checkpoint import Checkpoint
+from http_cache import HttpCache
+from raw_segments import SegmentWriter, default_compression
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.http_client import TokenBucket, backoff_delay, make_session
+from common.raw_reader import iter_records
+from common.shards import in_shard, shard_label, sharded, write_shard_manifest
+from common.task_runner import run_module
+
+OMDB_API_KEY = os.getenv("OMDB_API_KEY")
+if not OMDB_API_KEY:
+    raise RuntimeError("❌ OMDB_API_KEY manquante")
+
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/opt/airflow/datalake/raw")
+SNAPSHOT_DATE = os.getenv("SNAPSHOT_DATE") or datetime.now().strftime("%Y-%m-%d")
+
+# optionnel (fourni par Airflow)
+RUN_ID = os.getenv("RUN_ID") or datetime.now().strftime("%Y%m%d%H%M%S")
+
+BASE_DIR = Path(OUTPUT_DIR)
+
+# Quota OMDb : 1 000 requêtes / jour sur la clé gratuite (remis à zéro à minuit UTC)
+OMDB_DAILY_QUOTA = int(os.getenv("OMDB_DAILY_QUOTA", "1000"))
+OMDB_WORKERS = int(os.getenv("OMDB_WORKERS", "4"))
+OMDB_RATE_LIMIT = float(os.getenv("OMDB_RATE_LIMIT", "10"))  # requêtes / seconde
+OMDB_MAX_RETRIES = int(os.getenv("OMDB_MAX_RETRIES", "3"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Cache par imdb_id : notes et votes IMDb bougent lentement, une fiche reste fraîche plusieurs jours
+OMDB_CACHE_DIR = Path(os.getenv("OMDB_CACHE_DIR", str(BASE_DIR / "_cache" / "omdb")))
+OMDB_CACHE_TTL_DAYS = float(os.getenv("OMDB_CACHE_TTL_DAYS", "7"))
+OMDB_CACHE_ENABLED = os.getenv("OMDB_CACHE_ENABLED", "1") != "0"
+
+# Format zone raw : "ndjson" (segments compressés) ou "json" (un fichier {imdb_id}.json)
+RAW_FORMAT = os.getenv("RAW_FORMAT", "ndjson")
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION") or default_compression()
+RAW_SEGMENT_MAX_MB = float(os.getenv("RAW_SEGMENT_MAX_MB", "64"))
+
+OMDB_URL = "https://www.omdbapi.com/"
+
+TMDB_DETAILS_DIR = BASE_DIR / "tmdb/details" / f"date={SNAPSHOT_DATE}"
+OMDB_RATINGS_DIR = BASE_DIR / "omdb/ratings" / f"date={SNAPSHOT_DATE}"
+
+# Manifeste de reprise (une relance Airflow garde le même RUN_ID)
+CHECKPOINT_DIR = BASE_DIR / "_checkpoints" / "omdb" / f"date={SNAPSHOT_DATE}"
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class DailyQuota:
+    """
+    Compteur de requêtes OMDb du jour (UTC), persistant entre les runs.
+    Partagé entre threads (lock) et entre shards parallèles (flock sur le fichier).
+    """
+
+    def __init__(self, directory: Path, limit: int):
+        self.day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        self.path = Path(directory) / "quota" / f"{self.day}.json"
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.used_by_run = 0
+        self.used = self._update(lambda state: None)["used"]
+
+    def _update(self, change) -> dict:
+        """Lecture / modification / écriture du compteur sous verrou exclusif"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                state.setdefault("used", 0)
+                if change(state) is not False:
+                    state.update(day=self.day, limit=self.limit, updated_by=RUN_ID)
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(state, f)
+                    f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self.used = state["used"]
+        return state
+
+    def acquire(self) -> None:
+        granted = []
+
+        def take(state):
+            if state["used"] >= self.limit:
+                return False
+            state["used"] += 1
+            granted.append(True)
+
+        with self.lock:
+            self._update(take)
+            if not granted:
+                raise QuotaExhausted()
+            self.used_by_run += 1
+
+    def mark_exhausted(self) -> None:
+        """OMDb a répondu « Request limit reached! » : le compteur local était en retard"""
+        with self.lock:
+            self._update(lambda state: state.update(used=max(state["used"], self.limit)))
+
+
+SESSION = make_session(OMDB_WORKERS)
+RATE_LIMITER = TokenBucket(OMDB_RATE_LIMIT)
+CACHE = HttpCache(OMDB_CACHE_DIR / "http", ttl=OMDB_CACHE_TTL_DAYS * 86400, enabled=OMDB_CACHE_ENABLED)
+QUOTA = DailyQuota(OMDB_CACHE_DIR, OMDB_DAILY_QUOTA)
+
+
+def cache_params(imdb_id: str) -> dict:
+    # clé de cache = imdb_id (la clé d'API est exclue par HttpCache)
+    return {"i": imdb_id}
+
+
+def omdb_get(imdb_id: str, entry: dict | None) -> dict:
+    """Une fiche OMDb ; chaque tentative consomme une requête du quota"""
+    params = {**cache_params(imdb_id), "apikey": OMDB_API_KEY}
+    headers = CACHE.conditional_headers(entry)
+
+    for attempt in range(OMDB_MAX_RETRIES + 1):
+        QUOTA.acquire()
+        RATE_LIMITER.acquire()
+        try:
+            with metrics.span("http_fetch") as s:
+                r = SESSION.get(OMDB_URL, params=params, headers=headers, timeout=30)
+                s.add(bytes=len(r.content))
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == OMDB_MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if r.status_code == 401 and "limit" in r.text.lower():
+            QUOTA.mark_exhausted()
+            raise QuotaExhausted()
+
+        if r.status_code in RETRY_STATUS and attempt < OMDB_MAX_RETRIES:
+            print(f"   ↻ HTTP {r.status_code} sur {imdb_id} (tentative {attempt + 1})")
+            time.sleep(backoff_delay(attempt, r.headers.get("Retry-After")))
+            continue
+
+        if r.status_code == 304 and entry:
+            data = CACHE.revalidated(OMDB_URL, cache_params(imdb_id), entry)
+            if data is not None:
+                return data
+            headers, entry = {}, None
+            continue
+
+        r.raise_for_status()
+        return CACHE.store(OMDB_URL, cache_params(imdb_id), r)
+
+    raise RuntimeError(f"❌ Échec OMDb après {OMDB_MAX_RETRIES + 1} tentatives: {imdb_id}")
+
+
+def read_imdb_ids() -> list[str]:
+    """imdb_id du jour depuis la zone TMDB details (JSON ou segments), dédoublonnés"""
+    if not TMDB_DETAILS_DIR.exists():
+        raise FileNotFoundError(f"TMDB details introuvable: {TMDB_DETAILS_DIR}")
+
+    ids = (
+        details.get("imdb_id")
+        for _, details in iter_records(TMDB_DETAILS_DIR)
+        if isinstance(details, dict) and (not sharded() or (details.get("id") and in_shard(details["id"])))
+    )
+    return list(dict.fromkeys(i for i in ids if i))
+
+
+def make_meta(key: str) -> dict:
+    return {
+        "snapshot_date": SNAPSHOT_DATE,
+        "run_id": RUN_ID,
+        "extracted_at_utc": datetime.now(timezone.utc).isoformat(),
+        "source": "omdb",
+        "endpoint": "ratings",
+        "key": key,
+    }
+
+
+class RatingsWriter:
+    """Zone raw omdb/ratings/date=... au format choisi (RAW_FORMAT), imdb_id écrits reportés au checkpoint"""
+
+    def __init__(self, checkpoint: Checkpoint):
+        self.checkpoint = checkpoint
+        self.segments = None
+        if RAW_FORMAT == "ndjson":
+            self.segments = SegmentWriter(
+                OMDB_RATINGS_DIR,
+                prefix=f"{RUN_ID}-{shard_label()}-{os.getpid()}" if sharded() else f"{RUN_ID}-{os.getpid()}",
+                compression=RAW_COMPRESSION,
+                max_bytes=int(RAW_SEGMENT_MAX_MB * 1024 * 1024),
+                on_commit=checkpoint.mark_details,
+            )
+
+    def write(self, imdb_id: str, data: dict) -> None:
+        record = {"_meta": make_meta(imdb_id), "data": data}
+        if self.segments is not None:
+            # checkpoint mis à jour à la fermeture du segment (on_commit)
+            self.segments.write(record, key=imdb_id)
+            return
+        path = OMDB_RATINGS_DIR / f"{imdb_id}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, indent=2, ensure_ascii=False)
+        self.checkpoint.mark_detail(imdb_id)
+
+    def close(self) -> None:
+        if self.segments is not None:
+            self.segments.close()
+
+
+def plan(imdb_ids: list[str]):
+    """Sépare titres frais (cache) et titres à demander : nouveaux d'abord, puis les plus anciens"""
+    fresh, new, stale = {}, [], []
+    for imdb_id in imdb_ids:
+        entry, data = CACHE.lookup(OMDB_URL, cache_params(imdb_id))
+        if data is not None:
+            fresh[imdb_id] = data
+        elif entry is None:
+            new.append((imdb_id, None))
+        else:
+            stale.append((imdb_id, entry))
+    stale.sort(key=lambda item: item[1].get("validated_at", 0))
+    return fresh, new + stale
+
+
+def fetch_one(imdb_id: str, entry: dict | None):
+    """Renvoie (statut, data) ; quota épuisé → ancienne fiche du cache si elle existe"""
+    try:
+        return "fetched", omdb_get(imdb_id, entry)
+    except QuotaExhausted:
+        if entry is not None:
+            data = CACHE.stale_data(entry)
+            if data is not None:
+                return "stale", data
+        return "missing", None
+
+
+@metrics.instrumented("fetch_omdb")
+def main():
+    label = f" | shard {shard_label()}" if sharded() else ""
+    print(f"🎞️  OMDb extraction | snapshot_date={SNAPSHOT_DATE} | run_id={RUN_ID}{label}")
+
+    imdb_ids = read_imdb_ids()
+    print(f"✅ {len(imdb_ids)} imdb_id distincts (TMDB details{label})")
+
+    checkpoint_name = f"{RUN_ID}-{shard_label()}.json" if sharded() else f"{RUN_ID}.json"
+    checkpoint = Checkpoint(CHECKPOINT_DIR / checkpoint_name, SNAPSHOT_DATE, RUN_ID)
+    remaining = [imdb_id for imdb_id in imdb_ids if imdb_id not in checkpoint.details]
+    if len(remaining) < len(imdb_ids):
+        print(f"↩️  {len(imdb_ids) - len(remaining)} fiches déjà écrites (checkpoint)")
+
+    fresh, todo = plan(remaining)
+    nb_new = sum(1 for _, entry in todo if entry is None)
+    print(
+        f"🗄️  Cache OMDb (TTL {OMDB_CACHE_TTL_DAYS:g} j): {len(fresh)} frais | "
+        f"{nb_new} nouveaux, {len(todo) - nb_new} à rafraîchir"
+    )
+    print(f"⚡ Quota du jour: {QUOTA.used}/{QUOTA.limit} déjà utilisées | workers={OMDB_WORKERS} | {OMDB_RATE_LIMIT:g} req/s")
+
+    started = time.monotonic()
+    counts = {"checkpoint": len(imdb_ids) - len(remaining), "cache": len(fresh), "fetched": 0, "stale": 0, "missing": 0}
+    failed = []
+
+    writer = RatingsWriter(checkpoint)
+    try:
+        for imdb_id, data in fresh.items():
+            writer.write(imdb_id, data)
+
+        with metrics.ThreadPoolExecutor(max_workers=max(1, OMDB_WORKERS)) as pool:
+            futures = {pool.submit(fetch_one, imdb_id, entry): imdb_id for imdb_id, entry in todo}
+            for future in as_completed(futures):
+                imdb_id = futures[future]
+                try:
+                    status, data = future.result()
+                except Exception as e:
+                    print(f"   ⚠️ Erreur OMDb {imdb_id}: {e}")
+                    failed.append(imdb_id)
+                    continue
+                counts[status] += 1
+                if data is not None:
+                    writer.write(imdb_id, data)
+    finally:
+        writer.close()
+        checkpoint.save()
+
+    elapsed = time.monotonic() - started
+    print(
+        f"✅ {len(imdb_ids) - counts['missing'] - len(failed)} fiches OMDb en {elapsed:.1f}s | "
+        f"{counts['checkpoint']} déjà écrites, {counts['cache']} servies par le cache, {counts['fetched']} téléchargées, "
+        f"{counts['stale']} anciennes (quota épuisé), {counts['missing']} sans données"
+    )
+    print(f"📊 Quota: {QUOTA.used_by_run} requêtes ce run | {QUOTA.used}/{QUOTA.limit} aujourd'hui (UTC)")
+    CACHE.report("Cache OMDb")
+
+    if failed:
+        raise RuntimeError(f"❌ {len(failed)} fiches OMDb en échec: {failed[:10]}")
+
+    write_shard_manifest(BASE_DIR, SNAPSHOT_DATE, RUN_ID, "omdb", {
+        "titles": len(imdb_ids),
+        **counts,
+        "quota_used": QUOTA.used_by_run,
+    })
+    print("✅ OMDb terminé")
+
+
+def run(config: dict | None = None):
+    """Tâche Airflow par shard : config = SNAPSHOT_DATE, RUN_ID, OUTPUT_DIR, OMDB_RATE_LIMIT,
+    SHARD_INDEX / SHARD_COUNT"""
+    return run_module(__name__, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
 import os
+import sys
 import json
 import time
+from concurrent.futures import as_completed
 from pathlib import Path
 from datetime import datetime, timezone
 import requests
 
+from checkpoint import Checkpoint
+from http_cache import HttpCache
+from raw_segments import SegmentWriter, default_compression
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.http_client import TokenBucket, backoff_delay, make_session
+from common.shards import in_shard, shard_label, sharded, write_shard_manifest
+from common.task_runner import run_module
+
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 if not TMDB_API_KEY:
     raise RuntimeError("❌ TMDB_API_KEY manquante")
@@ -17,18 +29,81 @@ RUN_ID = os.getenv("RUN_ID") or datetime.now().strftime("%Y%m%d%H%M%S")
 
 BASE_DIR = Path(OUTPUT_DIR)
 
+# Concurrence / quota TMDB (~50 req/s max côté TMDB, on reste en dessous)
+TMDB_WORKERS = int(os.getenv("TMDB_WORKERS", "8"))
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "20"))  # requêtes / seconde
+TMDB_MAX_RETRIES = int(os.getenv("TMDB_MAX_RETRIES", "5"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Pagination /movie/popular (0 = jusqu'à total_pages, TMDB plafonne à 500)
+TMDB_PAGES = int(os.getenv("TMDB_PAGES", "1"))
+TMDB_MAX_PAGES = 500
+
+# Cache HTTP persistant (TTL en secondes, 0 = toujours revalider via ETag/Last-Modified)
+HTTP_CACHE_DIR = Path(os.getenv("HTTP_CACHE_DIR", str(BASE_DIR / "_cache" / "http")))
+HTTP_CACHE_TTL = float(os.getenv("HTTP_CACHE_TTL", "0"))
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1") != "0"
+
+# Format zone raw des détails : "ndjson" (segments compressés) ou "json" (un fichier par film)
+RAW_FORMAT = os.getenv("RAW_FORMAT", "ndjson")
+RAW_COMPRESSION = os.getenv("RAW_COMPRESSION") or default_compression()
+RAW_SEGMENT_MAX_MB = float(os.getenv("RAW_SEGMENT_MAX_MB", "64"))
+
+# Étape : "all" (classement + détails), "popular" (classement seul) ou
+# "details" (détails des films du shard SHARD_INDEX / SHARD_COUNT, classement relu sur disque)
+TMDB_STAGE = os.getenv("TMDB_STAGE", "all")
+
+# Manifeste de reprise (une relance Airflow garde le même RUN_ID)
+CHECKPOINT_DIR = BASE_DIR / "_checkpoints" / "tmdb" / f"date={SNAPSHOT_DATE}"
+
 TMDB_POPULAR_URL = "https://api.themoviedb.org/3/movie/popular"
 TMDB_DETAILS_URL = "https://api.themoviedb.org/3/movie/{movie_id}"
 
 
-def http_get(url, params):
-    r = requests.get(url, params=params, timeout=30)
-    r.raise_for_status()
-    return r.json()
+SESSION = make_session(TMDB_WORKERS)
+RATE_LIMITER = TokenBucket(TMDB_RATE_LIMIT)
+HTTP_CACHE = HttpCache(HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, enabled=HTTP_CACHE_ENABLED)
 
 
-def save_json(path: Path, data: dict, source: str, endpoint: str):
-    path.parent.mkdir(parents=True, exist_ok=True)
+def http_get(url, params, ttl: float | None = None):
+    entry, cached = HTTP_CACHE.lookup(url, params, ttl)
+    if cached is not None:
+        return cached
+    headers = HTTP_CACHE.conditional_headers(entry)
+
+    for attempt in range(TMDB_MAX_RETRIES + 1):
+        RATE_LIMITER.acquire()
+        try:
+            with metrics.span("http_fetch") as s:
+                r = SESSION.get(url, params=params, headers=headers, timeout=30)
+                s.add(bytes=len(r.content))
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == TMDB_MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if r.status_code in RETRY_STATUS and attempt < TMDB_MAX_RETRIES:
+            print(f"   ↻ HTTP {r.status_code} sur {url} (tentative {attempt + 1})")
+            time.sleep(backoff_delay(attempt, r.headers.get("Retry-After")))
+            continue
+
+        if r.status_code == 304 and entry:
+            data = HTTP_CACHE.revalidated(url, params, entry)
+            if data is not None:
+                return data
+            # objet manquant dans le cache : on retélécharge sans condition
+            headers, entry = {}, None
+            continue
+
+        r.raise_for_status()
+        return HTTP_CACHE.store(url, params, r)
+
+    raise RuntimeError(f"❌ Échec HTTP après {TMDB_MAX_RETRIES + 1} tentatives: {url}")
+
+
+def make_meta(source: str, endpoint: str, key=None) -> dict:
     meta = {
         "snapshot_date": SNAPSHOT_DATE,
         "run_id": RUN_ID,
@@ -36,45 +111,178 @@ def save_json(path: Path, data: dict, source: str, endpoint: str):
         "source": source,
         "endpoint": endpoint,
     }
+    if key is not None:
+        meta["key"] = key
+    return meta
 
-    payload = {"_meta": meta, "data": data}
+
+def save_json(path: Path, data: dict, source: str, endpoint: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {"_meta": make_meta(source, endpoint), "data": data}
 
     with open(path, "w", encoding="utf-8") as f:
         json.dump(payload, f, indent=2, ensure_ascii=False)
 
 
-def main():
-    print(f"🎬 TMDB extraction | snapshot_date={SNAPSHOT_DATE} | run_id={RUN_ID}")
+def read_json(path: Path) -> dict:
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def popular_page_path(page: int) -> Path:
+    # page 1 garde le nom historique lu par load_raw_to_postgres.py
+    name = "popular_movies.json" if page == 1 else f"popular_movies_p{page:03d}.json"
+    return BASE_DIR / "tmdb/popular" / f"date={SNAPSHOT_DATE}" / name
+
 
+def fetch_popular_page(page: int, checkpoint: Checkpoint) -> dict:
+    path = popular_page_path(page)
+    if page in checkpoint.pages and path.exists():
+        return read_json(path)["data"]
+
+    # classement quotidien : jamais servi sans revalidation
     popular = http_get(
         TMDB_POPULAR_URL,
-        {"api_key": TMDB_API_KEY, "page": 1, "language": "fr-FR"},
+        {"api_key": TMDB_API_KEY, "page": page, "language": "fr-FR"},
+        ttl=0,
     )
+    save_json(path, popular, source="tmdb", endpoint="popular")
+    checkpoint.mark_page(page, popular.get("total_pages"))
+    return popular
 
-    popular_path = BASE_DIR / "tmdb/popular" / f"date={SNAPSHOT_DATE}" / "popular_movies.json"
-    save_json(popular_path, popular, source="tmdb", endpoint="popular")
 
-    movies = popular.get("results", [])
-    print(f"✅ {len(movies)} films récupérés (popular)")
+def fetch_popular_pages(checkpoint: Checkpoint) -> list[dict]:
+    """Récupère page 1 puis les pages suivantes en parallèle (bornées par TMDB_PAGES)"""
+    first = fetch_popular_page(1, checkpoint)
+    total_pages = min(first.get("total_pages") or 1, TMDB_MAX_PAGES)
+    last_page = total_pages if TMDB_PAGES <= 0 else min(TMDB_PAGES, total_pages)
+
+    pages = {1: first}
+    with metrics.ThreadPoolExecutor(max_workers=max(1, TMDB_WORKERS)) as pool:
+        futures = {pool.submit(fetch_popular_page, page, checkpoint): page for page in range(2, last_page + 1)}
+        for future in as_completed(futures):
+            pages[futures[future]] = future.result()
+
+    print(f"✅ {last_page} pages popular (total_pages={first.get('total_pages')})")
+    return [pages[p] for p in sorted(pages)]
+
+
+def read_popular_pages() -> list[dict]:
+    """Pages déjà écrites par l'étape popular"""
+    popular_dir = BASE_DIR / "tmdb/popular" / f"date={SNAPSHOT_DATE}"
+    paths = sorted(popular_dir.glob("popular_movies*.json"))
+    if not paths:
+        raise FileNotFoundError(f"Classement popular introuvable: {popular_dir}")
+    return [read_json(path)["data"] for path in paths]
+
+
+def fetch_details(movie_id, checkpoint: Checkpoint | None = None, writer: SegmentWriter | None = None) -> dict:
+    details = http_get(
+        TMDB_DETAILS_URL.format(movie_id=movie_id),
+        {"api_key": TMDB_API_KEY, "language": "fr-FR"},
+    )
+
+    if writer is not None:
+        # checkpoint mis à jour à la fermeture du segment (on_commit)
+        writer.write({"_meta": make_meta("tmdb", "details", key=movie_id), "data": details}, key=movie_id)
+        return details
+
+    details_path = BASE_DIR / "tmdb/details" / f"date={SNAPSHOT_DATE}" / f"{movie_id}.json"
+    save_json(details_path, details, source="tmdb", endpoint="details")
+    if checkpoint is not None:
+        checkpoint.mark_detail(movie_id)
+    return details
+
+
+def make_details_writer(checkpoint: Checkpoint | None = None) -> SegmentWriter | None:
+    if RAW_FORMAT != "ndjson":
+        return None
+    return SegmentWriter(
+        BASE_DIR / "tmdb/details" / f"date={SNAPSHOT_DATE}",
+        # le shard est dans le nom du segment : le loader shardé le retrouve (common.shards.file_shard)
+        prefix=f"{RUN_ID}-{shard_label()}-{os.getpid()}" if sharded() else f"{RUN_ID}-{os.getpid()}",
+        compression=RAW_COMPRESSION,
+        max_bytes=int(RAW_SEGMENT_MAX_MB * 1024 * 1024),
+        on_commit=checkpoint.mark_details if checkpoint is not None else None,
+    )
 
-    for m in movies:
-        movie_id = m.get("id")
-        if not movie_id:
-            continue
 
-        details = http_get(
-            TMDB_DETAILS_URL.format(movie_id=movie_id),
-            {"api_key": TMDB_API_KEY, "language": "fr-FR"},
-        )
+def fetch_all_details(movie_ids: list, checkpoint: Checkpoint | None = None) -> int:
+    """Récupère les détails en parallèle (pool de threads + rate limiter)"""
+    print(f"⚡ Détails: {len(movie_ids)} films | workers={TMDB_WORKERS} | {TMDB_RATE_LIMIT:g} req/s")
+    started = time.monotonic()
+    failed = []
 
-        details_path = BASE_DIR / "tmdb/details" / f"date={SNAPSHOT_DATE}" / f"{movie_id}.json"
-        save_json(details_path, details, source="tmdb", endpoint="details")
+    writer = make_details_writer(checkpoint)
+    with metrics.ThreadPoolExecutor(max_workers=max(1, TMDB_WORKERS)) as pool:
+        futures = {pool.submit(fetch_details, movie_id, checkpoint, writer): movie_id for movie_id in movie_ids}
+        for future in as_completed(futures):
+            movie_id = futures[future]
+            try:
+                details = future.result()
+            except Exception as e:
+                print(f"   ⚠️ Erreur détails {movie_id}: {e}")
+                failed.append(movie_id)
+                continue
+            print(f"   ✔ {details.get('title')} | imdb={details.get('imdb_id')}")
 
-        print(f"   ✔ {details.get('title')} | imdb={details.get('imdb_id')}")
-        time.sleep(0.25)
+    if writer is not None:
+        writer.close()
+        print(f"📦 {len(writer.segments)} segment(s) NDJSON ({writer.compression})")
+
+    elapsed = time.monotonic() - started
+    print(f"✅ {len(movie_ids) - len(failed)} détails en {elapsed:.1f}s")
+
+    if failed:
+        raise RuntimeError(f"❌ {len(failed)} détails en échec: {failed[:10]}")
+    return len(movie_ids)
+
+
+@metrics.instrumented(lambda: f"fetch_tmdb_{TMDB_STAGE}")
+def main():
+    label = f" | shard {shard_label()}" if sharded() else ""
+    print(f"🎬 TMDB extraction | snapshot_date={SNAPSHOT_DATE} | run_id={RUN_ID} | étape={TMDB_STAGE}{label}")
+
+    checkpoint_name = f"{RUN_ID}-{shard_label()}.json" if sharded() else f"{RUN_ID}.json"
+    checkpoint = Checkpoint(CHECKPOINT_DIR / checkpoint_name, SNAPSHOT_DATE, RUN_ID)
+    try:
+        pages = read_popular_pages() if TMDB_STAGE == "details" else fetch_popular_pages(checkpoint)
+
+        # dédoublonnage (le classement peut bouger entre deux pages)
+        movie_ids = list(dict.fromkeys(
+            m.get("id") for page in pages for m in page.get("results", []) if m.get("id")
+        ))
+        print(f"✅ {len(movie_ids)} films récupérés (popular)")
+
+        if TMDB_STAGE == "popular":
+            return
+
+        if sharded():
+            movie_ids = [movie_id for movie_id in movie_ids if in_shard(movie_id)]
+            print(f"🧩 Shard {shard_label()}: {len(movie_ids)} films")
+
+        todo = [movie_id for movie_id in movie_ids if movie_id not in checkpoint.details]
+        if len(todo) < len(movie_ids):
+            print(f"↩️  {len(movie_ids) - len(todo)} détails déjà récupérés (checkpoint)")
+        fetch_all_details(todo, checkpoint)
+
+        write_shard_manifest(BASE_DIR, SNAPSHOT_DATE, RUN_ID, "tmdb_details", {
+            "movies": len(movie_ids),
+            "fetched": len(todo),
+            "from_checkpoint": len(movie_ids) - len(todo),
+        })
+    finally:
+        checkpoint.save()
+        HTTP_CACHE.report()
 
     print("✅ TMDB terminé")
 
 
+def run(config: dict | None = None):
+    """Tâche Airflow : config = TMDB_STAGE, SNAPSHOT_DATE, RUN_ID, OUTPUT_DIR, TMDB_PAGES (popular)
+    ou TMDB_RATE_LIMIT et SHARD_INDEX / SHARD_COUNT (details)"""
+    return run_module(__name__, config)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,145 @@
+"""
+Cache HTTP persistant (TMDB / OMDb) avec revalidation conditionnelle
+
+- clé = URL + paramètres triés (hors clé d'API)
+- index/<kk>/<clé>.json : ETag, Last-Modified, hash du contenu, dates
+- objects/<hh>/<hash>.json : corps de réponse, stocké une seule fois par contenu
+- TTL : en dessous, réponse servie localement sans requête ;
+  au-delà, requête conditionnelle (If-None-Match / If-Modified-Since)
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urlencode
+
+SECRET_PARAMS = {"api_key", "apikey"}
+
+
+def _atomic_write(path: Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+class HttpCache:
+    """Cache disque partagé entre threads (compteurs hit/miss inclus)"""
+
+    def __init__(self, root: Path, ttl: float = 0, enabled: bool = True):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stats = {"hit": 0, "revalidated": 0, "miss": 0}
+
+    # --- clés / chemins -------------------------------------------------
+
+    @staticmethod
+    def key(url: str, params: dict | None) -> str:
+        public = sorted((k, v) for k, v in (params or {}).items() if k not in SECRET_PARAMS)
+        return hashlib.sha256(f"{url}?{urlencode(public)}".encode("utf-8")).hexdigest()
+
+    def _index_path(self, key: str) -> Path:
+        return self.root / "index" / key[:2] / f"{key}.json"
+
+    def _object_path(self, content_hash: str) -> Path:
+        return self.root / "objects" / content_hash[:2] / f"{content_hash}.json"
+
+    def _count(self, kind: str) -> None:
+        with self.lock:
+            self.stats[kind] += 1
+
+    # --- lecture ----------------------------------------------------------
+
+    def lookup(self, url: str, params: dict | None, ttl: float | None = None):
+        """Retourne (entry, data_si_fraîche). data est None si une requête est nécessaire."""
+        if not self.enabled:
+            return None, None
+
+        index_path = self._index_path(self.key(url, params))
+        if not index_path.exists():
+            return None, None
+
+        try:
+            entry = json.loads(index_path.read_bytes())
+        except (OSError, ValueError):
+            return None, None
+
+        ttl = self.ttl if ttl is None else ttl
+        if time.time() - entry.get("validated_at", 0) < ttl:
+            data = self._read_object(entry)
+            if data is not None:
+                self._count("hit")
+                return entry, data
+        return entry, None
+
+    @staticmethod
+    def conditional_headers(entry: dict | None) -> dict:
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def stale_data(self, entry: dict):
+        """Corps d'une entrée expirée, servi faute de pouvoir revalider (quota, panne)"""
+        return self._read_object(entry)
+
+    def _read_object(self, entry: dict):
+        try:
+            return json.loads(self._object_path(entry["content_hash"]).read_bytes())
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # --- écriture ---------------------------------------------------------
+
+    def revalidated(self, url: str, params: dict | None, entry: dict):
+        """Réponse 304 : contenu inchangé, on prolonge l'entrée"""
+        data = self._read_object(entry)
+        if data is None:
+            return None
+        entry["validated_at"] = time.time()
+        _atomic_write(self._index_path(self.key(url, params)), json.dumps(entry).encode("utf-8"))
+        self._count("revalidated")
+        return data
+
+    def store(self, url: str, params: dict | None, response):
+        """Réponse 200 : stocke le corps (par hash) et met à jour l'index"""
+        body = response.content
+        data = json.loads(body)
+        self._count("miss")
+        if not self.enabled:
+            return data
+
+        content_hash = hashlib.sha256(body).hexdigest()
+        object_path = self._object_path(content_hash)
+        if not object_path.exists():
+            _atomic_write(object_path, body)
+
+        now = time.time()
+        entry = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": content_hash,
+            "fetched_at": now,
+            "validated_at": now,
+        }
+        _atomic_write(self._index_path(self.key(url, params)), json.dumps(entry).encode("utf-8"))
+        return data
+
+    def report(self, label: str = "HTTP cache") -> None:
+        total = sum(self.stats.values())
+        local = self.stats["hit"] + self.stats["revalidated"]
+        ratio = local / total if total else 0.0
+        print(
+            f"🗄️  {label}: {self.stats['hit']} hits, {self.stats['revalidated']} revalidés (304), "
+            f"{self.stats['miss']} téléchargés | {ratio:.0%} servis localement"
+        )
@@ -0,0 +1,112 @@
+"""
+Écriture zone raw en segments NDJSON compressés
+
+Un enregistrement { _meta, data } par ligne, compression zstd (si le module
+zstandard est installé) ou gzip, rotation quand un segment dépasse max_bytes.
+Un segment est écrit sous un nom temporaire puis renommé à sa fermeture :
+le loader ne voit jamais de segment incomplet.
+Relecture (JSON ou segments) : common/raw_reader.py, partagé avec le chargement PostgreSQL.
+"""
+
+import os
+import gzip
+import json
+import uuid
+import threading
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # optionnel
+    zstandard = None
+
+
+def default_compression() -> str:
+    return "zstd" if zstandard is not None else "gzip"
+
+
+class SegmentWriter:
+    """Writer thread-safe : part-<prefix>-<token>-<n>.ndjson.(gz|zst) dans un dossier date=...
+
+    token : propre à chaque writer, un run relancé dans le même processus (même RUN_ID, même pid)
+    n'écrase pas les segments déjà validés
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        prefix: str,
+        compression: str | None = None,
+        max_bytes: int = 64 * 1024 * 1024,
+        on_commit=None,
+    ):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.token = uuid.uuid4().hex[:8]
+        self.compression = compression or default_compression()
+        if self.compression == "zstd" and zstandard is None:
+            print("⚠️ zstandard non installé, repli sur gzip")
+            self.compression = "gzip"
+        self.max_bytes = max_bytes
+        self.on_commit = on_commit
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.segments = []
+        self._stream = None
+        self._raw = None
+        self._tmp_path = None
+        self._final_path = None
+        self._bytes = 0
+        self._keys = []
+
+    @property
+    def extension(self) -> str:
+        return ".ndjson.zst" if self.compression == "zstd" else ".ndjson.gz"
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.seq += 1
+        self._final_path = self.directory / f"part-{self.prefix}-{self.token}-{self.seq:05d}{self.extension}"
+        self._tmp_path = self._final_path.with_name(f".{self._final_path.name}.tmp")
+        self._raw = open(self._tmp_path, "wb")
+        if self.compression == "zstd":
+            self._stream = zstandard.ZstdCompressor(level=3).stream_writer(self._raw)
+        else:
+            self._stream = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=6)
+        self._bytes = 0
+        self._keys = []
+
+    def _close_segment(self):
+        if self._stream is None:
+            return
+        self._stream.close()
+        if not self._raw.closed:
+            self._raw.close()
+        os.replace(self._tmp_path, self._final_path)
+        self.segments.append(self._final_path)
+        keys = self._keys
+        self._stream = self._raw = None
+        if self.on_commit is not None and keys:
+            self.on_commit(keys)
+
+    def write(self, record: dict, key=None) -> None:
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        with self.lock:
+            if self._stream is None:
+                self._open()
+            self._stream.write(line)
+            self._bytes += len(line)
+            if key is not None:
+                self._keys.append(key)
+            if self._bytes >= self.max_bytes:
+                self._close_segment()
+
+    def close(self) -> None:
+        with self.lock:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,10 +1,30 @@
 import os
+import io
+import sys
 import json
-from datetime import datetime
+import re
+import time
+import hashlib
+import multiprocessing
+from collections import deque
+from datetime import date, datetime
 from pathlib import Path
 
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.raw_reader import iter_raw_records, raw_files, unwrap
+from common.shards import in_shard_file, shard_label, sharded, write_shard_manifest
+from common.task_runner import run_module
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:  # optionnel (décodeur JSON plus rapide)
+    json_loads = json.loads
 
 PG_HOST = os.getenv("POSTGRES_HOST", "postgres")
 PG_PORT = int(os.getenv("POSTGRES_PORT", "5432"))
@@ -16,6 +36,34 @@ DATA_DIR = os.getenv("DATA_DIR", "/opt/airflow/datalake/raw")
 SNAPSHOT_DATE = os.getenv("SNAPSHOT_DATE") or datetime.now().strftime("%Y-%m-%d")
 RUN_ID = os.getenv("RUN_ID") or datetime.now().strftime("%Y%m%d%H%M%S")
 
+# "bulk" = COPY vers table temporaire + upsert ensembliste ; "row" = INSERT par ligne (repli)
+LOAD_MODE = os.getenv("LOAD_MODE", "bulk")
+COPY_CHUNK_ROWS = int(os.getenv("COPY_CHUNK_ROWS", "5000"))
+
+# Pipeline de parsing : N processus décodent, une seule connexion écrit
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(min(4, os.cpu_count() or 1))))
+LOAD_BATCH_FILES = int(os.getenv("LOAD_BATCH_FILES", "200"))  # fichiers JSON par lot
+LOAD_QUEUE_SIZE = int(os.getenv("LOAD_QUEUE_SIZE", str(2 * max(1, LOAD_WORKERS))))  # lots en vol
+
+# Étape : "all" (tout), "prepare" (schéma, partitions, rétention, popular) ou
+# "shard" (détails TMDB + OMDb des fichiers du shard SHARD_INDEX / SHARD_COUNT)
+LOAD_STAGE = os.getenv("LOAD_STAGE", "all")
+
+# Manifeste fichier : seuls les fichiers nouveaux/modifiés sont rechargés (FORCE_RELOAD=1 pour tout relire)
+FORCE_RELOAD = os.getenv("FORCE_RELOAD", "0") == "1"
+
+# Partitionnement mensuel des tables raw par snapshot_date
+RAW_PARTITIONS_AHEAD = int(os.getenv("RAW_PARTITIONS_AHEAD", "2"))  # mois créés à l'avance
+RAW_RETENTION_MONTHS = int(os.getenv("RAW_RETENTION_MONTHS", "0"))  # 0 = on garde tout
+RAW_RETENTION_ACTION = os.getenv("RAW_RETENTION_ACTION", "detach")  # detach | drop
+
+# colonnes chargées (payload en dernier) et clé de conflit par table raw
+RAW_TABLES = {
+    "raw_tmdb_popular": (["snapshot_date", "tmdb_id", "title", "payload"], ["snapshot_date", "tmdb_id"]),
+    "raw_tmdb_details": (["snapshot_date", "tmdb_id", "imdb_id", "title", "payload"], ["snapshot_date", "tmdb_id"]),
+    "raw_omdb_ratings": (["snapshot_date", "imdb_id", "title", "payload"], ["snapshot_date", "imdb_id"]),
+}
+
 
 def connect():
     return psycopg2.connect(
@@ -28,33 +76,26 @@ def connect():
 
 
 def read_json(path: Path) -> dict:
-    with path.open("r", encoding="utf-8") as f:
-        return json.load(f)
-
+    return json_loads(path.read_bytes())
 
-def unwrap(obj: dict) -> dict:
-    """Accepte ancien format (payload direct) ou nouveau format { _meta, data }"""
-    if isinstance(obj, dict) and "data" in obj and "_meta" in obj:
-        return obj["data"]
-    return obj
 
+def shard_files(files: list[Path]) -> list[Path]:
+    """Fichiers du shard courant (tous si SHARD_COUNT=1)"""
+    if LOAD_STAGE != "shard" or not sharded():
+        return files
+    return [path for path in files if in_shard_file(path)]
 
-def ensure_schema_and_tables(cur):
-    cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
 
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS raw.raw_tmdb_popular (
+RAW_DDL = {
+    "raw_tmdb_popular": """
             snapshot_date DATE NOT NULL,
             tmdb_id       BIGINT NOT NULL,
             title         TEXT,
             payload       JSONB NOT NULL,
             created_at    TIMESTAMP DEFAULT NOW(),
             PRIMARY KEY (snapshot_date, tmdb_id)
-        );
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS raw.raw_tmdb_details (
+    """,
+    "raw_tmdb_details": """
             snapshot_date DATE NOT NULL,
             tmdb_id       BIGINT NOT NULL,
             imdb_id       TEXT,
@@ -62,74 +103,439 @@ def ensure_schema_and_tables(cur):
             payload       JSONB NOT NULL,
             created_at    TIMESTAMP DEFAULT NOW(),
             PRIMARY KEY (snapshot_date, tmdb_id)
-        );
-    """)
-
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS raw.raw_omdb_ratings (
+    """,
+    "raw_omdb_ratings": """
             snapshot_date DATE NOT NULL,
             imdb_id       TEXT NOT NULL,
             title         TEXT,
             payload       JSONB NOT NULL,
             created_at    TIMESTAMP DEFAULT NOW(),
             PRIMARY KEY (snapshot_date, imdb_id)
+    """,
+}
+
+
+def month_start(d: date) -> date:
+    return d.replace(day=1)
+
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(y, m + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def table_kind(cur, table: str):
+    """'r' = table classique, 'p' = table partitionnée, None = absente"""
+    cur.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'raw' AND c.relname = %s;
+    """, (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def ensure_partition(cur, table: str, month: date) -> None:
+    name = partition_name(table, month)
+    cur.execute("""
+        SELECT i.inhparent IS NOT NULL
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_inherits i ON i.inhrelid = c.oid AND i.inhparent = %s::regclass
+        WHERE n.nspname = 'raw' AND c.relname = %s;
+    """, (f"raw.{table}", name))
+    row = cur.fetchone()
+    if row and not row[0]:
+        # CREATE TABLE IF NOT EXISTS ne ferait rien et les INSERT échoueraient faute de partition
+        raise RuntimeError(f"❌ raw.{name} existe mais n'est pas une partition de raw.{table} "
+                           f"(renommez-la ou rattachez-la avec ALTER TABLE ... ATTACH PARTITION)")
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS raw.{name} "
+        f"PARTITION OF raw.{table} FOR VALUES FROM (%s) TO (%s);",
+        (month, add_months(month, 1)),
+    )
+
+
+def ensure_partitions(cur, table: str, first: date, last: date) -> None:
+    month = month_start(first)
+    while month <= last:
+        ensure_partition(cur, table, month)
+        month = add_months(month, 1)
+
+
+def migrate_to_partitioned(cur, table: str) -> None:
+    """Table classique existante → table partitionnée (copie puis suppression de l'ancienne)"""
+    legacy = f"{table}_legacy"
+    print(f"🔁 Migration {table} vers une table partitionnée")
+
+    cur.execute("""
+        SELECT con.conname
+        FROM pg_constraint con
+        JOIN pg_class c ON c.oid = con.conrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'raw' AND c.relname = %s AND con.contype = 'p';
+    """, (table,))
+    pkey = cur.fetchone()
+
+    cur.execute(f"ALTER TABLE raw.{table} RENAME TO {legacy};")
+    if pkey:
+        cur.execute(f"ALTER TABLE raw.{legacy} RENAME CONSTRAINT {pkey[0]} TO {legacy}_pkey;")
+
+    cur.execute(f"CREATE TABLE raw.{table} ({RAW_DDL[table]}) PARTITION BY RANGE (snapshot_date);")
+
+    cur.execute(f"SELECT MIN(snapshot_date), MAX(snapshot_date) FROM raw.{legacy};")
+    first, last = cur.fetchone()
+    if first is not None:
+        ensure_partitions(cur, table, first, last)
+
+    columns = RAW_TABLES[table][0] + ["created_at"]
+    cols = ", ".join(columns)
+    cur.execute(f"INSERT INTO raw.{table} ({cols}) SELECT {cols} FROM raw.{legacy};")
+    print(f"   ✅ {cur.rowcount} lignes migrées")
+    cur.execute(f"DROP TABLE raw.{legacy};")
+
+
+def ensure_schema_and_tables(cur, snapshot_date: str | None = None):
+    cur.execute("CREATE SCHEMA IF NOT EXISTS raw;")
+
+    current = month_start(date.fromisoformat(snapshot_date or SNAPSHOT_DATE))
+    for table, ddl in RAW_DDL.items():
+        kind = table_kind(cur, table)
+        if kind is None:
+            cur.execute(f"CREATE TABLE raw.{table} ({ddl}) PARTITION BY RANGE (snapshot_date);")
+        elif kind == "r":
+            migrate_to_partitioned(cur, table)
+
+        # partition du snapshot courant + quelques mois à l'avance
+        ensure_partitions(cur, table, current, add_months(current, RAW_PARTITIONS_AHEAD))
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS raw.load_manifest (
+            path          TEXT PRIMARY KEY,
+            snapshot_date DATE NOT NULL,
+            target_table  TEXT NOT NULL,
+            size_bytes    BIGINT NOT NULL,
+            mtime         DOUBLE PRECISION NOT NULL,
+            content_hash  TEXT NOT NULL,
+            run_id        TEXT,
+            loaded_at     TIMESTAMP DEFAULT NOW()
         );
     """)
 
     print("✅ Schéma et tables créés/vérifiés")
 
 
-def load_tmdb_popular(cur, snapshot_date: str):
-    popular_path = Path(DATA_DIR) / "tmdb" / "popular" / f"date={snapshot_date}" / "popular_movies.json"
-    if not popular_path.exists():
-        print(f"⚠️ TMDB popular introuvable: {popular_path}")
-        return 0
+def ensure_range_partitions(cur, date_from: str, date_to: str) -> None:
+    """Schéma + partitions de tous les mois de la plage (backfill : DDL avant les chargements parallèles)"""
+    ensure_schema_and_tables(cur, date_from)
+    first, last = month_start(date.fromisoformat(date_from)), month_start(date.fromisoformat(date_to))
+    for table in RAW_DDL:
+        ensure_partitions(cur, table, first, last)
 
-    wrapped = read_json(popular_path)
-    data = unwrap(wrapped)
 
-    movies = data.get("results", []) if isinstance(data, dict) else []
-    if not movies:
-        print("⚠️ TMDB popular: aucun film")
-        return 0
+def apply_retention(cur, snapshot_date: str) -> None:
+    """Détache (ou supprime) les partitions plus anciennes que RAW_RETENTION_MONTHS"""
+    if RAW_RETENTION_MONTHS <= 0:
+        return
 
-    inserted = 0
-    for m in movies:
-        tmdb_id = m.get("id")
-        title = m.get("title")
-        if not tmdb_id:
+    cutoff = add_months(month_start(date.fromisoformat(snapshot_date)), -RAW_RETENTION_MONTHS)
+    for table in RAW_DDL:
+        cur.execute("""
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            JOIN pg_namespace n ON n.oid = p.relnamespace
+            WHERE n.nspname = 'raw' AND p.relname = %s;
+        """, (table,))
+        for (name,) in cur.fetchall():
+            m = re.fullmatch(rf"{table}_p(\d{{4}})_(\d{{2}})", name)
+            if not m or date(int(m.group(1)), int(m.group(2)), 1) >= cutoff:
+                continue
+            cur.execute(f"ALTER TABLE raw.{table} DETACH PARTITION raw.{name};")
+            if RAW_RETENTION_ACTION == "drop":
+                cur.execute(f"DROP TABLE raw.{name};")
+                print(f"🗑️  Rétention: {name} supprimée")
+            else:
+                # renommée pour libérer le nom : un rechargement de ce mois recréera la partition
+                detached = f"{name}_detached_{snapshot_date.replace('-', '')}"
+                cur.execute(f"ALTER TABLE raw.{name} RENAME TO {detached};")
+                print(f"🗑️  Rétention: {name} détachée → {detached}")
+
+    # les fichiers de ces dates devront être rechargés si on les rejoue
+    cur.execute("DELETE FROM raw.load_manifest WHERE snapshot_date < %s;", (cutoff,))
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def plan_files(cur, files: list[Path], snapshot_date: str, table: str):
+    """Compare au manifeste : renvoie (fichiers à charger, entrées manifeste, nb ignorés)"""
+    cur.execute(
+        "SELECT path, size_bytes, mtime, content_hash FROM raw.load_manifest WHERE snapshot_date = %s",
+        (snapshot_date,),
+    )
+    known = {path: (size, mtime, content_hash) for path, size, mtime, content_hash in cur.fetchall()}
+
+    todo, entries, skipped = [], [], 0
+    for path in files:
+        rel = path.relative_to(DATA_DIR).as_posix()
+        st = path.stat()
+        previous = None if FORCE_RELOAD else known.get(rel)
+
+        # taille + mtime identiques : pas besoin de relire le fichier
+        if previous and previous[0] == st.st_size and previous[1] == st.st_mtime:
+            skipped += 1
             continue
 
-        cur.execute("""
-            INSERT INTO raw.raw_tmdb_popular (snapshot_date, tmdb_id, title, payload)
-            VALUES (%s, %s, %s, %s)
-            ON CONFLICT (snapshot_date, tmdb_id)
+        content_hash = file_hash(path)
+        entries.append((rel, snapshot_date, table, st.st_size, st.st_mtime, content_hash, RUN_ID))
+        if previous and previous[2] == content_hash:
+            # simple touch : contenu inchangé, on met juste à jour le manifeste
+            skipped += 1
+            continue
+        todo.append(path)
+
+    return todo, entries, skipped
+
+
+def record_manifest(cur, entries: list[tuple]) -> None:
+    if not entries:
+        return
+    execute_values(cur, """
+        INSERT INTO raw.load_manifest (path, snapshot_date, target_table, size_bytes, mtime, content_hash, run_id)
+        VALUES %s
+        ON CONFLICT (path)
+        DO UPDATE SET
+            size_bytes = EXCLUDED.size_bytes,
+            mtime = EXCLUDED.mtime,
+            content_hash = EXCLUDED.content_hash,
+            run_id = EXCLUDED.run_id,
+            loaded_at = NOW();
+    """, entries)
+
+
+def copy_value(value) -> str:
+    """Encode une valeur au format texte de COPY"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def encode_copy_rows(rows) -> tuple[str, int]:
+    """Encode des lignes en un bloc texte COPY (fait côté worker en mode pipeline)"""
+    buf = io.StringIO()
+    n = 0
+    for row in rows:
+        buf.write("\t".join(copy_value(v) for v in row))
+        buf.write("\n")
+        n += 1
+    return buf.getvalue(), n
+
+
+def iter_copy_chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= COPY_CHUNK_ROWS:
+            yield encode_copy_rows(chunk)
+            chunk = []
+    if chunk:
+        yield encode_copy_rows(chunk)
+
+
+def upsert_chunks_bulk(cur, table: str, chunks) -> int:
+    """COPY FROM STDIN vers une table temporaire puis un seul INSERT ... SELECT ... ON CONFLICT"""
+    columns, key = RAW_TABLES[table]
+    staging = f"tmp_{table}"
+    cols = ", ".join(columns)
+    keys = ", ".join(key)
+    updates = ",\n                ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in key)
+
+    cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {staging} (
+            LIKE raw.{table} INCLUDING DEFAULTS,
+            _seq BIGSERIAL
+        ) ON COMMIT DROP;
+    """)
+    cur.execute(f"TRUNCATE {staging};")
+
+    for text, n in chunks:
+        if n:
+            with metrics.span("db_copy", rows=n, bytes=len(text)):
+                cur.copy_expert(f"COPY {staging} ({cols}) FROM STDIN", io.StringIO(text))
+
+    # DISTINCT ON : une clé présente plusieurs fois garde la dernière version (comme en mode row)
+    with metrics.span("db_upsert") as s:
+        cur.execute(f"""
+            INSERT INTO raw.{table} ({cols})
+            SELECT DISTINCT ON ({keys}) {cols}
+            FROM {staging}
+            ORDER BY {keys}, _seq DESC
+            ON CONFLICT ({keys})
             DO UPDATE SET
-                title = EXCLUDED.title,
-                payload = EXCLUDED.payload;
-        """, (snapshot_date, tmdb_id, title, Json(m)))
-        inserted += 1
+                    {updates};
+        """)
+        s.add(rows=cur.rowcount)
+    return cur.rowcount
+
+
+def upsert_rows_per_row(cur, table: str, rows) -> int:
+    """Repli : un INSERT ... ON CONFLICT par enregistrement"""
+    columns, key = RAW_TABLES[table]
+    updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in columns if c not in key)
+    sql = f"""
+        INSERT INTO raw.{table} ({", ".join(columns)})
+        VALUES ({", ".join(["%s"] * len(columns))})
+        ON CONFLICT ({", ".join(key)})
+        DO UPDATE SET {updates};
+    """
 
+    inserted = 0
+    with metrics.span("db_upsert") as s:
+        for row in rows:
+            cur.execute(sql, (*row[:-1], Json(row[-1])))
+            inserted += 1
+        s.add(rows=inserted)
     return inserted
 
 
-def load_tmdb_details(cur, snapshot_date: str):
-    details_dir = Path(DATA_DIR) / "tmdb" / "details" / f"date={snapshot_date}"
-    if not details_dir.exists():
-        print(f"⚠️ TMDB details introuvable: {details_dir}")
+def upsert_rows(cur, table: str, rows) -> int:
+    if LOAD_MODE == "row":
+        return upsert_rows_per_row(cur, table, rows)
+    return upsert_chunks_bulk(cur, table, iter_copy_chunks(rows))
+
+
+def file_batches(files: list[Path]) -> list[list[Path]]:
+    """Regroupe les petits fichiers JSON ; un segment NDJSON forme un lot à lui seul"""
+    batches, current = [], []
+    for path in files:
+        if path.suffix != ".json":
+            batches.append([path])
+            continue
+        current.append(path)
+        if len(current) >= LOAD_BATCH_FILES:
+            batches.append(current)
+            current = []
+    if current:
+        batches.append(current)
+    return batches
+
+
+def parse_batch(kind: str, files: list[Path], snapshot_date: str):
+    """Tâche worker : lit + décode un lot, renvoie (lignes (mode row) ou bloc COPY (mode bulk), durée, nb lignes)"""
+    started = time.perf_counter()
+    rows_fn = iter_tmdb_details_rows if kind == "details" else iter_omdb_rows
+    rows = list(rows_fn(files, snapshot_date))
+    parsed = rows if LOAD_MODE == "row" else encode_copy_rows(rows)
+    return parsed, time.perf_counter() - started, len(rows)
+
+
+def parsed_result(outcome: tuple):
+    """Côté writer : durée mesurée dans le worker ajoutée au span json_parse"""
+    parsed, seconds, rows = outcome
+    metrics.record("json_parse", seconds, rows=rows)
+    return parsed
+
+
+def parse_workers() -> int:
+    """LOAD_WORKERS, ramené à 1 dans un processus démon (ex. tâche Airflow forkée d'un worker
+    du LocalExecutor) : multiprocessing y refuse de créer des processus enfants"""
+    if LOAD_WORKERS > 1 and multiprocessing.current_process().daemon:
+        return 1
+    return LOAD_WORKERS
+
+
+def iter_parsed_batches(kind: str, files: list[Path], snapshot_date: str):
+    """Lots décodés dans l'ordre, au plus LOAD_QUEUE_SIZE en vol (mémoire bornée)"""
+    batches = file_batches(files)
+    workers = parse_workers()
+    if workers <= 1:
+        for batch in batches:
+            yield parsed_result(parse_batch(kind, batch, snapshot_date))
+        return
+
+    from concurrent.futures import ProcessPoolExecutor  # import différé : inutile en mode séquentiel
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(parse_batch, kind, batch, snapshot_date))
+            if len(pending) >= LOAD_QUEUE_SIZE:
+                yield parsed_result(pending.popleft().result())
+        while pending:
+            yield parsed_result(pending.popleft().result())
+
+
+def upsert_files(cur, table: str, kind: str, files: list[Path], snapshot_date: str) -> int:
+    batches = iter_parsed_batches(kind, files, snapshot_date)
+    if LOAD_MODE == "row":
+        return upsert_rows_per_row(cur, table, (row for rows in batches for row in rows))
+    return upsert_chunks_bulk(cur, table, batches)
+
+
+def load_tmdb_popular(cur, snapshot_date: str):
+    popular_dir = Path(DATA_DIR) / "tmdb" / "popular" / f"date={snapshot_date}"
+    # popular_movies.json (page 1) + popular_movies_pNNN.json (pages suivantes)
+    popular_files = sorted(popular_dir.glob("popular_movies*.json"))
+    if not popular_files:
+        print(f"⚠️ TMDB popular introuvable: {popular_dir}")
         return 0
 
-    json_files = list(details_dir.glob("*.json"))
-    if not json_files:
-        print(f"⚠️ TMDB details: aucun fichier JSON dans {details_dir}")
+    # peu de pages : si une seule a changé on recharge toutes les pages (dédoublonnage cohérent)
+    todo, entries, skipped = plan_files(cur, popular_files, snapshot_date, "raw_tmdb_popular")
+    if not todo:
+        record_manifest(cur, entries)
+        print(f"⏭️  TMDB popular: {skipped} fichiers inchangés ignorés")
         return 0
 
-    print(f"📁 TMDB details: {len(json_files)} fichiers")
-    inserted = 0
+    # un film peut apparaître sur deux pages : on garde la première occurrence
+    by_id = {}
+    for popular_path in popular_files:
+        data = unwrap(read_json(popular_path))
+        for m in (data.get("results", []) if isinstance(data, dict) else []):
+            by_id.setdefault(m.get("id"), m)
+    movies = list(by_id.values())
+
+    if not movies:
+        print("⚠️ TMDB popular: aucun film")
+        return 0
 
-    for json_file in json_files:
+    rows = (
+        (snapshot_date, m.get("id"), m.get("title"), m)
+        for m in movies
+        if m.get("id")
+    )
+    inserted = upsert_rows(cur, "raw_tmdb_popular", rows)
+    record_manifest(cur, [
+        (path.relative_to(DATA_DIR).as_posix(), snapshot_date, "raw_tmdb_popular",
+         path.stat().st_size, path.stat().st_mtime, file_hash(path), RUN_ID)
+        for path in popular_files
+    ])
+    return inserted
+
+
+def iter_tmdb_details_rows(files: list[Path], snapshot_date: str):
+    for name, wrapped in iter_raw_records(files, json_loads):
         try:
-            wrapped = read_json(json_file)
             details = unwrap(wrapped)
 
             tmdb_id = details.get("id")
@@ -139,90 +545,120 @@ def load_tmdb_details(cur, snapshot_date: str):
             if not tmdb_id:
                 continue
 
-            cur.execute("""
-                INSERT INTO raw.raw_tmdb_details (snapshot_date, tmdb_id, imdb_id, title, payload)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (snapshot_date, tmdb_id)
-                DO UPDATE SET
-                    imdb_id = EXCLUDED.imdb_id,
-                    title = EXCLUDED.title,
-                    payload = EXCLUDED.payload;
-            """, (snapshot_date, tmdb_id, imdb_id, title, Json(details)))
-            inserted += 1
+            yield (snapshot_date, tmdb_id, imdb_id, title, details)
 
         except Exception as e:
-            print(f"⚠️ Erreur lecture {json_file.name}: {e}")
+            print(f"⚠️ Erreur lecture {name}: {e}")
             continue
 
-    return inserted
-
 
-def load_omdb_ratings(cur, snapshot_date: str):
-    omdb_dir = Path(DATA_DIR) / "omdb" / "ratings" / f"date={snapshot_date}"
-    if not omdb_dir.exists():
-        print(f"⚠️ OMDb ratings introuvable: {omdb_dir}")
+def load_tmdb_details(cur, snapshot_date: str):
+    details_dir = Path(DATA_DIR) / "tmdb" / "details" / f"date={snapshot_date}"
+    if not details_dir.exists():
+        print(f"⚠️ TMDB details introuvable: {details_dir}")
         return 0
 
-    json_files = list(omdb_dir.glob("*.json"))
-    if not json_files:
-        print(f"⚠️ OMDb ratings: aucun fichier JSON dans {omdb_dir}")
+    files = shard_files(raw_files(details_dir))
+    if not files:
+        print(f"⚠️ TMDB details: aucun fichier JSON/NDJSON dans {details_dir}")
         return 0
 
-    print(f"📁 OMDb ratings: {len(json_files)} fichiers")
-    inserted = 0
+    todo, entries, skipped = plan_files(cur, files, snapshot_date, "raw_tmdb_details")
+    print(f"📁 TMDB details: {len(files)} fichiers | {len(todo)} à charger | {skipped} inchangés ignorés")
 
-    for json_file in json_files:
+    inserted = upsert_files(cur, "raw_tmdb_details", "details", todo, snapshot_date) if todo else 0
+    record_manifest(cur, entries)
+    return inserted
+
+
+def iter_omdb_rows(files: list[Path], snapshot_date: str):
+    for name, wrapped in iter_raw_records(files, json_loads):
         try:
-            wrapped = read_json(json_file)
             omdb = unwrap(wrapped)
 
-            imdb_id = json_file.stem
+            # nom de fichier (ancien format) ou _meta.key (segments NDJSON)
+            imdb_id = omdb.get("imdbID") if ":" in name else name
             title = omdb.get("Title")
 
             if omdb.get("Response") != "True":
                 continue
 
-            cur.execute("""
-                INSERT INTO raw.raw_omdb_ratings (snapshot_date, imdb_id, title, payload)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (snapshot_date, imdb_id)
-                DO UPDATE SET
-                    title = EXCLUDED.title,
-                    payload = EXCLUDED.payload;
-            """, (snapshot_date, imdb_id, title, Json(omdb)))
-            inserted += 1
+            yield (snapshot_date, imdb_id, title, omdb)
 
         except Exception as e:
-            print(f"⚠️ Erreur lecture {json_file.name}: {e}")
+            print(f"⚠️ Erreur lecture {name}: {e}")
             continue
 
+
+def load_omdb_ratings(cur, snapshot_date: str):
+    omdb_dir = Path(DATA_DIR) / "omdb" / "ratings" / f"date={snapshot_date}"
+    if not omdb_dir.exists():
+        print(f"⚠️ OMDb ratings introuvable: {omdb_dir}")
+        return 0
+
+    files = shard_files(raw_files(omdb_dir))
+    if not files:
+        print(f"⚠️ OMDb ratings: aucun fichier JSON/NDJSON dans {omdb_dir}")
+        return 0
+
+    todo, entries, skipped = plan_files(cur, files, snapshot_date, "raw_omdb_ratings")
+    print(f"📁 OMDb ratings: {len(files)} fichiers | {len(todo)} à charger | {skipped} inchangés ignorés")
+
+    inserted = upsert_files(cur, "raw_omdb_ratings", "omdb", todo, snapshot_date) if todo else 0
+    record_manifest(cur, entries)
     return inserted
 
 
+def load_snapshot(cur, snapshot_date: str, stage: str = "all") -> dict:
+    """Charge les fichiers raw d'un snapshot (schéma et partitions supposés prêts) ; renvoie les lignes par table"""
+    stats = {}
+    if stage in ("all", "prepare"):
+        n_pop = load_tmdb_popular(cur, snapshot_date)
+        print(f"✅ raw_tmdb_popular [{snapshot_date}]: {n_pop} lignes")
+        stats["raw_tmdb_popular"] = n_pop
+
+    if stage in ("all", "shard"):
+        n_det = load_tmdb_details(cur, snapshot_date)
+        print(f"✅ raw_tmdb_details [{snapshot_date}]: {n_det} lignes")
+
+        n_omd = load_omdb_ratings(cur, snapshot_date)
+        print(f"✅ raw_omdb_ratings [{snapshot_date}]: {n_omd} lignes")
+        stats.update(raw_tmdb_details=n_det, raw_omdb_ratings=n_omd)
+    return stats
+
+
+@metrics.instrumented(lambda: f"load_postgres_{LOAD_STAGE}")
 def main():
-    print(f"🐘 LOAD PostgreSQL (raw) | snapshot_date={SNAPSHOT_DATE} | run_id={RUN_ID}")
+    label = f" | shard {shard_label()}" if LOAD_STAGE == "shard" and sharded() else ""
+    print(f"🐘 LOAD PostgreSQL (raw) | snapshot_date={SNAPSHOT_DATE} | run_id={RUN_ID} | étape={LOAD_STAGE}{label}")
     print(f"Source: {DATA_DIR}")
     print(f"Connexion: {PG_HOST}:{PG_PORT} db={PG_DB} user={PG_USER}")
+    print(f"Mode: {LOAD_MODE} | workers={parse_workers()}")
+    if parse_workers() < LOAD_WORKERS:
+        print(f"⚠️  Processus démon : LOAD_WORKERS={LOAD_WORKERS} ignoré, décodage dans le processus de la tâche")
 
     conn = connect()
     try:
         with conn:
             with conn.cursor() as cur:
-                ensure_schema_and_tables(cur)
-
-                n_pop = load_tmdb_popular(cur, SNAPSHOT_DATE)
-                print(f"✅ raw_tmdb_popular: {n_pop} lignes")
+                # DDL (partitions, rétention) une seule fois, avant les shards parallèles
+                if LOAD_STAGE in ("all", "prepare"):
+                    ensure_schema_and_tables(cur, SNAPSHOT_DATE)
+                    apply_retention(cur, SNAPSHOT_DATE)
 
-                n_det = load_tmdb_details(cur, SNAPSHOT_DATE)
-                print(f"✅ raw_tmdb_details: {n_det} lignes")
-
-                n_omd = load_omdb_ratings(cur, SNAPSHOT_DATE)
-                print(f"✅ raw_omdb_ratings: {n_omd} lignes")
+                stats = load_snapshot(cur, SNAPSHOT_DATE, LOAD_STAGE)
 
+        write_shard_manifest(DATA_DIR, SNAPSHOT_DATE, RUN_ID, f"load_{LOAD_STAGE}", stats)
         print("🎉 LOAD terminé")
     finally:
         conn.close()
 
 
+def run(config: dict | None = None):
+    """Tâche Airflow : config = LOAD_STAGE, SNAPSHOT_DATE, RUN_ID, DATA_DIR, POSTGRES_*,
+    LOAD_WORKERS, SHARD_INDEX / SHARD_COUNT (le backfill appelle load_snapshot directement)"""
+    return run_module(__name__, config)
+
+
 if __name__ == "__main__":
     main()
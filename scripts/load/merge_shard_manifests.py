@@ -0,0 +1,90 @@
+"""
+Fusion des manifestes de shards (étape reduce avant dbt)
+
+Vérifie que chaque étape shardée (ingest TMDB / OMDb, load) a produit le manifeste
+de tous ses shards pour ce RUN_ID, additionne les compteurs et écrit manifest.json.
+Un shard manquant fait échouer la tâche : dbt ne tourne jamais sur un jour incomplet.
+"""
+
+import os
+import sys
+import json
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.shards import SHARD_COUNT, manifest_dir
+from common.task_runner import run_module
+
+DATA_DIR = os.getenv("DATA_DIR", "/opt/airflow/datalake/raw")
+SNAPSHOT_DATE = os.getenv("SNAPSHOT_DATE") or datetime.now().strftime("%Y-%m-%d")
+RUN_ID = os.getenv("RUN_ID") or datetime.now().strftime("%Y%m%d%H%M%S")
+
+# étapes shardées attendues (SHARD_COUNT manifestes chacune)
+MERGE_STAGES = [s for s in os.getenv("MERGE_STAGES", "tmdb_details,omdb,load_shard").split(",") if s]
+
+
+def read_stage(directory: Path, stage: str) -> tuple[list[dict], list[int]]:
+    manifests, missing = [], []
+    for index in range(SHARD_COUNT):
+        path = directory / f"{stage}-s{index}of{SHARD_COUNT}.json"
+        if not path.exists():
+            missing.append(index)
+            continue
+        with path.open("r", encoding="utf-8") as f:
+            manifests.append(json.load(f))
+    return manifests, missing
+
+
+@metrics.instrumented("merge_shard_manifests")
+def main():
+    directory = manifest_dir(DATA_DIR, SNAPSHOT_DATE, RUN_ID)
+    print(f"🧩 MERGE manifestes | snapshot_date={SNAPSHOT_DATE} | run_id={RUN_ID} | {SHARD_COUNT} shards")
+    print(f"Dossier: {directory}")
+
+    merged = {
+        "snapshot_date": SNAPSHOT_DATE,
+        "run_id": RUN_ID,
+        "shard_count": SHARD_COUNT,
+        "merged_at_utc": datetime.now(timezone.utc).isoformat(),
+        "stages": {},
+    }
+    incomplete = {}
+
+    for stage in MERGE_STAGES:
+        manifests, missing = read_stage(directory, stage)
+        if missing:
+            incomplete[stage] = missing
+            continue
+
+        totals = Counter()
+        for manifest in manifests:
+            totals.update({k: v for k, v in manifest.get("stats", {}).items() if isinstance(v, (int, float))})
+        merged["stages"][stage] = {
+            "totals": dict(totals),
+            "shards": {m["shard_index"]: m.get("stats", {}) for m in manifests},
+        }
+        print(f"✅ {stage}: " + ", ".join(f"{k}={v}" for k, v in sorted(totals.items())))
+
+    if incomplete:
+        detail = ", ".join(f"{stage} (shards {missing})" for stage, missing in incomplete.items())
+        raise RuntimeError(f"❌ Manifestes manquants: {detail}")
+
+    path = directory / "manifest.json"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(merged, f, indent=2)
+    os.replace(tmp, path)
+
+    print(f"🎉 Manifeste fusionné: {path}")
+
+
+def run(config: dict | None = None):
+    """Tâche Airflow (reduce) : config = SNAPSHOT_DATE, RUN_ID, DATA_DIR, SHARD_COUNT"""
+    return run_module(__name__, config)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Backfill d'une plage de snapshots : load → dbt → export → index
+
+    BACKFILL_DATE_FROM=2026-01-01 BACKFILL_DATE_TO=2026-01-31 python scripts/maintenance/backfill.py
+    python scripts/maintenance/backfill.py 2026-01-01 2026-01-31
+
+- load : un jour par tâche, BACKFILL_LOAD_PARALLEL jours en parallèle sur un pool de connexions
+  PostgreSQL partagé (schéma et partitions de toute la plage créés avant)
+- dbt : un seul `dbt run` par bloc de jours contigus (--vars date_from / date_to), ou un run par jour
+- export : un seul export par bloc (EXPORT_DATE_FROM / EXPORT_DATE_TO, une partition Hive par jour)
+- index : mode live → une passe bulk par bloc ; mode versioned → un index par jour,
+  BACKFILL_INDEX_PARALLEL jours en parallèle sur la session HTTP Elasticsearch partagée
+  (base d'empreintes commune : aucun verrou SQLite gardé pendant un envoi bulk)
+- registre JSON par jour et par étape : relancé sur la même plage, le backfill reprend
+  aux étapes non terminées (un jour en échec n'avance pas aux étapes suivantes)
+
+Les scripts sont appelés in-process (common.task_runner), avec la configuration de l'environnement.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import subprocess
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from psycopg2.pool import ThreadedConnectionPool
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+for directory in ('load', 'export', 'index'):
+    sys.path.insert(0, str(SCRIPTS_DIR / directory))
+sys.path.insert(0, str(SCRIPTS_DIR))  # scripts/ (modules communs)
+from common import metrics
+from common.task_runner import load_module, run_module, task_env
+
+BACKFILL_DATE_FROM = os.getenv('BACKFILL_DATE_FROM')
+BACKFILL_DATE_TO = os.getenv('BACKFILL_DATE_TO') or BACKFILL_DATE_FROM
+
+STAGES = ('load', 'dbt', 'export', 'index')
+BACKFILL_STAGES = [s for s in os.getenv('BACKFILL_STAGES', ','.join(STAGES)).split(',') if s]
+
+# parallélisme par étape (dbt et export travaillent sur la plage entière)
+BACKFILL_LOAD_PARALLEL = int(os.getenv('BACKFILL_LOAD_PARALLEL', '4'))
+BACKFILL_INDEX_PARALLEL = int(os.getenv('BACKFILL_INDEX_PARALLEL', '2'))
+
+# "range" : un dbt run par bloc de jours contigus ; "date" : un run par jour (séquentiel)
+BACKFILL_DBT_MODE = os.getenv('BACKFILL_DBT_MODE', 'range')
+DBT_PROJECT_DIR = os.getenv('DBT_PROJECT_DIR', '/opt/airflow/movies_analytics')
+
+DATALAKE_PATH = Path(os.getenv('OUTPUT_DIR', '/opt/airflow/datalake'))
+BACKFILL_LEDGER = os.getenv('BACKFILL_LEDGER')  # défaut : <datalake>/_state/backfill/<from>_<to>.json
+RUN_ID = os.getenv('RUN_ID') or datetime.now().strftime('backfill-%Y%m%d%H%M%S')
+
+
+def day_range(date_from: str, date_to: str) -> list[str]:
+    start, end = date.fromisoformat(date_from), date.fromisoformat(date_to)
+    if end < start:
+        raise ValueError(f"❌ Plage vide: {date_from} → {date_to}")
+    return [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+
+
+def date_blocks(days: list[str]) -> list[tuple[str, str]]:
+    """Jours triés → blocs contigus (date_from, date_to)"""
+    blocks = []
+    for day in sorted(days):
+        if blocks and date.fromisoformat(day) - date.fromisoformat(blocks[-1][1]) == timedelta(days=1):
+            blocks[-1] = (blocks[-1][0], day)
+        else:
+            blocks.append((day, day))
+    return blocks
+
+
+class Ledger:
+    """Registre {jour: {étape: {status, ...}}}, réécrit atomiquement à chaque changement de statut"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        self.days = json.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else {}
+
+    def status(self, day: str, stage: str) -> str | None:
+        return self.days.get(day, {}).get(stage, {}).get('status')
+
+    def pending(self, days: list[str], stage: str, stages: list[str]) -> list[str]:
+        """Jours dont l'étape reste à faire et dont les étapes précédentes (de ce backfill) sont terminées"""
+        upstream = stages[:stages.index(stage)]
+        return [
+            day for day in days
+            if self.status(day, stage) != 'done' and all(self.status(day, s) == 'done' for s in upstream)
+        ]
+
+    def mark(self, days: list[str], stage: str, status: str, **info) -> None:
+        entry = {'status': status, 'run_id': RUN_ID, 'updated_at_utc': datetime.now(timezone.utc).isoformat(), **info}
+        with self.lock:
+            for day in days:
+                self.days.setdefault(day, {})[stage] = entry
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(self.days, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+def attempt(ledger: Ledger, stage: str, days: list[str], call) -> bool:
+    """Exécute call() pour ces jours et consigne le résultat dans le registre"""
+    label = days[0] if len(days) == 1 else f"{days[0]} → {days[-1]}"
+    ledger.mark(days, stage, 'running')
+    started = time.monotonic()
+    try:
+        stats = call()
+    except Exception as e:
+        ledger.mark(days, stage, 'failed', error=f"{type(e).__name__}: {e}")
+        print(f"❌ {stage} [{label}]: {e}")
+        return False
+    seconds = round(time.monotonic() - started, 1)
+    ledger.mark(days, stage, 'done', seconds=seconds, stats=stats or {})
+    print(f"✅ {stage} [{label}] en {seconds}s")
+    return True
+
+
+def run_days(ledger: Ledger, stage: str, days: list[str], fn, parallel: int) -> list[str]:
+    """fn(jour) pour chaque jour, au plus `parallel` à la fois ; renvoie les jours en échec"""
+    with metrics.ThreadPoolExecutor(max_workers=max(1, parallel)) as pool:
+        ok = list(pool.map(lambda day: attempt(ledger, stage, [day], lambda: fn(day)), days))
+    return [day for day, success in zip(days, ok) if not success]
+
+
+def run_blocks(ledger: Ledger, stage: str, days: list[str], fn) -> list[str]:
+    """fn(date_from, date_to) une fois par bloc de jours contigus ; renvoie les jours en échec"""
+    failed = []
+    for start, end in date_blocks(days):
+        block = [day for day in days if start <= day <= end]
+        if not attempt(ledger, stage, block, lambda: fn(start, end)):
+            failed.extend(block)
+    return failed
+
+
+def stage_module(name: str, config: dict):
+    """Module d'une étape chargé avec sa config ; les threads du backfill appellent ensuite ses fonctions"""
+    with task_env(config):
+        return load_module(name)
+
+
+# --- étapes -------------------------------------------------------------------
+
+def run_load(ledger: Ledger, days: list[str]) -> list[str]:
+    # le parallélisme vient des jours : pas de pool de processus de parsing par jour par défaut
+    load = stage_module('load_raw_to_postgres', {'RUN_ID': RUN_ID, 'LOAD_WORKERS': os.getenv('LOAD_WORKERS', '1')})
+    pool = ThreadedConnectionPool(
+        1, max(1, BACKFILL_LOAD_PARALLEL),
+        host=load.PG_HOST, port=load.PG_PORT, dbname=load.PG_DB, user=load.PG_USER, password=load.PG_PASSWORD,
+    )
+
+    def in_transaction(fn):
+        conn = pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    return fn(cur)
+        finally:
+            pool.putconn(conn)
+
+    try:
+        # DDL une seule fois avant les chargements parallèles
+        in_transaction(lambda cur: load.ensure_range_partitions(cur, days[0], days[-1]))
+        return run_days(
+            ledger, 'load', days,
+            lambda day: in_transaction(lambda cur: load.load_snapshot(cur, day, 'all')),
+            BACKFILL_LOAD_PARALLEL,
+        )
+    finally:
+        pool.closeall()
+
+
+def dbt_run(dbt_vars: dict) -> dict:
+    command = ['dbt', 'run', '--vars', json.dumps(dbt_vars)]
+    print(f"🛠️  {' '.join(command)}")
+    subprocess.run(command, cwd=DBT_PROJECT_DIR, check=True)
+    return {}
+
+
+def run_dbt(ledger: Ledger, days: list[str]) -> list[str]:
+    # modèles incrémentaux delete+insert : jamais deux dbt run en parallèle
+    if BACKFILL_DBT_MODE == 'date':
+        return run_days(ledger, 'dbt', days, lambda day: dbt_run({'snapshot_date': day}), 1)
+    return run_blocks(ledger, 'dbt', days, lambda start, end: dbt_run({'date_from': start, 'date_to': end}))
+
+
+def run_export(ledger: Ledger, days: list[str]) -> list[str]:
+    return run_blocks(
+        ledger, 'export', days,
+        lambda start, end: run_module(
+            'export_to_parquet', {'SNAPSHOT_DATE': end, 'EXPORT_DATE_FROM': start, 'EXPORT_DATE_TO': end}
+        ),
+    )
+
+
+def run_index(ledger: Ledger, days: list[str]) -> list[str]:
+    # une session keep-alive partagée par tous les jours indexés en parallèle
+    pool_size = int(os.getenv('ES_BULK_WORKERS', '4')) * max(1, BACKFILL_INDEX_PARALLEL)
+    index = stage_module('index_elasticsearch', {'ES_POOL_SIZE': os.getenv('ES_POOL_SIZE') or str(pool_size)})
+    index.es_ok()
+    index.create_indices(index.ES_TARGETS)
+
+    if index.ES_INDEX_MODE == 'versioned':
+        return run_days(ledger, 'index', days, lambda day: dict(index.index_range(day, day)), BACKFILL_INDEX_PARALLEL)
+    return run_blocks(ledger, 'index', days, lambda start, end: dict(index.index_range(start, end)))
+
+
+RUNNERS = {'load': run_load, 'dbt': run_dbt, 'export': run_export, 'index': run_index}
+
+
+@metrics.instrumented('backfill')
+def main(date_from: str | None = None, date_to: str | None = None):
+    date_from = date_from or BACKFILL_DATE_FROM
+    date_to = date_to or BACKFILL_DATE_TO or date_from
+    if not date_from:
+        raise RuntimeError("❌ Plage manquante : BACKFILL_DATE_FROM / BACKFILL_DATE_TO (ou arguments)")
+
+    unknown = [s for s in BACKFILL_STAGES if s not in RUNNERS]
+    if unknown:
+        raise ValueError(f"❌ Étapes inconnues: {unknown} (attendu: {', '.join(STAGES)})")
+    stages = [s for s in STAGES if s in BACKFILL_STAGES]
+
+    days = day_range(date_from, date_to)
+    ledger = Ledger(BACKFILL_LEDGER or DATALAKE_PATH / '_state' / 'backfill' / f'{date_from}_{date_to}.json')
+
+    print(f"⏪ BACKFILL {date_from} → {date_to} | {len(days)} jours | étapes: {', '.join(stages)} | run_id={RUN_ID}")
+    print(f"Registre: {ledger.path}")
+    print(f"Parallélisme: load={BACKFILL_LOAD_PARALLEL} jours | index={BACKFILL_INDEX_PARALLEL} jours | dbt={BACKFILL_DBT_MODE}")
+
+    failed = {}
+    for stage in stages:
+        todo = ledger.pending(days, stage, stages)
+        done = sum(ledger.status(day, stage) == 'done' for day in days)
+        blocked = len(days) - done - len(todo)
+        print(f"\n▶️  {stage}: {len(todo)} jours à traiter | {done} déjà faits | {blocked} bloqués par une étape précédente")
+        if todo:
+            failed[stage] = RUNNERS[stage](ledger, todo)
+
+    print("\n" + "=" * 50)
+    for stage in stages:
+        done = sum(ledger.status(day, stage) == 'done' for day in days)
+        print(f"   {stage:<7} {done}/{len(days)} jours terminés")
+    print("=" * 50)
+
+    failures = {stage: missed for stage, missed in failed.items() if missed}
+    if failures:
+        detail = ', '.join(f"{stage} ({len(missed)} jours, ex. {missed[0]})" for stage, missed in failures.items())
+        raise RuntimeError(f"❌ Backfill incomplet: {detail} — relancer pour reprendre")
+    print("🎉 BACKFILL terminé")
+
+
+def run(config: dict | None = None):
+    """Backfill lancé depuis une tâche Airflow : config = BACKFILL_DATE_FROM / BACKFILL_DATE_TO, BACKFILL_STAGES"""
+    return run_module(__name__, config)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
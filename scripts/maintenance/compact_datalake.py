@@ -0,0 +1,181 @@
+"""
+Compaction du datalake (formatted + usage) et rétention de la zone raw
+
+- partitions quotidiennes snapshot_date=YYYY-MM-DD/ d'un mois terminé
+  → un fichier mensuel snapshot_month=YYYY-MM/data.parquet (snapshot_date conservé en colonne)
+- écriture dans un .tmp puis rename atomique, suppression des partitions quotidiennes ensuite
+- zone raw : suppression des dossiers date=... plus anciens que RAW_RETENTION_DAYS
+"""
+
+import os
+import sys
+import shutil
+from pathlib import Path
+from datetime import date, datetime, timedelta
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # scripts/ (modules communs)
+from common import metrics
+from common.parquet_profiles import SORT_KEYS, TABLE_SCHEMAS, BufferedParquetWriter, get_profile
+from common.task_runner import run_module
+
+
+DATALAKE_PATH = Path(os.getenv('OUTPUT_DIR', '/opt/airflow/datalake'))
+SNAPSHOT_DATE = os.getenv('SNAPSHOT_DATE') or datetime.now().strftime('%Y-%m-%d')
+
+# un mois est compacté quand son dernier jour a plus de COMPACT_LAG_DAYS jours (relances tardives)
+COMPACT_LAG_DAYS = int(os.getenv('COMPACT_LAG_DAYS', '7'))
+COMPACT_ROW_GROUP_SIZE = int(os.getenv('COMPACT_ROW_GROUP_SIZE', str(256 * 1024)))
+
+# 0 = pas de rétention sur la zone raw
+RAW_RETENTION_DAYS = int(os.getenv('RAW_RETENTION_DAYS', '0'))
+
+LAYERS = ('formatted', 'usage')
+
+
+def month_end(month: date) -> date:
+    nxt = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return nxt - timedelta(days=1)
+
+
+def daily_partitions(table_dir: Path) -> dict[date, Path]:
+    parts = {}
+    for p in table_dir.glob('snapshot_date=*'):
+        if p.is_dir() and (p / 'data.parquet').exists():
+            parts[date.fromisoformat(p.name.split('=', 1)[1])] = p
+    return parts
+
+
+def read_day(path: Path, day: date, schema: pa.Schema | None) -> pa.Table:
+    """Lignes d'un seul snapshot (les anciens exports contenaient tout l'historique)"""
+    with metrics.span('parquet_read') as s:
+        table = pq.read_table(path, filters=[('snapshot_date', '=', day)])
+        s.add(rows=table.num_rows)
+    if schema is not None:
+        table = table.select([n for n in schema.names if n in table.column_names])
+        table = table.cast(pa.schema([schema.field(n) for n in table.column_names]))
+    return table
+
+
+def compact_month(table_dir: Path, month: date, days: dict[date, Path]) -> int:
+    """Fusionne les partitions quotidiennes (et un éventuel fichier mensuel existant) d'un mois"""
+    name = table_dir.name
+    schema = TABLE_SCHEMAS.get(name)
+    sort_keys = SORT_KEYS.get(name, ['snapshot_date'])
+
+    month_dir = table_dir / f'snapshot_month={month:%Y-%m}'
+    output_path = month_dir / 'data.parquet'
+    tmp_path = month_dir / '.data.parquet.tmp'
+
+    # jours déjà compactés, sauf ceux réexportés depuis (la partition quotidienne fait foi)
+    sources = {day: path / 'data.parquet' for day, path in days.items()}
+    if output_path.exists():
+        existing = pq.read_table(output_path, columns=['snapshot_date'])
+        for day in pc.unique(existing['snapshot_date']).to_pylist():
+            sources.setdefault(day, output_path)
+
+    month_dir.mkdir(parents=True, exist_ok=True)
+    profile = dict(get_profile(), row_group_size=COMPACT_ROW_GROUP_SIZE, sort_keys=sort_keys)
+
+    writer = None
+    rows = 0
+    try:
+        for day in sorted(sources):
+            table = read_day(sources[day], day, schema)
+            if table.num_rows == 0:
+                continue
+            table = table.sort_by([(k, 'ascending') for k in sort_keys if k in table.column_names])
+            if writer is None:
+                file_schema = table.schema
+                writer = BufferedParquetWriter(tmp_path, file_schema, profile)
+            else:
+                table = table.select(file_schema.names).cast(file_schema)
+            for batch in table.to_batches():
+                writer.write_batch(batch)
+            rows += table.num_rows
+
+        if writer is None:
+            return 0
+        writer.close()
+        writer = None
+        os.replace(tmp_path, output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+            tmp_path.unlink(missing_ok=True)
+
+    # le fichier mensuel est en place : les partitions quotidiennes peuvent disparaître
+    for path in days.values():
+        shutil.rmtree(path)
+
+    return rows
+
+
+def compact_table(table_dir: Path, today: date) -> None:
+    parts = daily_partitions(table_dir)
+    by_month: dict[date, dict[date, Path]] = {}
+    for day, path in parts.items():
+        by_month.setdefault(day.replace(day=1), {})[day] = path
+
+    for month, days in sorted(by_month.items()):
+        if month_end(month) + timedelta(days=COMPACT_LAG_DAYS) >= today:
+            continue
+        rows = compact_month(table_dir, month, days)
+        print(f"   ✅ {table_dir.name} {month:%Y-%m}: {len(days)} partitions → 1 fichier ({rows} lignes)")
+
+
+def apply_raw_retention(raw_dir: Path, today: date) -> int:
+    """Supprime les dossiers date=YYYY-MM-DD de la zone raw plus anciens que RAW_RETENTION_DAYS"""
+    if RAW_RETENTION_DAYS <= 0 or not raw_dir.exists():
+        return 0
+
+    cutoff = today - timedelta(days=RAW_RETENTION_DAYS)
+    removed = 0
+    # liste figée avant suppression : rglob ne doit pas parcourir un arbre qu'on modifie
+    for path in sorted(raw_dir.rglob('date=*')):
+        if not path.is_dir():  # aussi vrai si un dossier parent vient d'être supprimé
+            continue
+        try:
+            day = date.fromisoformat(path.name.split('=', 1)[1])
+        except ValueError:
+            continue
+        if day < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+@metrics.instrumented('compact_datalake')
+def main():
+    """Compaction mensuelle + rétention raw"""
+
+    today = date.fromisoformat(SNAPSHOT_DATE)
+    print(f"\n COMPACTION DATALAKE - {SNAPSHOT_DATE}\n")
+    print(f" Datalake path: {DATALAKE_PATH.absolute()}")
+    print(f" Délai avant compaction: {COMPACT_LAG_DAYS} jours | row groups: {COMPACT_ROW_GROUP_SIZE}\n")
+
+    for layer in LAYERS:
+        layer_dir = DATALAKE_PATH / layer
+        if not layer_dir.exists():
+            continue
+        print(f" {layer.upper()}")
+        print("=" * 50)
+        for table_dir in sorted(p for p in layer_dir.iterdir() if p.is_dir()):
+            compact_table(table_dir, today)
+
+    removed = apply_raw_retention(DATALAKE_PATH / 'raw', today)
+    if RAW_RETENTION_DAYS > 0:
+        print(f"\n🗑️  Rétention raw ({RAW_RETENTION_DAYS} jours): {removed} dossiers supprimés")
+
+    print("\n🎉 COMPACTION TERMINÉE")
+
+
+def run(config: dict | None = None):
+    """Tâche Airflow : config = SNAPSHOT_DATE, OUTPUT_DIR, RAW_RETENTION_DAYS"""
+    return run_module(__name__, config)
+
+
+if __name__ == '__main__':
+    main()
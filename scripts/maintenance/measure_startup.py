@@ -0,0 +1,96 @@
+"""
+Coût de démarrage d'une tâche : sous-processus `python script.py` vs appel in-process
+
+- sous-processus : nouvel interpréteur qui importe le module (ce que payait chaque BashOperator)
+- fork : processus forké depuis ce processus (qui n'a importé ni pandas, ni pyarrow, ni psycopg2),
+  qui importe le module comme run(config) le fait dans une tâche Airflow. Avec le LocalExecutor,
+  chaque tâche est un fork neuf du worker : les imports du script sont payés à chaque tâche,
+  seul le démarrage de l'interpréteur (et de site) est économisé.
+- STARTUP_PRELOAD=airflow : importe airflow avant de forker, comme le worker du LocalExecutor
+main() n'est pas appelé : seuls l'interpréteur, les imports et la configuration sont mesurés.
+
+    python scripts/maintenance/measure_startup.py
+    STARTUP_REPEAT=10 STARTUP_PRELOAD=airflow python scripts/maintenance/measure_startup.py
+"""
+
+import os
+import sys
+import time
+import importlib
+import statistics
+import subprocess
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(SCRIPTS_DIR))
+from common.task_runner import load_module, task_env
+
+STARTUP_REPEAT = int(os.getenv('STARTUP_REPEAT', '5'))
+STARTUP_PRELOAD = [m for m in os.getenv('STARTUP_PRELOAD', '').split(',') if m]
+
+SCRIPTS = (
+    'ingest/fetch_tmdb',
+    'ingest/fetch_omdb',
+    'load/load_raw_to_postgres',
+    'export/export_to_parquet',
+    'index/index_elasticsearch',
+    'maintenance/compact_datalake',
+)
+
+# clés factices : les scripts d'ingestion refusent de se charger sans clé d'API
+CONFIG = {
+    'TMDB_API_KEY': os.getenv('TMDB_API_KEY', 'dummy'),
+    'OMDB_API_KEY': os.getenv('OMDB_API_KEY', 'dummy'),
+}
+
+
+def split(script: str) -> tuple[Path, str]:
+    directory, name = script.rsplit('/', 1)
+    return SCRIPTS_DIR / directory, name
+
+
+def cold_start(script: str) -> float:
+    directory, name = split(script)
+    code = f"import sys; sys.path[:0] = [{str(directory)!r}, {str(SCRIPTS_DIR)!r}]; import {name}"
+    env = {**os.environ, **CONFIG}
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def fork_start(script: str) -> float:
+    """fork + import du module dans l'enfant ; le parent reste sans les imports du script"""
+    directory, name = split(script)
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            sys.path.insert(0, str(directory))
+            sys.stdout = open(os.devnull, 'w')
+            with task_env(CONFIG):
+                load_module(name)
+            status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    if status != 0:
+        raise RuntimeError(f"❌ Import de {script} en échec dans le fork")
+    return time.perf_counter() - started
+
+
+def main():
+    for module in STARTUP_PRELOAD:
+        importlib.import_module(module)
+    preload = f" | préchargés: {', '.join(STARTUP_PRELOAD)}" if STARTUP_PRELOAD else ""
+    print(f"⏱️  Démarrage des scripts | python={sys.executable} | médiane sur {STARTUP_REPEAT} essais{preload}")
+    print(f"{'script':<32} {'sous-processus':>15} {'fork':>10} {'économisé':>10}")
+
+    for script in SCRIPTS:
+        cold = statistics.median(cold_start(script) for _ in range(STARTUP_REPEAT))
+        forked = statistics.median(fork_start(script) for _ in range(STARTUP_REPEAT))
+        print(f"{script:<32} {cold * 1000:>12.0f} ms {forked * 1000:>7.0f} ms {(cold - forked) * 1000:>7.0f} ms")
+
+
+if __name__ == '__main__':
+    main()